@@ -9,7 +9,8 @@ from juntagrico_billing.admin.businessyear import BusinessYearAdmin
 from juntagrico_billing.admin.payment import PaymentAdmin, PaymentTypeAdmin
 from juntagrico_billing.models.account import MemberAccount, SubscriptionTypeAccount
 from juntagrico_billing.models.bill import Bill, BillItemType, BusinessYear
-from juntagrico_billing.models.payment import Payment, PaymentType
+from juntagrico_billing.models.notification import BillNotification
+from juntagrico_billing.models.payment import Payment, PaymentType, PaymentUpload
 from juntagrico_billing.models.settings import Settings
 
 
@@ -42,9 +43,21 @@ class BillItemTypeAdmin(admin.ModelAdmin):
     pass
 
 
+class BillNotificationAdmin(admin.ModelAdmin):
+    raw_id_fields = ['bill']
+    list_display = ['bill', 'created', 'claimed', 'sent', 'attempts', 'error']
+
+
+class PaymentUploadAdmin(admin.ModelAdmin):
+    exclude = ['content']
+    list_display = ['name', 'uploaded', 'processed', 'status', 'imported_count', 'skipped_count']
+
+
 admin.site.register(Settings, SettingsAdmin)
 admin.site.register(Bill, BillAdmin)
 admin.site.register(Payment, PaymentAdmin)
 admin.site.register(PaymentType, PaymentTypeAdmin)
 admin.site.register(BusinessYear, BusinessYearAdmin)
 admin.site.register(BillItemType, BillItemTypeAdmin)
+admin.site.register(BillNotification, BillNotificationAdmin)
+admin.site.register(PaymentUpload, PaymentUploadAdmin)
@@ -2,11 +2,17 @@ from django.utils.translation import gettext as _
 from django.urls import reverse
 from django.utils.html import mark_safe
 from django.contrib.admin import display, SimpleListFilter
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.messages import success
+from django.db.models import prefetch_related_objects
 from juntagrico.admins import BaseAdmin
 
 from juntagrico_billing.admin.billitem_inline import BillItemInline
 from juntagrico_billing.admin.payment_inline import PaymentInline
-from juntagrico_billing.util.billing import recalc_bill, publish_bills, update_vat, add_balancing_payment
+from juntagrico_billing.querysets.bill import display_data_prefetches
+from juntagrico_billing.util.bill_totals import deferred_bill_totals
+from juntagrico_billing.util.billing import publish_bills, update_vat, add_balancing_payments
+from juntagrico_billing.util.recalc import recalc_bills
 
 
 def set_notification_sent(modeladmin, request, queryset):
@@ -24,38 +30,44 @@ reset_notification_sent.short_description = _("Reset flag for 'notification sent
 
 
 def do_recalc_bill(modeladmin, request, queryset):
-    for bill in queryset.all():
-        recalc_bill(bill)
+    changes = recalc_bills(queryset.select_related('business_year'))
+    count = len([bill_changes for bill_changes in changes if bill_changes.items_changed])
+    success(request, _('%d bills recalculated.') % count)
 
 
 do_recalc_bill.short_description = _("Recalculate bills")
 
 
 def do_publish_bills(modeladmin, request, queryset):
-    bill_ids = [bill.id for bill in queryset.all()]
-    publish_bills(bill_ids)
+    count = publish_bills(queryset.values('id'))
+    success(request, _('%d bills published.') % count)
 
 
 do_publish_bills.short_description = _("Publish bills")
 
 
 def do_update_vat(modeladmin, request, queryset):
-    for bill in queryset.all():
-        update_vat(bill)
+    count = update_vat(queryset)
+    success(request, _('VAT updated on %d bills.') % count)
 
 
 do_update_vat.short_description = _("Update VAT (from settings)")
 
 
 def do_add_balancing_payment(modeladmin, request, queryset):
-    for bill in queryset.all():
-        add_balancing_payment(request, bill)
+    count = add_balancing_payments(request, queryset)
+    if count:
+        success(request, _('%d bills balanced.') % count)
 
 
 do_add_balancing_payment.short_description = _("Balance bill with compensation payment")
 
 
 class OpenAmountFilter(SimpleListFilter):
+    """
+    filter on the open amount stored on the bill,
+    maintained by the bill totals lifecycle (see util.bill_totals).
+    """
     title = _('Open amount')
     parameter_name = 'open_amount_filter'
 
@@ -67,11 +79,22 @@ class OpenAmountFilter(SimpleListFilter):
 
     def queryset(self, request, queryset):
         if self.value() == 'open':
-            return [obj for obj in queryset.all() if obj.amount_open > 0]
+            return queryset.filter(amount_open__gt=0)
         if self.value() == 'overpaid':
-            objects = [obj for obj in queryset.all() if obj.amount_open < 0]
-            print("%d objects" % len(objects))
-            return queryset.filter(id__in=[obj.id for obj in objects])
+            return queryset.filter(amount_open__lt=0)
+
+
+class BillChangeList(ChangeList):
+    def get_results(self, request):
+        """
+        prefetch the items of the bills on the page, so the list columns
+        don't need queries per bill.
+        the prefetch is not done on the queryset, as bills changed
+        by actions must not read their items from a stale prefetch cache.
+        """
+        super().get_results(request)
+        self.result_list = list(self.result_list)
+        prefetch_related_objects(self.result_list, *display_data_prefetches())
 
 
 class BillAdmin(BaseAdmin):
@@ -79,6 +102,7 @@ class BillAdmin(BaseAdmin):
     list_display = [
         'id', 'business_year', 'member', 'bill_date', 'item_kinds',
         'amount_f', 'amount_open_f', 'paid', 'published', 'user_bill_link']
+    list_select_related = ['member', 'business_year']
     list_filter = ['paid', 'published', 'notification_sent', 'business_year', OpenAmountFilter]
     readonly_fields = ['vat_rate', 'vat_amount', 'amount_paid', 'amount_open']
     inlines = [BillItemInline, PaymentInline, ]
@@ -86,11 +110,23 @@ class BillAdmin(BaseAdmin):
         do_recalc_bill, do_publish_bills, set_notification_sent,
         reset_notification_sent, do_update_vat, do_add_balancing_payment]
 
-    @display(description=_('Amount'))
+    def get_changelist(self, request, **kwargs):
+        return BillChangeList
+
+    def changeform_view(self, *args, **kwargs):
+        # recompute the bill totals once after saving all items and payments
+        with deferred_bill_totals():
+            return super().changeform_view(*args, **kwargs)
+
+    def delete_queryset(self, request, queryset):
+        with deferred_bill_totals():
+            super().delete_queryset(request, queryset)
+
+    @display(description=_('Amount'), ordering='amount')
     def amount_f(self, bill):
         return f'{bill.amount:8.2f}'
 
-    @display(description=_('Amount open'))
+    @display(description=_('Amount open'), ordering='amount_open')
     def amount_open_f(self, bill):
         return f'{bill.amount_open:8.2f}'
 
@@ -1,5 +1,40 @@
+from datetime import date
+
+from django.contrib.admin import display
+from django.contrib.messages import error, success
+from django.utils.translation import gettext as _
 from juntagrico.admins import BaseAdmin
 
+from juntagrico_billing.util.closing import close_business_year, reopen_business_year
+
+
+def do_close_business_years(modeladmin, request, queryset):
+    for business_year in queryset.order_by('start_date'):
+        if business_year.end_date >= date.today():
+            error(request, _('Business year {} has not ended yet.').format(business_year))
+            continue
+        close_business_year(business_year)
+        success(request, _('Business year {} closed.').format(business_year))
+
+
+do_close_business_years.short_description = _("Close business years")
+
+
+def do_reopen_business_years(modeladmin, request, queryset):
+    for business_year in queryset.all():
+        reopen_business_year(business_year)
+
+
+do_reopen_business_years.short_description = _("Reopen business years")
+
 
 class BusinessYearAdmin(BaseAdmin):
-    list_display = ['name', 'start_date']
+    list_display = ['name', 'start_date', 'closed']
+    list_select_related = ['closing']
+    actions = [do_close_business_years, do_reopen_business_years]
+
+    @display(description=_('Closed'))
+    def closed(self, obj):
+        if hasattr(obj, 'closing'):
+            return obj.closing.closed
+        return None
@@ -0,0 +1,15 @@
+from juntagrico_billing.util.billing import booking_changed, earliest_date, invalidate_memberbalances
+from juntagrico_billing.util.summaries import invalidate_summaries
+
+
+def bill_saved(instance, **kwargs):
+    """
+    called on save or delete of a bill
+    invalidate the member balance snapshots from the booking date on
+    (the old one, if it was earlier) and the cached summaries,
+    unless only fields not affecting the balances changed.
+    """
+    if not booking_changed(instance, ('booking_date', 'amount', 'member_id'), **kwargs):
+        return
+    invalidate_memberbalances(earliest_date(instance, 'booking_date'))
+    invalidate_summaries()
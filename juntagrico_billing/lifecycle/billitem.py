@@ -1,10 +1,13 @@
+from juntagrico_billing.util.bill_totals import bill_changed
+from juntagrico_billing.util.billing import booking_changed
+
+
 def billitem_saved(instance, **kwargs):
     """
-    called on save of a bill-item
-    adjust the total amount of the bill
+    called on save or delete of a bill-item
+    recompute the total amount of the bill,
+    unless only fields not affecting the amount changed.
     """
-    bill = instance.bill
-    total_amount = sum([item.amount for item in bill.items.all()])
-    if bill.amount != total_amount:
-        bill.amount = total_amount
-        bill.save()
+    if not booking_changed(instance, ('amount', 'bill_id'), **kwargs):
+        return
+    bill_changed(instance)
@@ -1,11 +1,17 @@
+from juntagrico_billing.util.bill_totals import bill_changed
+from juntagrico_billing.util.billing import booking_changed, earliest_date
+
+
 def payment_saved(instance, **kwargs):
     """
-    called on save of a payment
+    called on save or delete of a payment
+    update the paid and open amount of the bill,
     check if full amount of bill reached
-    and mark the bill as paid
+    and mark the bill as paid.
+    the snapshots are invalidated from the payment date
+    (the old one, if it was earlier).
+    nothing is done, if only fields not affecting the balances changed.
     """
-    bill = instance.bill
-    total_paid = sum((p.amount for p in bill.payments.all()))
-    if total_paid >= bill.amount:
-        bill.paid = True
-        bill.save()
+    if not booking_changed(instance, ('paid_date', 'amount', 'bill_id'), **kwargs):
+        return
+    bill_changed(instance, earliest_date(instance, 'paid_date'), payment=True)
@@ -0,0 +1,9 @@
+from juntagrico_billing.util.summaries import invalidate_summaries
+
+
+def share_saved(instance, **kwargs):
+    """
+    called on save or delete of a share
+    invalidate the cached summaries.
+    """
+    invalidate_summaries()
@@ -0,0 +1,10 @@
+from juntagrico_billing.util.pricing import invalidate_price_tables
+
+
+def subscriptiontype_saved(instance, **kwargs):
+    """
+    called on save or delete of a subscription type
+    or one of its billing periods.
+    invalidate the cached price tables.
+    """
+    invalidate_price_tables()
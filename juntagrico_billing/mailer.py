@@ -1,16 +1,31 @@
+import time
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.db import transaction
 from django.template.loader import get_template
+from django.utils import timezone
 from django.utils.translation import gettext as _
 from juntagrico.config import Config
 from juntagrico.mailer import EmailSender, organisation_subject, base_dict
 
+from juntagrico_billing.models.bill import Bill
+from juntagrico_billing.models.notification import BillNotification
 from juntagrico_billing.models.settings import Settings
 from juntagrico_billing.util.qrbill import is_qr_iban
 
+# number of attempts for sending a queued notification
+MAX_ATTEMPTS = 3
+
+# notifications claimed by a run that was interrupted
+# are sent again after this time
+CLAIM_TIMEOUT = timedelta(hours=1)
+
 
-def send_bill_notification(bill):
+def send_bill_notification(bill, settings=None, template=None, connection=None):
     # prepare variables that are passed to
     # template using locals()
-    settings = Settings.objects.first()
+    settings = settings or Settings.objects.first()
     payment_type = settings.default_paymenttype
     business_year = bill.business_year
     member = bill.member
@@ -18,7 +33,7 @@ def send_bill_notification(bill):
     end_date = business_year.end_date
     show_refnumber = is_qr_iban(payment_type.iban)
 
-    template = get_template('jb/mails/bill_notification.txt')
+    template = template or get_template('jb/mails/bill_notification.txt')
     render_dict = base_dict(locals())
 
     # render template
@@ -26,4 +41,109 @@ def send_bill_notification(bill):
 
     subject = organisation_subject(_('{0} Bill').format(Config.vocabulary('subscription')))
 
-    EmailSender.get_sender(subject, content).send_to(member.email)
+    sender = EmailSender.get_sender(subject, content)
+    # reuse the connection of the caller, if any
+    sender.email.connection = connection
+    sender.send_to(member.email)
+
+
+def queue_bill_notifications(bills):
+    """
+    queue notification e-mails for the given bills.
+    bills with a notification pending already are skipped.
+    returns the number of queued notifications.
+    """
+    pending = BillNotification.objects.pending(MAX_ATTEMPTS)
+    bill_ids = bills.exclude(notifications__in=pending).values_list('id', flat=True)
+
+    notifications = BillNotification.objects.bulk_create(
+        [BillNotification(bill_id=bill_id) for bill_id in bill_ids])
+    return len(notifications)
+
+
+def claim_notifications(max_attempts, last_id, batch_size):
+    """
+    claim the next batch of pending notifications for sending.
+    notifications claimed by a concurrent run are left out.
+    returns the ids of the examined notifications and the claimed notifications.
+    """
+    now = timezone.now()
+    expired = now - CLAIM_TIMEOUT
+    with transaction.atomic():
+        claimable = BillNotification.objects.pending(max_attempts).claimable(expired).filter(id__gt=last_id)
+        ids = list(claimable.select_for_update(skip_locked=True)
+                   .order_by('id').values_list('id', flat=True)[:batch_size])
+        # the claim is conditional, in case the database doesn't lock rows
+        BillNotification.objects.filter(id__in=ids).claimable(expired).update(claimed=now)
+
+    claimed = BillNotification.objects.filter(id__in=ids, claimed=now)\
+        .select_related('bill__member', 'bill__business_year').order_by('id')
+    return ids, list(claimed)
+
+
+def notification_failed(notification, error):
+    """
+    record a failed attempt, the notification is released for the next run.
+    """
+    notification.attempts += 1
+    notification.claimed = None
+    notification.error = str(error)
+    notification.save()
+
+
+def send_queued_notifications(batch_size=100, delay=0.0, max_attempts=MAX_ATTEMPTS):
+    """
+    send the queued bill notifications in batches.
+    each batch is claimed before sending, so concurrent runs don't send twice,
+    and all e-mails of a batch are sent over the same mail server connection.
+    failed notifications are retried on the next run until max_attempts is reached.
+    returns the number of sent and failed notifications.
+    """
+    settings = Settings.objects.first()
+    template = get_template('jb/mails/bill_notification.txt')
+
+    sent = 0
+    failed = 0
+    last_id = 0
+    while True:
+        # every notification is tried at most once per run
+        ids, batch = claim_notifications(max_attempts, last_id, batch_size)
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        try:
+            connection = get_connection()
+            connection.open()
+        except Exception as e:
+            # mail server not reachable, the whole batch failed
+            for notification in batch:
+                notification_failed(notification, e)
+            failed += len(batch)
+            continue
+
+        try:
+            for notification in batch:
+                try:
+                    send_bill_notification(notification.bill, settings, template, connection)
+                except Exception as e:
+                    notification_failed(notification, e)
+                    failed += 1
+                else:
+                    notification.attempts += 1
+                    notification.sent = timezone.now()
+                    notification.error = ''
+                    # mark every notification as sent right away,
+                    # so that an interrupted run doesn't send twice
+                    with transaction.atomic():
+                        notification.save()
+                        Bill.objects.filter(pk=notification.bill_id).update(notification_sent=True)
+                    sent += 1
+
+                # rate limiting
+                if delay:
+                    time.sleep(delay)
+        finally:
+            connection.close()
+
+    return sent, failed
@@ -0,0 +1,56 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from juntagrico_billing.models.bill import BusinessYear
+from juntagrico_billing.util.pdfbulk import iter_bills_merged, iter_bills_zip
+
+
+class Command(BaseCommand):
+    help = "Render all bills of a business year as PDFs into a ZIP archive or a single PDF for printing."
+
+    def add_arguments(self, parser):
+        parser.add_argument('year', help='name of the business year')
+        parser.add_argument('outfile', help='ZIP file (or PDF file with --merge) to write')
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='number of processes rendering bills in parallel (default: number of CPUs)')
+        parser.add_argument('--merge', action='store_true',
+                            help='write all bills into one PDF document instead of a ZIP archive. '
+                                 'the document is built in memory, use --batch-size for large numbers of bills')
+        parser.add_argument('--batch-size', type=int, default=0,
+                            help='with --merge, write PDF documents of this many bills each, '
+                                 'numbered outfile-1.pdf, outfile-2.pdf, ... (default: all bills in one document)')
+        parser.add_argument('--unpublished', action='store_true',
+                            help='include unpublished bills')
+
+    # entry point used by manage.py
+    def handle(self, *args, **options):
+        year = BusinessYear.objects.by_name(options['year'])
+        if year is None:
+            raise CommandError('Business year %s not found' % options['year'])
+
+        bills = year.bills.all()
+        if not options['unpublished']:
+            bills = bills.published()
+        bill_ids = list(bills.order_by('member__last_name', 'member__first_name', 'id').values_list('id', flat=True))
+        processes = max(options['processes'], 1)
+
+        start = time.perf_counter()
+        if options['merge']:
+            batch_size = options['batch_size'] or None
+            root, ext = os.path.splitext(options['outfile'])
+            for number, document in enumerate(iter_bills_merged(bill_ids, batch_size, processes), 1):
+                filename = '%s-%d%s' % (root, number, ext) if batch_size else options['outfile']
+                with open(filename, 'wb') as outfile:
+                    outfile.write(document)
+        else:
+            with open(options['outfile'], 'wb') as outfile:
+                for chunk in iter_bills_zip(bill_ids, processes):
+                    outfile.write(chunk)
+        duration = time.perf_counter() - start
+
+        # report throughput
+        rate = len(bill_ids) / duration if duration else 0.0
+        self.stdout.write('%d bills rendered in %.1fs with %d processes (%.1f bills/s, %.1f bills/s per process)' % (
+            len(bill_ids), duration, processes, rate, rate / processes))
@@ -0,0 +1,18 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from juntagrico_billing.util.payment_upload import process_payment_uploads
+
+
+class Command(BaseCommand):
+    help = "Import the uploaded payment files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=os.cpu_count() or 1,
+                            help='number of processes parsing files in parallel (default: number of CPUs)')
+
+    # entry point used by manage.py
+    def handle(self, *args, **options):
+        done, failed = process_payment_uploads(max(options['processes'], 1))
+        self.stdout.write('%d payment files imported, %d failed' % (done, failed))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from juntagrico_billing.models.bill import Bill
+from juntagrico_billing.util.billing import update_paid_amounts
+
+
+class Command(BaseCommand):
+    help = "Recalculate the paid and open amount of all bills from their payments."
+
+    # entry point used by manage.py
+    def handle(self, *args, **options):
+        count = update_paid_amounts(Bill.objects.all())
+        self.stdout.write('%d bills updated' % count)
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from juntagrico_billing.models.bill import BusinessYear
+from juntagrico_billing.util.recalc import recalc_business_year
+
+
+class Command(BaseCommand):
+    help = "Recalculate all bills of a business year from the current subscription parts."
+
+    def add_arguments(self, parser):
+        parser.add_argument('year', help='name of the business year')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report the bills that would change their amount')
+
+    # entry point used by manage.py
+    def handle(self, *args, **options):
+        year = BusinessYear.objects.by_name(options['year'])
+        if year is None:
+            raise CommandError('Business year %s not found' % options['year'])
+
+        changes = recalc_business_year(year, dry_run=options['dry_run'])
+
+        # report the bills with changed amounts
+        changed = [bill_changes for bill_changes in changes if bill_changes.amount_changed]
+        for bill_changes in changed:
+            self.stdout.write('Bill %d (%s): %.2f -> %.2f' % (
+                bill_changes.bill.id, bill_changes.bill.member,
+                bill_changes.old_amount, bill_changes.amount))
+
+        items_changed = len([bill_changes for bill_changes in changes if bill_changes.items_changed])
+        if options['dry_run']:
+            self.stdout.write('%d bills would be changed, %d with a changed amount' % (items_changed, len(changed)))
+        else:
+            self.stdout.write('%d bills changed, %d with a changed amount' % (items_changed, len(changed)))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from juntagrico_billing.mailer import send_queued_notifications, MAX_ATTEMPTS
+
+
+class Command(BaseCommand):
+    help = "Send the queued bill notification e-mails."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='number of e-mails sent over one mail server connection')
+        parser.add_argument('--delay', type=float, default=0.0,
+                            help='seconds to wait between two e-mails')
+        parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                            help='number of attempts for sending a notification')
+
+    # entry point used by manage.py
+    def handle(self, *args, **options):
+        sent, failed = send_queued_notifications(
+            options['batch_size'], options['delay'], options['max_attempts'])
+        self.stdout.write('%d notifications sent, %d failed' % (sent, failed))
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico_billing', '0006_alter_payment_paid_date'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='billitem',
+            index=models.Index(fields=['subscription_part', 'bill'], name='juntagrico__subscri_4344a9_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:56
+
+from django.db import migrations, models
+from django.db.models import F, FloatField, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def calc_paid_amounts(apps, schema_editor):
+    Bill = apps.get_model('juntagrico_billing', 'Bill')
+    Payment = apps.get_model('juntagrico_billing', 'Payment')
+
+    payments_sum = Payment.objects.filter(bill=OuterRef('pk'))\
+        .order_by().values('bill')\
+        .annotate(total=Sum('amount')).values('total')
+    amount_paid = Coalesce(Subquery(payments_sum, output_field=FloatField()), 0.0)
+
+    Bill.objects.update(
+        amount_paid=amount_paid,
+        amount_open=F('amount') - amount_paid)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico_billing', '0007_billitem_part_bill_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bill',
+            name='amount_open',
+            field=models.FloatField(db_index=True, default=0.0, verbose_name='Betrag offen'),
+        ),
+        migrations.AddField(
+            model_name='bill',
+            name='amount_paid',
+            field=models.FloatField(default=0.0, verbose_name='Betrag bezahlt'),
+        ),
+        migrations.RunPython(calc_paid_amounts, migrations.RunPython.noop),
+    ]
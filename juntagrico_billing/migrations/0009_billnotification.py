@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+import juntagrico.entity
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico_billing', '0008_bill_amount_paid_open'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BillNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Erstellt')),
+                ('sent', models.DateTimeField(blank=True, null=True, verbose_name='Gesendet')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Versuche')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Fehler')),
+                ('bill', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='juntagrico_billing.bill', verbose_name='Rechnung')),
+            ],
+            options={
+                'verbose_name': 'Rechnungs-Benachrichtigung',
+                'verbose_name_plural': 'Rechnungs-Benachrichtigungen',
+            },
+            bases=(models.Model, juntagrico.entity.OldHolder),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:06
+
+from django.db import migrations, models
+import juntagrico.entity
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico_billing', '0009_billnotification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentUpload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Dateiname')),
+                ('content', models.BinaryField(blank=True, null=True, verbose_name='Inhalt')),
+                ('skip_duplicates', models.BooleanField(default=False, verbose_name='Bereits importierte Zahlungen überspringen')),
+                ('uploaded', models.DateTimeField(auto_now_add=True, verbose_name='Hochgeladen')),
+                ('processed', models.DateTimeField(blank=True, null=True, verbose_name='Verarbeitet')),
+                ('status', models.CharField(choices=[('pending', 'Ausstehend'), ('processing', 'In Bearbeitung'), ('done', 'Importiert'), ('failed', 'Fehlgeschlagen')], default='pending', max_length=20, verbose_name='Status')),
+                ('imported_count', models.PositiveIntegerField(default=0, verbose_name='Importierte Zahlungen')),
+                ('skipped_count', models.PositiveIntegerField(default=0, verbose_name='Übersprungene Zahlungen')),
+                ('message', models.TextField(blank=True, default='', verbose_name='Meldung')),
+            ],
+            options={
+                'verbose_name': 'Zahlungsdatei',
+                'verbose_name_plural': 'Zahlungsdateien',
+            },
+            bases=(models.Model, juntagrico.entity.OldHolder),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:09
+
+from django.db import migrations, models
+import juntagrico.entity
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico_billing', '0010_paymentupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BexioLedgerEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('docnumber', models.CharField(max_length=50, unique=True, verbose_name='Belegnummer')),
+                ('bexio_id', models.PositiveIntegerField(verbose_name='Bexio-ID')),
+                ('booking_date', models.DateField(db_index=True, verbose_name='Buchungsdatum')),
+                ('content_hash', models.CharField(max_length=64, verbose_name='Inhalts-Hash')),
+                ('exported', models.DateTimeField(auto_now=True, verbose_name='Exportiert')),
+            ],
+            options={
+                'verbose_name': 'Bexio-Buchungseintrag',
+                'verbose_name_plural': 'Bexio-Buchungseinträge',
+            },
+            bases=(models.Model, juntagrico.entity.OldHolder),
+        ),
+    ]
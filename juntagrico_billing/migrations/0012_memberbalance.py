@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import juntagrico.entity
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico', '0041_1_7'),
+        ('juntagrico_billing', '0011_bexioledgerentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MemberBalance',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('keydate', models.DateField(db_index=True, verbose_name='Stichdatum')),
+                ('billed_amount', models.FloatField(default=0.0, verbose_name='Betrag verrechnet')),
+                ('billed_items_amount', models.FloatField(default=0.0, verbose_name='Betrag Rechnungspositionen')),
+                ('paid_amount', models.FloatField(default=0.0, verbose_name='Betrag bezahlt')),
+                ('balance', models.FloatField(default=0.0, verbose_name='Saldo')),
+                ('member', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='billing_balances', to='juntagrico.member', verbose_name='Mitglied')),
+            ],
+            options={
+                'verbose_name': 'Mitglieder-Saldo',
+                'verbose_name_plural': 'Mitglieder-Saldi',
+                'unique_together': {('keydate', 'member')},
+            },
+            bases=(models.Model, juntagrico.entity.OldHolder),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+import juntagrico.entity
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico_billing', '0012_memberbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='YearClosing',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('closed', models.DateTimeField(auto_now_add=True, verbose_name='Abgeschlossen')),
+                ('opening_billed', models.FloatField(default=0.0, verbose_name='Eröffnung Betrag verrechnet')),
+                ('opening_paid', models.FloatField(default=0.0, verbose_name='Eröffnung Betrag bezahlt')),
+                ('closing_billed', models.FloatField(default=0.0, verbose_name='Abschluss Betrag verrechnet')),
+                ('closing_paid', models.FloatField(default=0.0, verbose_name='Abschluss Betrag bezahlt')),
+                ('business_year', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='closing', to='juntagrico_billing.businessyear', verbose_name='Geschäftsjahr')),
+            ],
+            options={
+                'verbose_name': 'Geschäftsjahres-Abschluss',
+                'verbose_name_plural': 'Geschäftsjahres-Abschlüsse',
+            },
+            bases=(models.Model, juntagrico.entity.OldHolder),
+        ),
+        migrations.AddField(
+            model_name='memberbalance',
+            name='closing',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='juntagrico_billing.yearclosing', verbose_name='Geschäftsjahres-Abschluss'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico_billing', '0013_yearclosing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='billnotification',
+            name='claimed',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='In Bearbeitung seit'),
+        ),
+    ]
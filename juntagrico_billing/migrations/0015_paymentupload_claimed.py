@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico_billing', '0014_billnotification_claimed'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentupload',
+            name='claimed',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='In Bearbeitung seit'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:48
+
+from django.db import migrations, models
+import juntagrico.entity
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('juntagrico_billing', '0015_paymentupload_claimed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BexioSyncedRange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_date', models.DateField(blank=True, null=True, verbose_name='Von Datum')),
+                ('till_date', models.DateField(blank=True, null=True, verbose_name='Bis Datum')),
+                ('synced', models.DateTimeField(auto_now_add=True, verbose_name='Abgeglichen')),
+            ],
+            options={
+                'verbose_name': 'Mit Bexio abgeglichener Zeitraum',
+                'verbose_name_plural': 'Mit Bexio abgeglichene Zeiträume',
+            },
+            bases=(models.Model, juntagrico.entity.OldHolder),
+        ),
+    ]
@@ -1,11 +1,36 @@
 from django.db.models import signals
+from juntagrico.entity.billing import BillingPeriod
+from juntagrico.entity.share import Share
+from juntagrico.entity.subtypes import SubscriptionType
+from juntagrico.util.signals import set_old_state
 
-from .bill import BillItem
+from .bill import Bill, BillItem
 from .payment import Payment
+from .notification import BillNotification  # noqa: F401
+from .bexio import BexioLedgerEntry, BexioSyncedRange  # noqa: F401
+from .balance import MemberBalance, YearClosing  # noqa: F401
+from juntagrico_billing.lifecycle.bill import bill_saved
 from juntagrico_billing.lifecycle.payment import payment_saved
 from juntagrico_billing.lifecycle.billitem import billitem_saved
+from juntagrico_billing.lifecycle.share import share_saved
+from juntagrico_billing.lifecycle.subscriptiontype import subscriptiontype_saved
 
 # connect signals to lifecycle functions
 signals.post_save.connect(payment_saved, sender=Payment)
+signals.post_delete.connect(payment_saved, sender=Payment)
+signals.post_save.connect(bill_saved, sender=Bill)
+signals.post_delete.connect(bill_saved, sender=Bill)
 signals.post_save.connect(billitem_saved, sender=BillItem)
 signals.post_delete.connect(billitem_saved, sender=BillItem)
+signals.post_save.connect(subscriptiontype_saved, sender=SubscriptionType)
+signals.post_delete.connect(subscriptiontype_saved, sender=SubscriptionType)
+signals.post_save.connect(subscriptiontype_saved, sender=BillingPeriod)
+signals.post_delete.connect(subscriptiontype_saved, sender=BillingPeriod)
+signals.post_save.connect(share_saved, sender=Share)
+signals.post_delete.connect(share_saved, sender=Share)
+
+# keep the loaded state of bills, items and payments, so that the lifecycle functions
+# see the old values. connected after the lifecycle functions, which run first on save.
+for model in (Bill, BillItem, Payment):
+    signals.post_init.connect(set_old_state, sender=model)
+    signals.post_save.connect(set_old_state, sender=model)
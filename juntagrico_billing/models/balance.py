@@ -0,0 +1,62 @@
+from django.db import models
+from django.utils.translation import gettext as _
+from juntagrico.entity import JuntagricoBaseModel
+from juntagrico.entity.member import Member
+
+from juntagrico_billing.models.bill import BusinessYear
+from juntagrico_billing.querysets.balance import YearClosingQuerySet
+
+
+class YearClosing(JuntagricoBaseModel):
+    """
+    Closing of a business year.
+    Stores the totals billed and paid since the beginning
+    up to the start (opening) and the end (closing) of the year,
+    so summaries of later date ranges only need to sum up the bookings
+    after the closed year.
+    """
+    business_year = models.OneToOneField(BusinessYear, related_name='closing',
+                                         on_delete=models.CASCADE,
+                                         verbose_name=_('Business Year'))
+    closed = models.DateTimeField(_('Closed'), auto_now_add=True)
+    opening_billed = models.FloatField(_('Opening billed amount'), default=0.0)
+    opening_paid = models.FloatField(_('Opening paid amount'), default=0.0)
+    closing_billed = models.FloatField(_('Closing billed amount'), default=0.0)
+    closing_paid = models.FloatField(_('Closing paid amount'), default=0.0)
+
+    objects = YearClosingQuerySet.as_manager()
+
+    def __str__(self):
+        return str(self.business_year)
+
+    class Meta:
+        verbose_name = _('Business year closing')
+        verbose_name_plural = _('Business year closings')
+
+
+class MemberBalance(JuntagricoBaseModel):
+    """
+    Snapshot of the balance of a member at a key date.
+    Stored when exporting member balances, so repeated exports
+    of the same key date don't need to compute the balances again.
+    Snapshots are deleted when bills or payments before their key date change,
+    the snapshots of a business year closing together with the closing.
+    """
+    keydate = models.DateField(_('Key date'), db_index=True)
+    member = models.ForeignKey(Member, related_name='billing_balances',
+                               on_delete=models.CASCADE, verbose_name=_('Member'))
+    billed_amount = models.FloatField(_('Billed amount'), default=0.0)
+    billed_items_amount = models.FloatField(_('Billed items amount'), default=0.0)
+    paid_amount = models.FloatField(_('Paid amount'), default=0.0)
+    balance = models.FloatField(_('Balance'), default=0.0)
+    closing = models.ForeignKey(YearClosing, related_name='balances',
+                                null=True, blank=True, on_delete=models.CASCADE,
+                                verbose_name=_('Business year closing'))
+
+    def __str__(self):
+        return '{} {}'.format(self.member, self.keydate)
+
+    class Meta:
+        verbose_name = _('Member balance')
+        verbose_name_plural = _('Member balances')
+        unique_together = ('keydate', 'member')
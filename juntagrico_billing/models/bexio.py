@@ -0,0 +1,41 @@
+from django.db import models
+from django.utils.translation import gettext as _
+from juntagrico.entity import JuntagricoBaseModel
+
+
+class BexioLedgerEntry(JuntagricoBaseModel):
+    """
+    Booking exported to Bexio.
+    Records the id of the Bexio entry and a hash of the booking content,
+    so repeated exports only need to send the changes to Bexio.
+    """
+    docnumber = models.CharField(_('Document number'), max_length=50, unique=True)
+    bexio_id = models.PositiveIntegerField(_('Bexio id'))
+    booking_date = models.DateField(_('Booking date'), db_index=True)
+    content_hash = models.CharField(_('Content hash'), max_length=64)
+    exported = models.DateTimeField(_('Exported'), auto_now=True)
+
+    def __str__(self):
+        return self.docnumber
+
+    class Meta:
+        verbose_name = _('Bexio ledger entry')
+        verbose_name_plural = _('Bexio ledger entries')
+
+
+class BexioSyncedRange(JuntagricoBaseModel):
+    """
+    Date range, for which the ledger was reconciled with all the entries in Bexio.
+    The ledger is only used instead of the Bexio entries for date ranges it fully covers.
+    Open ends of the range are stored as null.
+    """
+    from_date = models.DateField(_('From date'), null=True, blank=True)
+    till_date = models.DateField(_('Till date'), null=True, blank=True)
+    synced = models.DateTimeField(_('Synced'), auto_now_add=True)
+
+    def __str__(self):
+        return '{} - {}'.format(self.from_date or '', self.till_date or '')
+
+    class Meta:
+        verbose_name = _('Bexio synced range')
+        verbose_name_plural = _('Bexio synced ranges')
@@ -61,21 +61,21 @@ class Bill(JuntagricoBaseModel):
     notification_sent = models.BooleanField(_('Notification sent'), null=False, blank=False, default=False)
     vat_rate = models.FloatField(_('VAT Rate'), null=False, blank=False, default=0.0)
 
-    objects = BillQuerySet.as_manager()
-
-    # derived properties
-    @property
-    def amount_paid(self):
-        return sum([p.amount for p in self.payments.all()])
-
-    amount_paid.fget.short_description = _('Amount paid')
+    # denormalized sum of payments, maintained by the payment lifecycle
+    amount_paid = models.FloatField(_('Amount paid'), null=False, blank=False, default=0.0)
+    amount_open = models.FloatField(_('Amount open'), null=False, blank=False, default=0.0, db_index=True)
 
-    @property
-    def amount_open(self):
-        return self.amount - self.amount_paid
+    objects = BillQuerySet.as_manager()
 
-    amount_open.fget.short_description = _('Amount open')
+    def save(self, *args, **kwargs):
+        """
+        save override to keep the open amount in sync
+        with amount and paid amount.
+        """
+        self.amount_open = self.amount - self.amount_paid
+        super().save(*args, **kwargs)
 
+    # derived properties
     @property
     def vat_amount(self):
         return sum([itm.vat_amount for itm in self.items.all()])
@@ -120,8 +120,8 @@ class Bill(JuntagricoBaseModel):
                     return (1, itm.id)
                 else:
                     return (0, itm.id)
-            elif itm.custom_item_type:
-                return (2, itm.custom_item_type.id, itm.id)
+            elif itm.custom_item_type_id:
+                return (2, itm.custom_item_type_id, itm.id)
             else:
                 # itm without reference (unexpected)
                 return (3, None)
@@ -241,16 +241,26 @@ class BillItem(JuntagricoBaseModel):
     class Meta:
         verbose_name = _('Bill item')
         verbose_name_plural = _('Bill items')
+        indexes = [
+            # lookup of billed subscription parts per bill
+            models.Index(fields=['subscription_part', 'bill']),
+        ]
 
     def save(self, *args, **kwargs):
         """
         save override to automatically recalculate the vat amount
         """
+        self.calc_vat_amount()
+
+        super().save(*args, **kwargs)
+
+    def calc_vat_amount(self):
+        """
+        calculate the vat amount based on the vat rate of the bill.
+        """
         # calc vat only for subscription_part items
         if self.bill and self.subscription_part:
             vat_rate = self.bill.vat_rate
             self.vat_amount = round(self.amount / (1 + vat_rate) * vat_rate, 2)
         else:
             self.vat_amount = 0.0
-
-        super().save(*args, **kwargs)
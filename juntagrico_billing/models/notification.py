@@ -0,0 +1,30 @@
+from django.db import models
+from django.utils.translation import gettext as _
+from juntagrico.entity import JuntagricoBaseModel
+
+from juntagrico_billing.querysets.notification import BillNotificationQuerySet
+
+
+class BillNotification(JuntagricoBaseModel):
+    """
+    Outbox entry for a bill notification e-mail.
+    Entries are queued by the bookkeeper and sent in batches
+    by the send_bill_notifications management command.
+    """
+    bill = models.ForeignKey('Bill', related_name='notifications',
+                             null=False, blank=False,
+                             on_delete=models.CASCADE, verbose_name=_('Bill'))
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+    claimed = models.DateTimeField(_('Claimed'), null=True, blank=True)
+    sent = models.DateTimeField(_('Sent'), null=True, blank=True)
+    attempts = models.PositiveIntegerField(_('Attempts'), default=0)
+    error = models.TextField(_('Error'), blank=True, default='')
+
+    objects = BillNotificationQuerySet.as_manager()
+
+    def __str__(self):
+        return '{}'.format(self.bill_id)
+
+    class Meta:
+        verbose_name = _('Bill notification')
+        verbose_name_plural = _('Bill notifications')
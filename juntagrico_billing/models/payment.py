@@ -3,7 +3,7 @@ from juntagrico.entity import JuntagricoBaseModel
 from django.utils.translation import gettext as _
 from juntagrico.config import Config
 
-from juntagrico_billing.querysets.payment import PaymentQuerySet
+from juntagrico_billing.querysets.payment import PaymentQuerySet, PaymentUploadQuerySet
 
 
 class Payment(JuntagricoBaseModel):
@@ -53,3 +53,38 @@ class PaymentType(JuntagricoBaseModel):
     class Meta:
         verbose_name = _('Payment type')
         verbose_name_plural = _('Payment types')
+
+
+class PaymentUpload(JuntagricoBaseModel):
+    """
+    Uploaded payment file, staged for importing.
+    Uploads are processed in the background by
+    the process_payment_uploads management command.
+    """
+    STATUS_CHOICES = (
+        ('pending', _('Pending')),
+        ('processing', _('Processing')),
+        ('done', _('Imported')),
+        ('failed', _('Failed')),
+    )
+
+    name = models.CharField(_('File name'), max_length=255)
+    content = models.BinaryField(_('Content'), null=True, blank=True)
+    skip_duplicates = models.BooleanField(
+        _('Skip payments that have already been imported'), default=False)
+    uploaded = models.DateTimeField(_('Uploaded'), auto_now_add=True)
+    claimed = models.DateTimeField(_('Claimed'), null=True, blank=True)
+    processed = models.DateTimeField(_('Processed'), null=True, blank=True)
+    status = models.CharField(_('Status'), max_length=20, choices=STATUS_CHOICES, default='pending')
+    imported_count = models.PositiveIntegerField(_('Imported payments'), default=0)
+    skipped_count = models.PositiveIntegerField(_('Skipped payments'), default=0)
+    message = models.TextField(_('Message'), blank=True, default='')
+
+    objects = PaymentUploadQuerySet.as_manager()
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = _('Payment upload')
+        verbose_name_plural = _('Payment uploads')
@@ -0,0 +1,11 @@
+from django.db import models
+
+
+class YearClosingQuerySet(models.QuerySet):
+    def latest_until(self, keydate):
+        """
+        the closing of the latest business year ending on or before keydate.
+        """
+        return self.filter(business_year__end_date__lte=keydate)\
+            .select_related('business_year')\
+            .order_by('-business_year__end_date').first()
@@ -1,4 +1,23 @@
 from django.db import models
+from django.db.models import Prefetch
+
+
+def display_data_prefetches():
+    """
+    prefetch lookups for the items and payments of bills,
+    including the subscription types and products of the items.
+    """
+    # the models import this module
+    from juntagrico_billing.models.bill import BillItem
+    from juntagrico_billing.models.payment import Payment
+
+    items = BillItem.objects.select_related(
+        'subscription_part__type__size__product',
+        'subscription_part__subscription',
+        'custom_item_type')
+    payments = Payment.objects.select_related('type')
+
+    return [Prefetch('items', queryset=items), Prefetch('payments', queryset=payments)]
 
 
 class BillQuerySet(models.QuerySet):
@@ -11,6 +30,15 @@ class BillQuerySet(models.QuerySet):
     def in_daterange(self, from_date, till_date):
         return self.filter(booking_date__gte=from_date, booking_date__lte=till_date)
 
+    def with_display_data(self):
+        """
+        load everything needed for displaying the bills with their
+        derived properties (item kinds, description, vat amount, period)
+        in a constant number of queries.
+        """
+        return self.select_related('member', 'business_year')\
+            .prefetch_related(*display_data_prefetches())
+
 
 class BusinessYearQuerySet(models.QuerySet):
     def by_name(self, yearname):
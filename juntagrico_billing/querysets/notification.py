@@ -0,0 +1,17 @@
+from django.db import models
+from django.db.models import Q
+
+
+class BillNotificationQuerySet(models.QuerySet):
+    def pending(self, max_attempts):
+        return self.filter(sent__isnull=True, attempts__lt=max_attempts)
+
+    def claimable(self, expired):
+        # not claimed by a run or claimed by a run that was interrupted
+        return self.filter(Q(claimed__isnull=True) | Q(claimed__lt=expired))
+
+    def failed(self, max_attempts):
+        return self.filter(sent__isnull=True, attempts__gte=max_attempts)
+
+    def sent(self):
+        return self.filter(sent__isnull=False)
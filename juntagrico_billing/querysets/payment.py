@@ -1,7 +1,15 @@
 from django.db import models
+from django.db.models import Q
 
 
 class PaymentQuerySet(models.QuerySet):
 
     def in_daterange(self, from_date, till_date):
         return self.filter(paid_date__gte=from_date, paid_date__lte=till_date)
+
+
+class PaymentUploadQuerySet(models.QuerySet):
+    def claimable(self, expired):
+        # pending or claimed by a run that was interrupted
+        return self.filter(Q(status='pending') | Q(status='processing', claimed__lt=expired) |
+                           Q(status='processing', claimed__isnull=True))
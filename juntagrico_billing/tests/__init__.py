@@ -1,5 +1,7 @@
 from datetime import date
 
+from django.core.cache import cache
+
 from juntagrico.entity.billing import BillingPeriod
 from juntagrico.tests import JuntagricoTestCase
 
@@ -78,6 +80,11 @@ class BillingTestCase(JuntagricoTestCase):
             default_paymenttype=cls.payment_type,
         )
 
+    def setUp(self):
+        super().setUp()
+        # cached price tables don't notice the rollback of previous tests
+        cache.clear()
+
     @staticmethod
     def create_billing_member(first_name, last_name):
         return JuntagricoTestCase.create_member(
@@ -0,0 +1,259 @@
+import json
+import socket
+import threading
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, mock
+from urllib.parse import parse_qs, urlparse
+
+import requests.exceptions
+
+from juntagrico_billing.util.bexio_api import BexioApiClient, RateLimiter
+from juntagrico_billing.util.bexio_exporter import BexioExporter
+from juntagrico_billing.util.bookings import Booking
+
+
+class FakeBexioHandler(BaseHTTPRequestHandler):
+    """
+    Minimal implementation of the Bexio manual entries API.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data=None, headers=None):
+        body = json.dumps(data).encode('utf8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_entry(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length))
+        # bexio returns the date on the entries as well
+        for entry in data['entries']:
+            entry['date'] = data['date']
+        return data
+
+    def fail_injected(self):
+        """
+        answer with an injected failure, if there is one left.
+        """
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            if not server.failures or self.command not in server.failing_methods:
+                return False
+            status = server.failures.pop(0)
+
+        self.send_json(status, {'error': 'injected'}, {'Retry-After': '0'} if status == 429 else None)
+        return True
+
+    def do_GET(self):
+        if self.fail_injected():
+            return
+        path = urlparse(self.path).path
+        if path == '/2.0/accounts':
+            self.send_json(200, [{'id': 1, 'account_no': '1100'}, {'id': 2, 'account_no': '3001'}])
+        elif path == '/3.0/currencies':
+            self.send_json(200, [{'id': 1, 'name': 'CHF'}])
+        else:
+            query = parse_qs(urlparse(self.path).query)
+            limit = int(query.get('limit', [2000])[0])
+            offset = int(query.get('offset', [0])[0])
+            with self.server.lock:
+                self.server.pages += 1
+                self.send_json(200, list(self.server.entries.values())[offset:offset + limit])
+
+    def do_POST(self):
+        if self.fail_injected():
+            return
+        data = self.read_entry()
+        with self.server.lock:
+            self.server.next_id += 1
+            data['id'] = self.server.next_id
+            self.server.entries[data['id']] = data
+        self.send_json(201, data)
+
+    def do_PUT(self):
+        if self.fail_injected():
+            return
+        data = self.read_entry()
+        entry_id = int(self.path.rsplit('/', 1)[1])
+        with self.server.lock:
+            data['id'] = entry_id
+            self.server.entries[entry_id] = data
+        self.send_json(200, data)
+
+    def do_DELETE(self):
+        if self.fail_injected():
+            return
+        entry_id = int(self.path.rsplit('/', 1)[1])
+        with self.server.lock:
+            if self.server.entries.pop(entry_id, None) is None:
+                self.send_json(404, {'error': 'not found'})
+                return
+        self.send_json(200, {'success': True})
+
+
+class BexioApiTest(TestCase):
+    """
+    Tests of the api client and exporter against a fake Bexio server.
+    """
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeBexioHandler)
+        self.server.lock = threading.Lock()
+        self.server.entries = {}
+        self.server.next_id = 0
+        self.server.requests = 0
+        self.server.pages = 0
+        self.server.failures = []
+        self.server.failing_methods = ('GET', 'POST', 'PUT', 'DELETE')
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.api_client = BexioApiClient(
+            'token', base_url='http://127.0.0.1:%d' % self.server.server_port,
+            rate=1000, max_retries=3, backoff=0.01)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def bookings(self, count):
+        return [
+            Booking(date=date(2023, 1, 1), docnumber=str(10000 + idx), text="Booking %d" % idx,
+                    debit_account="1100", credit_account="3001", price=100.0 + idx, vat_amount=0.0)
+            for idx in range(count)]
+
+    def test_parallel_export(self):
+        exporter = BexioExporter(self.api_client, date(2023, 1, 1), date(2023, 12, 31), workers=4)
+        result, message = exporter.export_bookings(self.bookings(20))
+
+        self.assertEqual('OK', message)
+        self.assertEqual({'created': 20, 'updated': 0, 'deleted': 0, 'failed': 0}, result)
+        self.assertEqual(20, len(self.server.entries))
+
+        # export again, nothing changes
+        result, message = exporter.export_bookings(self.bookings(20))
+        self.assertEqual({'created': 0, 'updated': 0, 'deleted': 0, 'failed': 0}, result)
+
+        # change and remove bookings
+        bookings = self.bookings(15)
+        bookings[0].price = 1.0
+        result, message = exporter.export_bookings(bookings)
+        self.assertEqual({'created': 0, 'updated': 1, 'deleted': 5, 'failed': 0}, result)
+        self.assertEqual(15, len(self.server.entries))
+
+    def test_get_existing_bookings(self):
+        exporter = BexioExporter(self.api_client, date(2023, 1, 1), date(2023, 12, 31))
+        bookings = self.bookings(5)
+        bookings[0].date = date(2022, 12, 31)
+        exporter.export_bookings(bookings)
+        self.server.pages = 0
+
+        # pages are only fetched while iterating
+        existing = self.api_client.get_existing_bookings(date(2023, 1, 1), date(2023, 12, 31), page_size=2)
+        self.assertEqual(0, self.server.pages)
+        self.assertEqual(['10001', '10002', '10003', '10004'], [booking.docnumber for booking in existing])
+        self.assertEqual(3, self.server.pages)
+
+    def test_retry(self):
+        self.server.failures = [429, 503]
+        exporter = BexioExporter(self.api_client, date(2023, 1, 1), date(2023, 12, 31))
+        result, message = exporter.export_bookings(self.bookings(2))
+
+        self.assertEqual('OK', message)
+        self.assertEqual(2, result['created'])
+        self.assertEqual(2, len(self.server.entries))
+
+    def test_no_retry_of_create_on_server_error(self):
+        """
+        creating an entry is not retried on a server error,
+        bexio may have created the entry already.
+        """
+        self.server.failures = [429, 503]
+        self.server.failing_methods = ('POST',)
+        exporter = BexioExporter(self.api_client, date(2023, 1, 1), date(2023, 12, 31))
+        result, message = exporter.export_bookings(self.bookings(1))
+
+        self.assertEqual({'created': 0, 'updated': 0, 'deleted': 0, 'failed': 1}, result)
+        self.assertEqual([], self.server.failures)
+        self.assertEqual(0, len(self.server.entries))
+
+    def test_retry_of_create_on_connection_failure(self):
+        """
+        creating an entry is retried, if the connection failed before sending.
+        """
+        # port without a server
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        sleeps = []
+        api_client = BexioApiClient(
+            'token', base_url='http://127.0.0.1:%d' % port,
+            rate=1000, max_retries=3, backoff=0.01, sleep=sleeps.append)
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            api_client.request("POST", "/3.0/accounting/manual_entries", json={})
+        self.assertEqual(3, len(sleeps))
+
+    def test_retry_on_timeout(self):
+        """
+        idempotent requests are retried on a read timeout, creating an entry is not.
+        """
+        sleeps = []
+        api_client = BexioApiClient(
+            'token', base_url='http://127.0.0.1:%d' % self.server.server_port,
+            rate=1000, max_retries=3, backoff=0.01, sleep=sleeps.append)
+        send = api_client.session.request
+
+        def time_out_first(*args, **kwargs):
+            if not sleeps:
+                raise requests.exceptions.ReadTimeout()
+            return send(*args, **kwargs)
+
+        with mock.patch.object(api_client.session, 'request', side_effect=time_out_first):
+            response = api_client.request("GET", "/2.0/accounts")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, len(sleeps))
+
+        with mock.patch.object(api_client.session, 'request', side_effect=requests.exceptions.ReadTimeout()):
+            with self.assertRaises(requests.exceptions.ReadTimeout):
+                api_client.request("POST", "/3.0/accounting/manual_entries", json={})
+        self.assertEqual(1, len(sleeps))
+
+    def test_failed_operation(self):
+        exporter = BexioExporter(self.api_client, date(2023, 1, 1), date(2023, 12, 31))
+        exporter.export_bookings(self.bookings(3))
+
+        # one request keeps failing, the other bookings are still updated
+        bookings = self.bookings(3)
+        for booking in bookings:
+            booking.price = 1.0
+        self.server.failures = [500] * 4
+        self.server.failing_methods = ('PUT',)
+        result, message = exporter.export_bookings(bookings)
+
+        self.assertEqual({'created': 0, 'updated': 2, 'deleted': 0, 'failed': 1}, result)
+        self.assertEqual(1, len(exporter.failed_operations()))
+        self.assertIn('500', message)
+
+
+class RateLimiterTest(TestCase):
+    def test_token_bucket(self):
+        now = [0.0]
+
+        def sleep(seconds):
+            now[0] += seconds
+
+        limiter = RateLimiter(2, capacity=2, clock=lambda: now[0], sleep=sleep)
+        for _ in range(6):
+            limiter.acquire()
+
+        # 2 requests in a burst, then 2 per second
+        self.assertAlmostEqual(2.0, now[0])
@@ -1,6 +1,13 @@
 
+import copy
+from datetime import date
 from unittest import TestCase
+
+from django import test
+
+from juntagrico_billing.models.bexio import BexioLedgerEntry
 from juntagrico_billing.util.bexio_exporter import BexioExporter
+from juntagrico_billing.util.bexio_ledger import BexioLedger
 from juntagrico_billing.util.bookings import Booking
 
 
@@ -155,6 +162,171 @@ class BexioExporterTest(TestCase):
         self.assertFalse(self.exporter.bookings_are_equal(booking1, booking2))
 
 
+class BexioLedgerExportTest(test.TestCase):
+    """
+    Tests of the incremental export using the ledger.
+    """
+    def setUp(self):
+        self.bookings = [
+            Booking(date=date(2023, 1, 1), docnumber="12345", text="Test Booking",
+                    debit_account="1100", credit_account="3001", price=100.0, vat_amount=20.0),
+            Booking(date=date(2023, 1, 2), docnumber="12346", text="Another Booking",
+                    debit_account="1100", credit_account="3001", price=200.0, vat_amount=40.0),
+        ]
+        self.api_client = TestApiClient()
+        self.exporter = BexioExporter(self.api_client, date(2023, 1, 1), date(2023, 12, 31), BexioLedger())
+
+    def test_first_export_fills_ledger(self):
+        result, msg = self.exporter.export_bookings(self.bookings)
+
+        self.assertEqual(1, self.api_client.get_existing_calls)
+        self.assertEqual(2, result['created'])
+        self.assertEqual(
+            {'12345': 1, '12346': 2},
+            dict(BexioLedgerEntry.objects.values_list('docnumber', 'bexio_id')))
+
+    def test_incremental_export(self):
+        self.exporter.export_bookings(self.bookings)
+
+        # change one booking, remove one and add a new one
+        self.bookings[0].price = 150.0
+        del self.bookings[1]
+        self.bookings.append(
+            Booking(date=date(2023, 1, 3), docnumber="12347", text="Third Booking",
+                    debit_account="1100", credit_account="3001", price=300.0, vat_amount=60.0))
+
+        result, msg = self.exporter.export_bookings(self.bookings)
+
+        # bexio entries are not loaded again
+        self.assertEqual(1, self.api_client.get_existing_calls)
+        self.assertEqual({'created': 1, 'updated': 1, 'deleted': 1, 'failed': 0}, result)
+        self.assertEqual(1, self.api_client.updated_bookings[0][0].id)
+        self.assertEqual(2, self.api_client.deleted_bookings[0].id)
+        self.assertEqual(
+            {'12345': 1, '12347': 3},
+            dict(BexioLedgerEntry.objects.values_list('docnumber', 'bexio_id')))
+
+        # nothing changed
+        result, msg = self.exporter.export_bookings(self.bookings)
+        self.assertEqual({'created': 0, 'updated': 0, 'deleted': 0, 'failed': 0}, result)
+
+    def test_moved_booking(self):
+        """
+        a booking moved into the date range updates its bexio entry exported for another range.
+        """
+        BexioExporter(self.api_client, date(2022, 1, 1), date(2022, 12, 31), BexioLedger()).export_bookings(
+            [Booking(date=date(2022, 12, 1), docnumber="12346", text="Another Booking",
+                     debit_account="1100", credit_account="3001", price=200.0, vat_amount=40.0)])
+        self.exporter.export_bookings(self.bookings[:1])
+
+        result, msg = self.exporter.export_bookings(self.bookings)
+        self.assertEqual({'created': 0, 'updated': 1, 'deleted': 0, 'failed': 0}, result)
+        self.assertEqual(1, self.api_client.updated_bookings[0][0].id)
+        self.assertEqual(
+            {'12345': 2, '12346': 1},
+            dict(BexioLedgerEntry.objects.values_list('docnumber', 'bexio_id')))
+        self.assertEqual(date(2023, 1, 2), BexioLedgerEntry.objects.get(docnumber='12346').booking_date)
+
+        # nothing left to delete in the old range
+        result, msg = BexioExporter(
+            self.api_client, date(2022, 1, 1), date(2022, 12, 31), BexioLedger()).export_bookings([])
+        self.assertEqual({'created': 0, 'updated': 0, 'deleted': 0, 'failed': 0}, result)
+
+    def test_full_sync(self):
+        self.exporter.export_bookings(self.bookings)
+        self.api_client.existing_bookings = []
+
+        result, msg = self.exporter.export_bookings(self.bookings, full_sync=True)
+
+        self.assertEqual(2, self.api_client.get_existing_calls)
+        self.assertEqual(2, result['created'])
+        self.assertEqual(
+            {'12345': 3, '12346': 4},
+            dict(BexioLedgerEntry.objects.values_list('docnumber', 'bexio_id')))
+
+    def test_partial_coverage(self):
+        """
+        a ledger reconciled for a narrower date range is not used for a wider one.
+        """
+        BexioExporter(self.api_client, date(2023, 1, 1), date(2023, 1, 1), BexioLedger()).export_bookings(
+            self.bookings[:1])
+        self.assertTrue(BexioLedger().covers(date(2023, 1, 1), date(2023, 1, 1)))
+        self.assertFalse(BexioLedger().covers(date(2023, 1, 1), date(2023, 12, 31)))
+
+        # both bookings are in bexio, the second one is not in the ledger
+        existing_bookings = [copy.copy(booking) for booking in self.bookings]
+        existing_bookings[0].id = 1
+        existing_bookings[1].id = 7
+        self.api_client.existing_bookings = existing_bookings
+
+        result, msg = self.exporter.export_bookings(self.bookings)
+        self.assertEqual(2, self.api_client.get_existing_calls)
+        self.assertEqual({'created': 0, 'updated': 0, 'deleted': 0, 'failed': 0}, result)
+        self.assertEqual(
+            {'12345': 1, '12346': 7},
+            dict(BexioLedgerEntry.objects.values_list('docnumber', 'bexio_id')))
+        self.assertTrue(BexioLedger().covers(date(2023, 1, 1), date(2023, 12, 31)))
+
+    def test_failed_loading_keeps_ledger(self):
+        """
+        a failure while loading the bexio entries leaves the ledger as it is.
+        """
+        self.exporter.export_bookings(self.bookings)
+
+        def failing_pages(from_date, till_date):
+            yield self.api_client.created_bookings[0]
+            raise ConnectionError('page 2 failed')
+        self.api_client.get_existing_bookings = failing_pages
+
+        result, msg = self.exporter.export_bookings(self.bookings, full_sync=True)
+        self.assertEqual('page 2 failed', msg)
+        self.assertEqual(
+            {'12345': 1, '12346': 2},
+            dict(BexioLedgerEntry.objects.values_list('docnumber', 'bexio_id')))
+
+    def test_failed_sync_not_reconciled(self):
+        """
+        the date range is only recorded as reconciled, if all operations succeeded.
+        """
+        def failing_create(booking):
+            raise ConnectionError('create failed')
+        self.api_client.create_booking = failing_create
+
+        result, msg = self.exporter.export_bookings(self.bookings)
+        self.assertEqual(2, result['failed'])
+        self.assertFalse(BexioLedger().covers(date(2023, 1, 1), date(2023, 12, 31)))
+
+    def duplicate_bookings(self):
+        # the first booking is twice in bexio
+        existing_bookings = [copy.copy(self.bookings[0]), copy.copy(self.bookings[0]), copy.copy(self.bookings[1])]
+        for bexio_id, booking in enumerate(existing_bookings, 1):
+            booking.id = bexio_id
+        return existing_bookings
+
+    def test_duplicates_kept(self):
+        """
+        duplicate bexio entries are only deleted if requested.
+        """
+        self.api_client.existing_bookings = self.duplicate_bookings()
+        result, msg = self.exporter.export_bookings(self.bookings)
+        self.assertEqual({'created': 0, 'updated': 0, 'deleted': 0, 'failed': 0}, result)
+
+    def test_remove_duplicates(self):
+        """
+        removing a duplicate keeps the ledger entry of the remaining bexio entry.
+        """
+        self.api_client.existing_bookings = self.duplicate_bookings()
+        exporter = BexioExporter(self.api_client, date(2023, 1, 1), date(2023, 12, 31), BexioLedger(),
+                                 remove_duplicates=True)
+        result, msg = exporter.export_bookings(self.bookings)
+
+        self.assertEqual({'created': 0, 'updated': 0, 'deleted': 1, 'failed': 0}, result)
+        self.assertEqual(1, self.api_client.deleted_bookings[0].id)
+        self.assertEqual(
+            {'12345': 2, '12346': 3},
+            dict(BexioLedgerEntry.objects.values_list('docnumber', 'bexio_id')))
+
+
 class TestApiClient:
     """
     Mock API client for testing purposes.
@@ -170,19 +342,22 @@ class TestApiClient:
         self.created_bookings = []
         self.updated_bookings = []
         self.deleted_bookings = []
+        self.get_existing_calls = 0
 
     def get_existing_bookings(self, from_date, till_date):
         """
         Mock method to get existing bookings from Bexio.
         """
+        self.get_existing_calls += 1
         return self.existing_bookings
 
     def create_booking(self, booking):
         """
         Mock method to create a booking in Bexio.
+        Returns the id of the created entry.
         """
         self.created_bookings.append(booking)
-        return booking
+        return len(self.created_bookings)
 
     def update_booking(self, existing_booking, new_booking):
         """
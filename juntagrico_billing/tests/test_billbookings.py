@@ -1,10 +1,12 @@
 from datetime import date
 
+from django.urls import reverse
 from juntagrico.entity.subs import SubscriptionPart
 from juntagrico_billing.models.bill import BillItem, BillItemType
 from juntagrico_billing.models.payment import Payment, PaymentType
 from juntagrico_billing.util.billing import create_bill
 from juntagrico_billing.util.bookings import get_bill_bookings, get_payment_bookings
+from juntagrico_billing.util.export import EXCEL_CONTENT_TYPE
 from . import BillingTestCase
 
 
@@ -103,6 +105,52 @@ class BillBookingsTest(BillingTestCase):
         self.assertEqual('4321', booking.member_account)
 
 
+    def test_bookings_queries(self):
+        """
+        the number of queries doesn't depend on the number of bills and payments
+        """
+        for idx in range(3):
+            subscription = self.create_subscription_and_member(
+                self.sub_type, date(2018, 1, 1), None, "Bookings%d" % idx, "1900%d" % idx)
+            bill = create_bill(subscription.parts.all(), self.year, self.year.start_date, 0.0)
+            Payment.objects.create(bill=bill, paid_date=date(2018, 3, 1), amount=100.0, type=self.paymenttype)
+
+        # items, settings
+        with self.assertNumQueries(2):
+            self.assertEqual(5, len(get_bill_bookings(self.year.start_date, self.year.end_date)))
+
+        # payments, item kinds, settings
+        with self.assertNumQueries(3):
+            self.assertEqual(5, len(get_payment_bookings(self.year.start_date, self.year.end_date)))
+
+    def test_bookings_download_csv(self):
+        self.client.force_login(self.admin.user)
+        response = self.client.get(reverse('jb:bookings-download'), {
+            'fromdate': '2018-01-01', 'tilldate': '2018-12-31', 'format': 'csv'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual('text/csv', response['Content-Type'])
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual('Datum,Belegnummer,Text,Soll,Haben,Betrag,KS1 (Mitglied),MWST', lines[0])
+        # two bill items and two payments
+        self.assertEqual(5, len(lines))
+        self.assertTrue(lines[1].startswith('2018-01-01,%d,' % (500001 + self.bill.id * 10)))
+        self.assertTrue(lines[4].startswith('2018-07-02,%d,' % (600000 + self.payment2.id)))
+
+    def test_bookings_download_negotiated(self):
+        self.client.force_login(self.admin.user)
+        params = {'fromdate': '2018-01-01', 'tilldate': '2018-12-31'}
+        response = self.client.get(reverse('jb:bookings-download'), params, HTTP_ACCEPT='text/csv')
+        self.assertEqual('text/csv', response['Content-Type'])
+
+        response = self.client.get(reverse('jb:bookings-download'), params)
+        self.assertEqual(EXCEL_CONTENT_TYPE, response['Content-Type'])
+        self.assertEqual(b'PK', b''.join(response.streaming_content)[:2])
+
+        response = self.client.get(reverse('jb:bookings-download'), {'fromdate': '2018-01-01'})
+        self.assertEqual(400, response.status_code)
+
+
 class BillWithCustomItemBookingsTest(BillingTestCase):
     def test_get_bill_bookings(self):
         item_type1 = BillItemType(name='Custom Item 1', booking_account='2211')
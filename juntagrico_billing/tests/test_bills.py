@@ -1,17 +1,34 @@
-from datetime import date
+from datetime import date, timedelta
 from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
 from django.conf import settings
+from django.core.cache import cache
+from django.contrib.messages import get_messages
+from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
 import django.core.mail
 from juntagrico.entity.subs import SubscriptionPart
+from juntagrico.entity.subtypes import SubscriptionType
 
 from juntagrico_billing.models.bill import Bill, BillItem, BillItemType
+from juntagrico_billing.models.notification import BillNotification
+from juntagrico_billing.models.payment import Payment
 from juntagrico_billing.util.billing import get_billable_subscription_parts, \
-    create_bill, create_bills_for_items, recalc_bill, publish_bills
+    create_bill, create_bills_for_items, publish_bills
 from juntagrico_billing.util.billing import scale_subscriptionpart_price
-from juntagrico_billing.util.billing import get_open_bills
+from juntagrico_billing.util.billing import get_open_bills, update_paid_amounts
+from juntagrico_billing.util.billing import update_vat, add_balancing_payments
+from juntagrico_billing.util.bill_totals import deferred_bill_totals
+from juntagrico_billing.util.pricing import PRICE_TABLE_VERSION_KEY
+from juntagrico_billing.util.recalc import recalc_bill, recalc_business_year
 from juntagrico_billing.util.qrbill import bill_id_from_refnumber, member_id_from_refnumber
-from juntagrico_billing.mailer import send_bill_notification
+from juntagrico_billing.mailer import CLAIM_TIMEOUT
+from juntagrico_billing.mailer import send_bill_notification, queue_bill_notifications, send_queued_notifications
 from . import BillingTestCase
 
 
@@ -111,6 +128,60 @@ class ScaleExtraSubscriptionPriceTest(BillingTestCase):
         self.assertEqual(self.expected_price, price, "partial active")
 
 
+class PriceTableTest(BillingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        cls.extrasubs = SubscriptionPart.objects.create(
+            subscription=cls.subscription,
+            activation_date=date(2018, 1, 1),
+            type=cls.extrasub_type
+        )
+
+    def test_no_queries_per_part(self):
+        start_date = date(2018, 1, 1)
+        end_date = date(2018, 12, 31)
+
+        # first call builds the price table
+        scale_subscriptionpart_price(self.part, start_date, end_date)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Decimal('1200.0'), scale_subscriptionpart_price(self.part, start_date, end_date))
+            self.assertEqual(Decimal('300.0'), scale_subscriptionpart_price(self.extrasubs, start_date, end_date))
+
+    def test_invalidate_on_period_change(self):
+        start_date = date(2018, 1, 1)
+        end_date = date(2018, 12, 31)
+        self.assertEqual(Decimal('300.0'), scale_subscriptionpart_price(self.extrasubs, start_date, end_date))
+
+        self.extrasub_period2.price = 400
+        self.extrasub_period2.save()
+        self.assertEqual(Decimal('500.0'), scale_subscriptionpart_price(self.extrasubs, start_date, end_date))
+
+    def test_invalidate_on_type_change(self):
+        start_date = date(2018, 1, 1)
+        end_date = date(2018, 12, 31)
+        self.assertEqual(Decimal('1200.0'), scale_subscriptionpart_price(self.part, start_date, end_date))
+
+        self.sub_type.price = 1500
+        self.sub_type.save()
+        self.assertEqual(Decimal('1500.0'), scale_subscriptionpart_price(self.part, start_date, end_date))
+
+    def test_evicted_version(self):
+        """
+        tables cached before the version key was evicted are not served again.
+        """
+        start_date = date(2018, 1, 1)
+        end_date = date(2018, 12, 31)
+        self.assertEqual(Decimal('1200.0'), scale_subscriptionpart_price(self.part, start_date, end_date))
+
+        # price changed without invalidation, then the version key is evicted
+        SubscriptionType.objects.filter(pk=self.sub_type.pk).update(price=1500)
+        cache.delete(PRICE_TABLE_VERSION_KEY)
+        self.assertEqual(Decimal('1500.0'), scale_subscriptionpart_price(self.part, start_date, end_date))
+
+
 class BillSubscriptionsTests(BillingTestCase):
     @classmethod
     def setUpTestData(cls):
@@ -148,6 +219,18 @@ class BillSubscriptionsTests(BillingTestCase):
         subscription = billable_parts[0].subscription
         self.assertEqual('Test', subscription.primary_member.last_name)
 
+    def test_get_billable_subscriptions_single_query(self):
+        # create bill for subs2
+        create_bill(self.subs2.parts.all(), self.year, self.year.start_date)
+
+        with self.assertNumQueries(1):
+            billable_parts = list(get_billable_subscription_parts(self.year))
+            self.assertEqual(3, len(billable_parts))
+            self.assertEqual(
+                ['Test', 'Test', 'Test3'],
+                sorted([part.subscription.primary_member.last_name for part in billable_parts]))
+            self.assertEqual(1, len([part for part in billable_parts if part.type.size.product.is_extra]))
+
     def test_create_bill_multiple_members(self):
         # creating a bill for billable items from different members
         # should result in an error
@@ -172,6 +255,26 @@ class BillSubscriptionsTests(BillingTestCase):
         billable_items = get_billable_subscription_parts(self.year)
         self.assertEqual(0, len(billable_items))
 
+    def test_create_bill_for_all_query_count(self):
+        """
+        bulk creation of bills needs a constant number of queries,
+        independent of the number of members.
+        """
+        for idx in range(5):
+            self.create_subscription_and_member(self.sub_type, date(2018, 1, 1), None, "Bulk%d" % idx, "1800%d" % idx)
+
+        billable_items = list(get_billable_subscription_parts(self.year))
+        with self.assertNumQueries(9):
+            bills = create_bills_for_items(billable_items, self.year, self.year.start_date)
+
+        self.assertEqual(8, len(bills))
+
+        # amount and vat amount are set without the lifecycle hooks
+        for bill in Bill.objects.filter(business_year=self.year):
+            self.assertEqual(sum([itm.amount for itm in bill.items.all()]), bill.amount)
+        bill = Bill.objects.get(member=self.subscription.primary_member)
+        self.assertEqual(1500.0, bill.amount)
+
     def test_recalc_bill_no_changes(self):
         """
         test that recalc bill does not alter a bill, if nothing was changed.
@@ -241,6 +344,99 @@ class BillSubscriptionsTests(BillingTestCase):
         recalc_bill(bill)
         self.assertEqual(org_amount - 100.0, bill.amount)
 
+    def test_recalc_business_year(self):
+        """
+        recalculate all bills of a year, applying only the changed items.
+        """
+        billable_items = get_billable_subscription_parts(self.year)
+        bills = create_bills_for_items(billable_items, self.year, self.year.start_date)
+        bill = Bill.objects.get(pk=bills[0].pk)
+        extra_item = bill.items.get(subscription_part=self.extrasubs)
+
+        # change activation date of the extra subscription
+        # and add a part, that is not billed yet
+        self.extrasubs.activation_date = date(2018, 7, 1)
+        self.extrasubs.save()
+        part = SubscriptionPart.objects.create(
+            subscription=self.subs2, activation_date=date(2018, 1, 1), type=self.extrasub_type)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            changes = recalc_business_year(self.year)
+
+        self.assertEqual(3, len(changes))
+        self.assertEqual(2, len([bill_changes for bill_changes in changes if bill_changes.amount_changed]))
+
+        # the item of the extra subscription is updated in place
+        bill = Bill.objects.get(pk=bill.pk)
+        self.assertEqual(200.0, bill.items.get(pk=extra_item.pk).amount)
+        self.assertEqual(1400.0, bill.amount)
+        bill = Bill.objects.get(member=self.subs2.primary_member)
+        self.assertEqual(part, bill.items.get(amount=300.0).subscription_part)
+        self.assertEqual(1500.0, bill.amount)
+
+        # nothing left to change
+        changes = recalc_business_year(self.year)
+        self.assertEqual([], [bill_changes for bill_changes in changes if bill_changes.items_changed])
+
+    def test_recalc_business_year_dry_run(self):
+        """
+        a dry run reports the bills that would change their amount,
+        without changing them.
+        """
+        billable_items = get_billable_subscription_parts(self.year)
+        bills = create_bills_for_items(billable_items, self.year, self.year.start_date)
+        self.extrasubs.activation_date = date(2018, 7, 1)
+        self.extrasubs.save()
+
+        changes = recalc_business_year(self.year, dry_run=True)
+        changed = [bill_changes for bill_changes in changes if bill_changes.amount_changed]
+        self.assertEqual([bills[0].pk], [bill_changes.bill.pk for bill_changes in changed])
+        self.assertEqual(1500.0, changed[0].old_amount)
+        self.assertEqual(1400.0, changed[0].amount)
+
+        self.assertEqual(1500.0, Bill.objects.get(pk=bills[0].pk).amount)
+        self.assertEqual(300.0, BillItem.objects.get(subscription_part=self.extrasubs).amount)
+
+        out = StringIO()
+        call_command('recalc_bills', self.year.name, '--dry-run', stdout=out)
+        self.assertEqual('Bill %d (%s): 1500.00 -> 1400.00\n1 bills would be changed, 1 with a changed amount\n' % (
+            bills[0].pk, bills[0].member), out.getvalue())
+
+    def test_recalc_business_year_several_bills(self):
+        """
+        parts that are not billed yet are added to the first bill of a member,
+        parts on another bill of the year are removed.
+        """
+        bill1 = create_bill(self.subs2.parts.all(), self.year, self.year.start_date)
+        bill2 = Bill.objects.create(business_year=self.year, member=self.subs2.primary_member,
+                                    bill_date=date(2018, 6, 1), booking_date=date(2018, 6, 1))
+        BillItem.objects.create(bill=bill2, subscription_part=self.subs2.parts.all()[0], amount=1200.0)
+        part = SubscriptionPart.objects.create(
+            subscription=self.subs2, activation_date=date(2018, 1, 1), type=self.extrasub_type)
+
+        recalc_business_year(self.year, [bill1, bill2])
+
+        self.assertEqual([part], [itm.subscription_part for itm in bill1.items.all()])
+        self.assertEqual(300.0, bill1.amount)
+        self.assertEqual(1, len(bill2.items.all()))
+        self.assertEqual(1200.0, bill2.amount)
+
+    def test_recalc_business_year_query_count(self):
+        """
+        recalculating a year needs a constant number of queries,
+        independent of the number of bills.
+        """
+        for idx in range(5):
+            self.create_subscription_and_member(self.sub_type, date(2018, 1, 1), None, "Bulk%d" % idx, "1800%d" % idx)
+        billable_items = get_billable_subscription_parts(self.year)
+        create_bills_for_items(billable_items, self.year, self.year.start_date)
+        SubscriptionPart.objects.update(activation_date=date(2018, 7, 1))
+
+        with self.assertNumQueries(7):
+            changes = recalc_business_year(self.year)
+
+        self.assertEqual(8, len([bill_changes for bill_changes in changes if bill_changes.amount_changed]))
+
 
 class GetBillableItemsTests(BillingTestCase):
     def test_inactive_subscription(self):
@@ -351,6 +547,134 @@ class BillsListTest(BillingTestCase):
         bills = get_open_bills(self.year, 100)
         self.assertEqual(1, len(bills), '1 open bill, not counting zero bill')
 
+    def test_get_open_bills_percentage(self):
+        """
+        query open bills by percentage of the paid amount.
+        """
+        Payment.objects.create(bill=self.bill1, type=self.payment_type,
+                               paid_date=date(2018, 2, 15), amount=100.0)
+
+        # bill1 is paid 50%
+        self.assertEqual(1, len(get_open_bills(self.year, 75)))
+        self.assertEqual(0, len(get_open_bills(self.year, 50)))
+
+    def test_open_bills_view(self):
+        """
+        open bills list is sorted and paginated server side.
+        """
+        url = reverse('jb:open-bills-list')
+        response = self.assertGet(url + '?state=open&order=-member&page=1', member=self.admin)
+        self.assertEqual('-member', response.context['order'])
+        self.assertEqual([self.bill1], list(response.context['bills_list']))
+
+        # invalid ordering falls back to the default
+        response = self.assertGet(url + '?order=nonsense', member=self.admin)
+        self.assertEqual('-amount_open', response.context['order'])
+
+    def add_display_bills(self, count):
+        """
+        add published and unpublished bills with subscription parts,
+        custom items and payments to the bills of the member.
+        """
+        for idx in range(count):
+            for published in (True, False):
+                bill = Bill.objects.create(
+                    business_year=self.year, member=self.member, published=published,
+                    bill_date=date(2018, 6, idx + 1), booking_date=date(2018, 6, idx + 1))
+                BillItem.objects.create(bill=bill, subscription_part=self.part, amount=1200.0)
+                BillItem.objects.create(bill=bill, custom_item_type=self.item_type1, amount=100.0)
+                Payment.objects.create(bill=bill, type=self.payment_type, paid_date=date(2018, 7, 1), amount=100.0)
+
+    def assertConstantQueries(self, url, member):
+        """
+        the number of queries for displaying a list of bills
+        doesn't depend on the number of bills.
+        """
+        self.add_display_bills(1)
+        self.assertGet(url, member=member)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertGet(url, member=member)
+
+        self.add_display_bills(3)
+        with self.assertNumQueries(len(queries)):
+            self.assertGet(url, member=member)
+
+    def test_open_bills_view_queries(self):
+        self.assertConstantQueries(reverse('jb:open-bills-list'), self.admin)
+
+    def test_unpublished_bills_view_queries(self):
+        self.assertConstantQueries(reverse('jb:unpublished-bills-list'), self.admin)
+
+    def test_bills_notify_view_queries(self):
+        self.assertConstantQueries(reverse('jb:bills-notify'), self.admin)
+
+    def test_user_bills_view_queries(self):
+        self.assertConstantQueries(reverse('jb:user-bills'), self.member)
+
+    def test_bill_admin_list_queries(self):
+        self.assertConstantQueries(reverse('admin:juntagrico_billing_bill_changelist'), self.admin)
+
+    def test_bill_admin_open_amount(self):
+        """
+        the bill admin filters and sorts on the stored open amount.
+        """
+        Payment.objects.create(bill=self.bill2, type=self.payment_type,
+                               paid_date=date(2018, 3, 15), amount=50.0)
+        url = reverse('admin:juntagrico_billing_bill_changelist')
+
+        response = self.assertGet(url + '?open_amount_filter=open', member=self.admin)
+        self.assertEqual(1, response.context['cl'].result_count)
+        self.assertEqual([self.bill1], response.context['cl'].result_list)
+
+        response = self.assertGet(url + '?open_amount_filter=overpaid', member=self.admin)
+        self.assertEqual([self.bill2], response.context['cl'].result_list)
+
+        # sort by the open amount column, descending
+        response = self.assertGet(url + '?o=-7', member=self.admin)
+        self.assertEqual([self.bill1, self.bill3, self.bill2], response.context['cl'].result_list)
+
+    def test_display_data(self):
+        self.add_display_bills(1)
+        bill = Bill.objects.with_display_data().get(bill_date=date(2018, 6, 1), published=True)
+        with self.assertNumQueries(0):
+            self.assertEqual('Abo, Test Item Type', bill.item_kinds)
+            self.assertEqual(2, len(bill.ordered_items))
+            self.assertEqual(2, len(bill.description.splitlines()))
+            self.assertEqual(0.0, bill.vat_amount)
+            self.assertEqual(date(2018, 1, 1), bill.period_start)
+            self.assertEqual(date(2018, 12, 31), bill.period_end)
+            self.assertEqual(1, len(bill.payments.all()))
+
+    def test_paid_amounts(self):
+        """
+        paid and open amounts are maintained on payment save and delete.
+        """
+        payment1 = Payment.objects.create(bill=self.bill1, type=self.payment_type,
+                                          paid_date=date(2018, 2, 15), amount=50.0)
+        payment2 = Payment.objects.create(bill=self.bill1, type=self.payment_type,
+                                          paid_date=date(2018, 2, 16), amount=30.0)
+        bill = Bill.objects.get(pk=self.bill1.pk)
+        self.assertEqual(80.0, bill.amount_paid)
+        self.assertEqual(120.0, bill.amount_open)
+
+        payment1.amount = 70.0
+        payment1.save()
+        payment2.delete()
+        bill = Bill.objects.get(pk=self.bill1.pk)
+        self.assertEqual(70.0, bill.amount_paid)
+        self.assertEqual(130.0, bill.amount_open)
+        self.assertEqual(1, Bill.objects.filter(amount_open=130.0).count())
+
+    def test_update_paid_amounts(self):
+        Payment.objects.create(bill=self.bill1, type=self.payment_type,
+                               paid_date=date(2018, 2, 15), amount=50.0)
+        Bill.objects.update(amount_paid=0.0, amount_open=0.0)
+
+        self.assertEqual(3, update_paid_amounts(Bill.objects.all()))
+        bill = Bill.objects.get(pk=self.bill1.pk)
+        self.assertEqual(50.0, bill.amount_paid)
+        self.assertEqual(150.0, bill.amount_open)
+
     def test_bills_for_member(self):
         """
         query bills displayed to members.
@@ -368,11 +692,17 @@ class BillsListTest(BillingTestCase):
         self.assertEqual(2, len(Bill.objects.filter(published=True)), "only 2 bills are published")
 
         id_list = [self.bill1.id, self.bill2.id, self.bill3.id]
-        publish_bills(id_list)
+        self.assertEqual(1, publish_bills(id_list), "only bill3 is newly published")
 
         # query published bills from db
         self.assertEqual(3, len(Bill.objects.filter(published=True)), "all 3 bills are published")
 
+    def test_publish_bills_action(self):
+        url = reverse('admin:juntagrico_billing_bill_changelist')
+        data = {'action': 'do_publish_bills', '_selected_action': [self.bill2.id, self.bill3.id]}
+        self.assertPost(url, data, code=302, member=self.admin)
+        self.assertEqual(3, len(Bill.objects.filter(published=True)), "all 3 bills are published")
+
 
 class BillTest(BillingTestCase):
     @classmethod
@@ -427,6 +757,53 @@ class BillTest(BillingTestCase):
         self.assertEqual('Custom', items[2].item_kind)
         self.assertEqual('', items[3].item_kind)
 
+    def test_update_vat(self):
+        """
+        update the vat rate from settings on a set of bills.
+        only subscription items carry vat.
+        """
+        self.settings.vat_percent = 7.7
+        self.settings.save()
+
+        self.assertEqual(1, update_vat(Bill.objects.filter(pk=self.bill.pk)))
+
+        bill = Bill.objects.get(pk=self.bill.pk)
+        self.assertEqual(0.077, bill.vat_rate)
+        items = bill.ordered_items
+        self.assertEqual(round(1200.0 / 1.077 * 0.077, 2), items[0].vat_amount)
+        self.assertEqual(0.0, items[2].vat_amount)
+
+    def test_add_balancing_payments(self):
+        """
+        balance bills with a compensation payment for their open amount.
+        """
+        Payment.objects.create(bill=self.bill, type=self.payment_type,
+                               paid_date=date(2018, 2, 15), amount=1000.0)
+        self.settings.balancing_paymenttype = self.payment_type
+        self.settings.save()
+
+        self.assertEqual(1, add_balancing_payments(None, Bill.objects.all()))
+
+        bill = Bill.objects.get(pk=self.bill.pk)
+        self.assertTrue(bill.paid)
+        self.assertEqual(0.0, bill.amount_open)
+        self.assertEqual(bill.amount, bill.amount_paid)
+        self.assertEqual(bill.amount - 1000.0, bill.payments.get(paid_date=date.today()).amount)
+
+        # balanced bills are not balanced again
+        self.assertEqual(0, add_balancing_payments(None, Bill.objects.all()))
+
+    def test_add_balancing_payments_action(self):
+        """
+        the admin action reports a missing balancing payment type.
+        """
+        url = reverse('admin:juntagrico_billing_bill_changelist')
+        data = {'action': 'do_add_balancing_payment', '_selected_action': [self.bill.id]}
+        response = self.assertPost(url, data, code=302, member=self.admin)
+        messages = [str(message) for message in get_messages(response.wsgi_request)]
+        self.assertEqual(['No balancing payment type configured.'], messages)
+        self.assertEqual(0, self.bill.payments.count())
+
     def test_vat_subscription(self):
         # the first item should be the subsription item
         # with price 1200.00
@@ -500,3 +877,109 @@ class BillTest(BillingTestCase):
 
         reftext = 'Referenznummer:  {}'.format(self.bill.refnumber)
         self.assertTrue(reftext in msg)
+
+    def test_queue_notifications(self):
+        """
+        notifications are queued once and sent in a batch.
+        """
+        bills = Bill.objects.filter(pk=self.bill.pk)
+        self.assertEqual(1, queue_bill_notifications(bills))
+        # already queued
+        self.assertEqual(0, queue_bill_notifications(bills))
+        self.assertEqual(0, len(django.core.mail.outbox))
+
+        self.assertEqual((1, 0), send_queued_notifications())
+        self.assertEqual(1, len(django.core.mail.outbox))
+        self.assertTrue(Bill.objects.get(pk=self.bill.pk).notification_sent)
+        self.assertIsNotNone(BillNotification.objects.get(bill=self.bill).sent)
+
+        # nothing left to send
+        self.assertEqual((0, 0), send_queued_notifications())
+
+    def test_queued_notification_retry(self):
+        """
+        failed notifications are retried until max attempts are reached.
+        """
+        queue_bill_notifications(Bill.objects.filter(pk=self.bill.pk))
+
+        # no default payment type leads to an error on sending
+        self.settings.default_paymenttype = None
+        self.settings.save()
+        self.assertEqual((0, 1), send_queued_notifications(max_attempts=2))
+        self.assertEqual((0, 1), send_queued_notifications(max_attempts=2))
+        self.assertEqual((0, 0), send_queued_notifications(max_attempts=2))
+
+        notification = BillNotification.objects.get(bill=self.bill)
+        self.assertEqual(2, notification.attempts)
+        self.assertTrue(notification.error)
+        self.assertFalse(Bill.objects.get(pk=self.bill.pk).notification_sent)
+
+    def test_queued_notification_claimed(self):
+        """
+        notifications claimed by a concurrent run are not sent again,
+        unless the claim has expired.
+        """
+        queue_bill_notifications(Bill.objects.filter(pk=self.bill.pk))
+        BillNotification.objects.update(claimed=timezone.now())
+        self.assertEqual((0, 0), send_queued_notifications())
+        self.assertEqual(0, len(django.core.mail.outbox))
+
+        # claim of an interrupted run
+        BillNotification.objects.update(claimed=timezone.now() - CLAIM_TIMEOUT - timedelta(minutes=1))
+        self.assertEqual((1, 0), send_queued_notifications())
+        self.assertEqual(1, len(django.core.mail.outbox))
+
+    def test_queued_notification_connection_error(self):
+        """
+        a failing mail server connection fails the batch without aborting the run.
+        """
+        queue_bill_notifications(Bill.objects.filter(pk=self.bill.pk))
+        with mock.patch('juntagrico_billing.mailer.get_connection', side_effect=OSError('connection refused')):
+            self.assertEqual((0, 1), send_queued_notifications())
+
+        notification = BillNotification.objects.get(bill=self.bill)
+        self.assertEqual(1, notification.attempts)
+        self.assertEqual('connection refused', notification.error)
+        self.assertIsNone(notification.claimed)
+
+        # sent on the next run
+        self.assertEqual((1, 0), send_queued_notifications())
+
+    def test_deferred_bill_totals(self):
+        """
+        changes of items and payments within deferred_bill_totals
+        recompute the bill totals only once, on commit.
+        """
+        with self.captureOnCommitCallbacks() as callbacks:
+            with deferred_bill_totals():
+                for _idx in range(10):
+                    BillItem.objects.create(bill=self.bill, custom_item_type=self.item_type, amount=10.0)
+                Payment.objects.create(bill=self.bill, type=self.payment_type,
+                                       paid_date=date(2018, 2, 1), amount=100.0)
+
+            # nothing recomputed yet
+            self.assertEqual(self.bill.amount, Bill.objects.get(pk=self.bill.pk).amount)
+
+        self.assertEqual(1, len(callbacks))
+        # savepoint, lock, amounts, paid flag, release savepoint, closings, balance snapshots, totals
+        with self.assertNumQueries(8):
+            callbacks[0]()
+
+        bill = Bill.objects.get(pk=self.bill.pk)
+        self.assertEqual(self.bill.amount + 100.0, bill.amount)
+        self.assertEqual(100.0, bill.amount_paid)
+        self.assertEqual(bill.amount - 100.0, bill.amount_open)
+        self.assertFalse(bill.paid)
+
+    def test_bill_totals_immediate(self):
+        """
+        outside of deferred_bill_totals, the totals are recomputed on each change
+        and set on the bill object.
+        """
+        bill = Bill.objects.get(pk=self.bill.pk)
+        Payment.objects.create(bill=bill, type=self.payment_type,
+                               paid_date=date(2018, 2, 1), amount=bill.amount)
+        self.assertTrue(bill.paid)
+        self.assertEqual(0.0, bill.amount_open)
+        self.assertTrue(Bill.objects.get(pk=self.bill.pk).paid)
+
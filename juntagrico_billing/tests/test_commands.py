@@ -1,6 +1,9 @@
+import os
+import tempfile
 from io import StringIO
 
 from django.core.management import call_command
+from django.core.management.base import CommandError
 
 from juntagrico.tests import JuntagricoTestCase
 
@@ -10,3 +13,29 @@ class ManagementCommandsTest(JuntagricoTestCase):
         out = StringIO()
         call_command('generate_billing_testdata', stdout=out)
         self.assertEqual(out.getvalue(), '')
+
+    def test_rebuild_bill_amounts(self):
+        out = StringIO()
+        call_command('rebuild_bill_amounts', stdout=out)
+        self.assertEqual(out.getvalue(), '0 bills updated\n')
+
+    def test_send_bill_notifications(self):
+        out = StringIO()
+        call_command('send_bill_notifications', stdout=out)
+        self.assertEqual(out.getvalue(), '0 notifications sent, 0 failed\n')
+
+    def test_export_bill_pdfs(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with self.assertRaises(CommandError):
+                call_command('export_bill_pdfs', 'unknown', os.path.join(tmpdir, 'bills.zip'), stdout=out)
+
+    def test_recalc_bills(self):
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('recalc_bills', 'unknown', '--dry-run', stdout=out)
+
+    def test_process_payment_uploads(self):
+        out = StringIO()
+        call_command('process_payment_uploads', stdout=out)
+        self.assertEqual(out.getvalue(), '0 payment files imported, 0 failed\n')
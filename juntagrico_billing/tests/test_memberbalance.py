@@ -1,8 +1,13 @@
 from datetime import date
+
+from django.db.models import F
+from django.urls import reverse
 from . import BillingTestCase
+from juntagrico_billing.models.balance import MemberBalance
 from juntagrico_billing.models.bill import Bill, BillItem, BillItemType
 from juntagrico_billing.models.payment import Payment, PaymentType
 from juntagrico_billing.util.billing import get_memberbalances
+from juntagrico_billing.util.closing import close_business_year, reopen_business_year
 
 
 class MemberBalanceTest(BillingTestCase):
@@ -68,3 +73,100 @@ class MemberBalanceTest(BillingTestCase):
         self.assertEqual(balances[1]['billed_amount'], 3100)
         self.assertEqual(balances[1]['paid_amount'], 1500)
         self.assertEqual(balances[1]['balance'], 1600)
+
+    def test_member_balance_single_query(self):
+        # second item on a bill must not multiply the billed amount
+        BillItem.objects.create(bill=self.bill4, custom_item_type=self.item_type1, amount=100)
+
+        # closing lookup, balances
+        with self.assertNumQueries(2):
+            balances = get_memberbalances(date(2024, 12, 31))
+
+        self.assertEqual([b['last_name'] for b in balances], ['Member1', 'Member2'])
+        self.assertEqual(balances[1]['billed_amount'], 3200)
+        self.assertEqual(balances[1]['billed_items_amount'], 3200)
+        self.assertEqual(balances[1]['paid_amount'], 1500)
+        self.assertEqual(balances[1]['balance'], 1700)
+
+    def test_member_balance_snapshot(self):
+        keydate = date(2024, 12, 31)
+        balances = get_memberbalances(keydate, snapshot=True)
+        self.assertEqual(2, MemberBalance.objects.filter(keydate=keydate).count())
+
+        # served from the snapshot
+        with self.assertNumQueries(1):
+            self.assertEqual(balances, get_memberbalances(keydate, snapshot=True))
+
+        # a payment before the key date invalidates the snapshot
+        Payment.objects.create(bill=self.bill4, amount=500, paid_date=date(2024, 12, 1), type=self.payment_type)
+        self.assertFalse(MemberBalance.objects.filter(keydate=keydate).exists())
+        balances = get_memberbalances(keydate, snapshot=True)
+        self.assertEqual(balances[1]['balance'], 1100)
+
+    def test_member_balance_snapshot_moved_dates(self):
+        keydate = date(2024, 12, 31)
+        get_memberbalances(keydate, snapshot=True)
+
+        # moving a bill after the key date invalidates the snapshot
+        bill = Bill.objects.get(id=self.bill4.id)
+        bill.booking_date = date(2025, 3, 1)
+        bill.save()
+        self.assertFalse(MemberBalance.objects.filter(keydate=keydate).exists())
+        balances = get_memberbalances(keydate, snapshot=True)
+        self.assertEqual(balances, get_memberbalances(keydate))
+        self.assertEqual(balances[1]['balance'], 100)
+
+        # as does moving a payment after the key date
+        payment = Payment.objects.get(bill=self.bill5)
+        payment.paid_date = date(2025, 3, 1)
+        payment.save()
+        self.assertFalse(MemberBalance.objects.filter(keydate=keydate).exists())
+        balances = get_memberbalances(keydate, snapshot=True)
+        self.assertEqual(balances[1]['balance'], 1600)
+
+    def test_member_balance_after_closing(self):
+        year = self.create_business_year(2024)
+        closing = close_business_year(year)
+        self.assertEqual(2, closing.balances.count())
+
+        # bookings after the closed year are added to the closing balances
+        expected = get_memberbalances(date(2025, 12, 31))
+        closing.balances.filter(member=self.member1).update(paid_amount=F('paid_amount') + 1)
+        balances = get_memberbalances(date(2025, 12, 31))
+        self.assertEqual(expected[0]['paid_amount'] + 1, balances[0]['paid_amount'])
+        self.assertEqual(expected[1], balances[1])
+        self.assertEqual(balances[0]['billed_amount'], 3900)
+
+        # after reopening, the full history is summed up again
+        reopen_business_year(year)
+        self.assertFalse(MemberBalance.objects.exists())
+        balances = get_memberbalances(date(2025, 12, 31))
+        self.assertEqual(expected, balances)
+
+        # a payment in a closed year reopens it
+        close_business_year(year)
+        Payment.objects.create(bill=self.bill4, amount=500, paid_date=date(2024, 12, 1), type=self.payment_type)
+        self.assertFalse(MemberBalance.objects.exists())
+        balances = get_memberbalances(date(2025, 12, 31))
+        self.assertEqual(expected[0], balances[0])
+        self.assertEqual(expected[1]['paid_amount'] + 500, balances[1]['paid_amount'])
+
+    def test_member_balance_export_csv(self):
+        self.client.force_login(self.admin.user)
+        response = self.client.get(reverse('jb:memberbalance-export'), {
+            'keydate': '2024-12-31', 'format': 'csv'})
+        self.assertEqual(200, response.status_code)
+        self.assertIn('memberbalances_2024-12-31.csv', response['Content-Disposition'])
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual('Nachname,Vorname,Rechnungen,Rechnungspositionen,Zahlungen,Saldo', lines[0])
+        self.assertTrue(lines[1].startswith('Member1,Alpha,'))
+
+    def test_member_balance_export_excel(self):
+        self.client.force_login(self.admin.user)
+        response = self.client.get(reverse('jb:memberbalance-export'), {
+            'keydate': '2024-12-31', 'export': ''})
+        self.assertEqual(200, response.status_code)
+        self.assertIn('memberbalances_2024-12-31.xlsx', response['Content-Disposition'])
+        self.assertEqual(b'PK', b''.join(response.streaming_content)[:2])
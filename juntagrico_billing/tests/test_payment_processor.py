@@ -1,12 +1,17 @@
 import unittest
-from datetime import date
+from datetime import date, timedelta
+from unittest import mock
 
 from django import test
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from django.utils import timezone
 
 from juntagrico_billing.models.bill import Bill
-from juntagrico_billing.models.payment import Payment, PaymentType
-from juntagrico_billing.util.qrbill import bill_id_from_refnumber, member_id_from_refnumber
+from juntagrico_billing.models.payment import Payment, PaymentType, PaymentUpload
+from juntagrico_billing.util.qrbill import bill_id_from_refnumber, member_id_from_refnumber, calc_refnumber
 from juntagrico_billing.util.payment_processor import PaymentProcessor, PaymentInfo, PaymentProcessorError
+from juntagrico_billing.util.payment_upload import process_payment_uploads, stage_payment_uploads, CLAIM_TIMEOUT
 from . import BillingTestCase
 
 
@@ -260,3 +265,184 @@ class PaymentProcessorTest(test.TestCase):
         # check that no payments are assigned
         self.assertEqual(0, len(self.bill1.payments.all()))
         self.assertEqual(0, len(self.bill2.payments.all()))
+
+    def test_process_payments_queries(self):
+        """
+        the number of queries doesn't depend on the number of payments
+        """
+        self.bill1.amount = 250.0
+        self.bill1.save()
+
+        payment_infos = [
+            PaymentInfo(
+                date(2018, 3, 15),
+                'CH7730000001250094239',
+                50.0,
+                'QRR',
+                '000000000000000100000000010',
+                'xa56-klkw%d' % idx
+            )
+            for idx in range(5)]
+
+        # prefetch (3), duplicates (1), savepoint, lock, bulk create,
+        # update amounts, update paid flag, invalidate closings and balance snapshots, release savepoint
+        with self.assertNumQueries(12):
+            self.processor.process_payments(payment_infos)
+
+        self.bill1.refresh_from_db()
+        self.assertEqual(5, self.bill1.payments.count())
+        self.assertEqual(250.0, self.bill1.amount_paid)
+        self.assertEqual(0.0, self.bill1.amount_open)
+        self.assertTrue(self.bill1.paid)
+
+    def test_process_payments_duplicates(self):
+        """
+        all duplicates are reported at once or skipped
+        """
+        Payment.objects.create(
+            bill=self.bill1, type=self.paymenttype1,
+            paid_date=date(2018, 3, 1), amount=10.0, unique_id='dup-1')
+        Payment.objects.create(
+            bill=self.bill1, type=self.paymenttype1,
+            paid_date=date(2018, 3, 1), amount=10.0, unique_id='dup-2')
+
+        payment_infos = [
+            PaymentInfo(
+                date(2018, 3, 15),
+                'CH7730000001250094239',
+                50.0,
+                'QRR',
+                '000000000000000100000000010',
+                unique_id
+            )
+            for unique_id in ('dup-1', 'new-1', 'dup-2', 'new-1')]
+
+        with self.assertRaisesMessage(
+                PaymentProcessorError,
+                'Payments with unique ids dup-1, dup-2, new-1 have already been imported.'):
+            self.processor.process_payments(payment_infos)
+        self.assertEqual(2, self.bill1.payments.count())
+
+        skipped = self.processor.process_payments(payment_infos, skip_duplicates=True)
+        self.assertEqual([payment_infos[0], payment_infos[2], payment_infos[3]], skipped)
+        self.assertEqual(3, self.bill1.payments.count())
+        self.assertTrue(Payment.objects.filter(unique_id='new-1').exists())
+
+
+CAMT054_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.054.001.04">
+    <BkToCstmrDbtCdtNtfctn>
+        <Ntfctn>
+            <Ntry>
+                <NtryRef>%(iban)s</NtryRef>
+                <ValDt><Dt>2018-03-15</Dt></ValDt>
+                <NtryDtls>
+                    <TxDtls>
+                        <Refs><InstrId>%(unique_id)s</InstrId></Refs>
+                        <Amt Ccy="CHF">%(amount).2f</Amt>
+                        <RmtInf>
+                            <Strd>
+                                <CdtrRefInf>
+                                    <Tp><CdOrPrtry><Prtry>QRR</Prtry></CdOrPrtry></Tp>
+                                    <Ref>%(reference)s</Ref>
+                                </CdtrRefInf>
+                            </Strd>
+                        </RmtInf>
+                    </TxDtls>
+                </NtryDtls>
+            </Ntry>
+        </Ntfctn>
+    </BkToCstmrDbtCdtNtfctn>
+</Document>
+"""
+
+
+class PaymentUploadTest(BillingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.upload_member = cls.create_billing_member('Peter', 'Uploader')
+        cls.bill = Bill.objects.create(
+            business_year=cls.year, amount=100.0,
+            member=cls.upload_member, published=True,
+            bill_date=date(2018, 2, 1), booking_date=date(2018, 2, 1)
+        )
+
+    def camt_file(self, name, unique_id, amount):
+        content = CAMT054_TEMPLATE % {
+            'iban': self.payment_type.iban,
+            'unique_id': unique_id,
+            'amount': amount,
+            'reference': calc_refnumber(self.bill),
+        }
+        return SimpleUploadedFile(name, content.encode('utf8'))
+
+    def test_upload_and_process(self):
+        self.client.force_login(self.admin.user)
+        response = self.client.post(reverse('jb:payments-upload'), {
+            'file': [
+                self.camt_file('day1.xml', 'upload-1', 40.0),
+                self.camt_file('day2.xml', 'upload-2', 60.0),
+                SimpleUploadedFile('invalid.xml', b'<Document'),
+            ],
+            'skip_duplicates': 'on',
+        })
+        self.assertRedirects(response, reverse('jb:payments-uploads'))
+        self.assertEqual(3, PaymentUpload.objects.filter(status='pending').count())
+
+        self.assertEqual((2, 1), process_payment_uploads())
+        self.assertEqual(0, PaymentUpload.objects.filter(status__in=('pending', 'processing')).count())
+
+        self.bill.refresh_from_db()
+        self.assertEqual(100.0, self.bill.amount_paid)
+        self.assertTrue(self.bill.paid)
+
+        failed = PaymentUpload.objects.get(status='failed')
+        self.assertEqual('invalid.xml', failed.name)
+        self.assertIsNone(failed.content)
+
+        # uploading the same file again skips the payment
+        stage_payment_uploads([self.camt_file('day1.xml', 'upload-1', 40.0)], skip_duplicates=True)
+        self.assertEqual((1, 0), process_payment_uploads())
+        upload = PaymentUpload.objects.order_by('-id').first()
+        self.assertEqual((0, 1), (upload.imported_count, upload.skipped_count))
+
+        self.assertGet(reverse('jb:payments-uploads'), member=self.admin)
+
+    def test_process_unexpected_error(self):
+        """
+        an unexpected error fails the upload, the other uploads are still imported.
+        """
+        stage_payment_uploads([
+            self.camt_file('day1.xml', 'upload-1', 40.0),
+            self.camt_file('day2.xml', 'upload-2', 60.0),
+        ])
+        process_payments = PaymentProcessor.process_payments
+        calls = []
+
+        def fail_first(processor, payments, skip_duplicates=False):
+            calls.append(payments)
+            if len(calls) == 1:
+                raise ValueError('bad date')
+            return process_payments(processor, payments, skip_duplicates)
+
+        with mock.patch.object(PaymentProcessor, 'process_payments', fail_first):
+            self.assertEqual((1, 1), process_payment_uploads())
+
+        failed = PaymentUpload.objects.get(status='failed')
+        self.assertEqual('day1.xml', failed.name)
+        self.assertIn('bad date', failed.message)
+        self.assertEqual(0, PaymentUpload.objects.filter(status__in=('pending', 'processing')).count())
+
+    def test_reclaim_interrupted_upload(self):
+        """
+        uploads left in processing by an interrupted run are processed again
+        after the claim timeout.
+        """
+        stage_payment_uploads([self.camt_file('day1.xml', 'upload-1', 40.0)])
+        PaymentUpload.objects.update(status='processing', claimed=timezone.now())
+        self.assertEqual((0, 0), process_payment_uploads())
+
+        PaymentUpload.objects.update(claimed=timezone.now() - CLAIM_TIMEOUT - timedelta(minutes=1))
+        self.assertEqual((1, 0), process_payment_uploads())
+        self.assertEqual('done', PaymentUpload.objects.get().status)
@@ -1,7 +1,7 @@
 from unittest import TestCase
 import datetime
 from os.path import join, dirname
-from juntagrico_billing.util.payment_reader import Camt045Reader
+from juntagrico_billing.util.payment_reader import Camt045Reader, PaymentReaderError
 
 
 class Camt054ReaderTest(TestCase):
@@ -83,3 +83,31 @@ class Camt054ReaderTest(TestCase):
         self.assertEqual('QRR', payment.ref_type)
         self.assertEqual('000000000000013600000000688', payment.reference)
         self.assertEqual('230202CH09TIF874', payment.unique_id)
+
+    def test_iter_payments_from_file(self):
+        """
+        payments are parsed incrementally from a file object.
+        """
+        reader = Camt045Reader()
+
+        testfile = join(dirname(__file__), 'camt054_testfile.xml')
+        with open(testfile, 'rb') as f:
+            payments = reader.iter_payments(f, chunk_size=512)
+            payment = next(payments)
+            self.assertEqual('1006265-25bbb3b1a', payment.unique_id)
+            payment = next(payments)
+            self.assertEqual('1005970-70a75515', payment.unique_id)
+            self.assertEqual([], list(payments))
+
+    def test_read_invalid_documents(self):
+        reader = Camt045Reader()
+
+        with self.assertRaises(PaymentReaderError):
+            reader.parse_payments('<Document xmlns="%s"></Document>' % reader.ns)
+
+        with self.assertRaises(PaymentReaderError):
+            reader.parse_payments(
+                '<Document xmlns="%s"><BkToCstmrDbtCdtNtfctn><Ntfctn/></BkToCstmrDbtCdtNtfctn></Document>' % reader.ns)
+
+        with self.assertRaises(PaymentReaderError):
+            reader.parse_payments(self.read_file('camt054_testfile.xml')[:2000])
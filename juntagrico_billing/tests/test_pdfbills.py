@@ -1,11 +1,18 @@
+import zipfile
 from datetime import date
+from io import BytesIO
+from unittest import mock
 
 from django.http import HttpResponse
+from django.urls import reverse
 from juntagrico.entity.subs import SubscriptionPart
+from pypdf import PdfReader
 
 from juntagrico_billing.util.billing import create_bill
 from . import BillingTestCase
 from ..util.pdfbill import PdfBillRenderer
+from ..util.pdfbulk import bill_pdf_filename, iter_bills_merged, iter_bills_zip
+from ..util.qrbill import get_cached_qrbill_svg, get_qrbill_svg, qrbill_cache_key
 
 
 class PdfBillTests(BillingTestCase):
@@ -21,3 +28,63 @@ class PdfBillTests(BillingTestCase):
         )
         bill = create_bill(self.subscription.parts.all(), self.year, self.year.start_date)
         PdfBillRenderer().render(bill, HttpResponse())
+
+    def test_bills_zip(self):
+        bill = create_bill(self.subscription.parts.all(), self.year, self.year.start_date)
+        archive = zipfile.ZipFile(BytesIO(b''.join(iter_bills_zip([bill.id]))))
+        self.assertEqual([bill_pdf_filename(bill.id)], archive.namelist())
+        self.assertTrue(archive.read(bill_pdf_filename(bill.id)).startswith(b'%PDF'))
+
+    def test_bills_merged(self):
+        bill = create_bill(self.subscription.parts.all(), self.year, self.year.start_date)
+        subscription2 = self.create_subscription_and_member(self.sub_type, date(2018, 1, 1), None, "Test2", "4322")
+        bill2 = create_bill(subscription2.parts.all(), self.year, self.year.start_date)
+        documents = list(iter_bills_merged([bill.id, bill2.id]))
+        single = BytesIO()
+        PdfBillRenderer().render(bill, single)
+        pages = len(PdfReader(single).pages)
+        self.assertEqual(1, len(documents))
+        self.assertEqual(2 * pages, len(PdfReader(BytesIO(documents[0])).pages))
+
+        # one document per batch
+        documents = list(iter_bills_merged([bill.id, bill2.id], batch_size=1))
+        self.assertEqual([pages, pages], [len(PdfReader(BytesIO(document)).pages) for document in documents])
+
+    def test_bills_pdf_export_view(self):
+        bill = create_bill(self.subscription.parts.all(), self.year, self.year.start_date)
+        bill.published = True
+        bill.save()
+        response = self.assertGet(reverse('jb:bills-pdf-export'), member=self.admin)
+        self.assertEqual('application/zip', response['Content-Type'])
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual([bill_pdf_filename(bill.id)], archive.namelist())
+
+    def test_payslip_cache(self):
+        bill = create_bill(self.subscription.parts.all(), self.year, self.year.start_date)
+        with mock.patch('juntagrico_billing.util.qrbill.get_qrbill_svg', wraps=get_qrbill_svg) as qrbill_svg:
+            PdfBillRenderer().render(bill, BytesIO())
+            PdfBillRenderer().render(bill, BytesIO())
+            self.assertEqual(1, qrbill_svg.call_count)
+
+            # payslip of the html bill is cached too
+            get_cached_qrbill_svg(bill, self.payment_type)
+            self.assertEqual(1, qrbill_svg.call_count)
+
+            # a changed address produces a new payslip
+            bill.member.addr_street = 'Other Street 2'
+            PdfBillRenderer().render(bill, BytesIO())
+            self.assertEqual(2, qrbill_svg.call_count)
+
+    def test_payslip_cache_member(self):
+        """
+        the reference number contains the member id,
+        a bill of another member with the same address gets another payslip.
+        """
+        bill = create_bill(self.subscription.parts.all(), self.year, self.year.start_date)
+        key = qrbill_cache_key(bill, self.payment_type, 'svg')
+
+        other = self.create_billing_member("Other", "Member")
+        for field in ('first_name', 'last_name', 'addr_street', 'addr_zipcode', 'addr_location'):
+            setattr(other, field, getattr(bill.member, field))
+        bill.member = other
+        self.assertNotEqual(key, qrbill_cache_key(bill, self.payment_type, 'svg'))
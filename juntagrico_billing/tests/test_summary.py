@@ -0,0 +1,160 @@
+from datetime import date
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import F
+from juntagrico.entity.share import Share
+
+from juntagrico_billing.models.balance import YearClosing
+from juntagrico_billing.models.bill import Bill, BillItem, BillItemType
+from juntagrico_billing.models.payment import Payment
+from juntagrico_billing.util.billing import get_billing_summary
+from juntagrico_billing.util.closing import close_business_year, reopen_business_year
+from juntagrico_billing.util.shares_summary import get_shares_summary
+from juntagrico_billing.util.summaries import SUMMARY_VERSION_KEY, get_cached_summary
+from . import BillingTestCase
+
+
+class SummaryTest(BillingTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+
+        item_type = BillItemType.objects.create(name='Summary Item', booking_account='2211')
+        cls.member1 = cls.create_billing_member("Alpha", "Summary")
+
+        def create_bill(booking_date, *amounts):
+            bill = Bill.objects.create(
+                business_year=cls.year, member=cls.member1,
+                bill_date=booking_date, booking_date=booking_date)
+            for amount in amounts:
+                BillItem.objects.create(bill=bill, custom_item_type=item_type, amount=amount)
+            return bill
+
+        cls.bill1 = create_bill(date(2017, 12, 1), 100, 200)
+        cls.bill2 = create_bill(date(2018, 3, 1), 400, 800)
+        create_bill(date(2019, 1, 1), 1600)
+
+        Payment.objects.create(bill=cls.bill1, amount=250, paid_date=date(2017, 12, 15), type=cls.payment_type)
+        Payment.objects.create(bill=cls.bill2, amount=1000, paid_date=date(2018, 4, 1), type=cls.payment_type)
+
+        Share.objects.create(member=cls.member1, value=250, paid_date=date(2017, 1, 1))
+        Share.objects.create(
+            member=cls.member1, value=250, paid_date=date(2018, 1, 1), cancelled_date=date(2018, 2, 1),
+            termination_date=date(2018, 5, 31), payback_date=date(2018, 6, 1))
+        Share.objects.create(member=cls.member1, value=250, paid_date=date(2018, 5, 1))
+
+    def test_billing_summary(self):
+        # closing lookup, bill items, payments
+        with self.assertNumQueries(3):
+            summary = get_billing_summary(date(2018, 1, 1), date(2018, 12, 31))
+
+        self.assertEqual(1200, summary['range_billed'])
+        self.assertEqual(1000, summary['range_payments'])
+        self.assertEqual(300, summary['start_billed'])
+        self.assertEqual(1500, summary['end_billed'])
+        self.assertEqual(50, summary['start_balance'])
+        self.assertEqual(250, summary['end_balance'])
+
+    def test_billing_summary_after_closing(self):
+        year2017 = self.create_business_year(2017)
+        closing = close_business_year(year2017)
+        self.assertEqual(0, closing.opening_billed)
+        self.assertEqual(300, closing.closing_billed)
+        self.assertEqual(250, closing.closing_paid)
+
+        expected = get_billing_summary(date(2018, 1, 1), date(2019, 12, 31))
+        self.assertEqual(50, expected['start_balance'])
+        self.assertEqual(1850, expected['end_balance'])
+
+        # totals until the end of the closed year are taken from the closing
+        closing.closing_billed = 310
+        closing.save()
+        summary = get_billing_summary(date(2018, 1, 1), date(2019, 12, 31))
+        self.assertEqual(60, summary['start_balance'])
+        self.assertEqual(1860, summary['end_balance'])
+        self.assertEqual(expected['range_balance'], summary['range_balance'])
+
+        # closing the following year uses the closing of 2017
+        closing2018 = close_business_year(self.year)
+        self.assertEqual(310, closing2018.opening_billed)
+        self.assertEqual(1510, closing2018.closing_billed)
+
+    def test_billing_summary_booking_in_closed_year(self):
+        fromdate, tilldate = date(2019, 1, 1), date(2019, 12, 31)
+        close_business_year(self.year)
+        summary = get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+        self.assertEqual(1250, summary['start_payments'])
+
+        # changes not affecting the amounts keep the year closed
+        bill = Bill.objects.get(id=self.bill2.id)
+        bill.private_notes = 'reminder sent'
+        bill.published = True
+        bill.save()
+        item = bill.items.first()
+        item.description = 'Vegetables'
+        item.save()
+        payment = bill.payments.get()
+        payment.private_notes = 'checked'
+        payment.save()
+        self.assertTrue(YearClosing.objects.exists())
+
+        # a payment in the closed year reopens it
+        Payment.objects.create(bill=self.bill2, amount=200, paid_date=date(2018, 6, 1), type=self.payment_type)
+        self.assertFalse(YearClosing.objects.exists())
+        summary = get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+        self.assertEqual(1450, summary['start_payments'])
+
+        # closing and reopening invalidate the cached summaries
+        close_business_year(self.year)
+        YearClosing.objects.update(closing_paid=F('closing_paid') + 10)
+        summary = get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+        self.assertEqual(1460, summary['start_payments'])
+        reopen_business_year(self.year)
+        summary = get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+        self.assertEqual(1450, summary['start_payments'])
+
+    def test_billing_summary_empty(self):
+        summary = get_billing_summary(date(2010, 1, 1), date(2010, 12, 31))
+        self.assertEqual(0, summary['range_balance'])
+        self.assertEqual(0, summary['end_balance'])
+
+    def test_shares_summary(self):
+        with self.assertNumQueries(1):
+            summary = get_shares_summary(date(2018, 1, 1), date(2018, 12, 31))
+
+        self.assertEqual(Decimal(250), summary['start_balance'])
+        self.assertEqual(Decimal(500), summary['end_balance'])
+        self.assertEqual(Decimal(250), summary['range_balance'])
+
+    def test_cached_summary(self):
+        fromdate, tilldate = date(2018, 1, 1), date(2018, 12, 31)
+        get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+        with self.assertNumQueries(0):
+            summary = get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+        self.assertEqual(1000, summary['range_payments'])
+
+        # writing a payment invalidates the cached summary
+        Payment.objects.create(bill=self.bill2, amount=200, paid_date=date(2018, 5, 1), type=self.payment_type)
+        summary = get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+        self.assertEqual(1200, summary['range_payments'])
+
+        # so does writing a share
+        get_cached_summary('shares', fromdate, tilldate, get_shares_summary)
+        Share.objects.create(member=self.member1, value=250, paid_date=date(2018, 7, 1))
+        summary = get_cached_summary('shares', fromdate, tilldate, get_shares_summary)
+        self.assertEqual(Decimal(750), summary['end_balance'])
+
+    def test_cached_summary_evicted_version(self):
+        """
+        summaries cached before the version key was evicted are not served again.
+        """
+        fromdate, tilldate = date(2018, 1, 1), date(2018, 12, 31)
+        get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+
+        # payment written without invalidation, then the version key is evicted
+        Payment.objects.bulk_create([
+            Payment(bill=self.bill2, amount=200, paid_date=date(2018, 5, 1), type=self.payment_type)])
+        cache.delete(SUMMARY_VERSION_KEY)
+        summary = get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+        self.assertEqual(1200, summary['range_payments'])
@@ -13,10 +13,12 @@ urlpatterns = [
     path('jb/bills_generate', views.bills_generate, name='bills-generate'),
     path('jb/bills_notify', views.bills_notify, name='bills-notify'),
     path('jb/bill_recalc/<int:bill_id>', views.bill_recalc, name='bill-recalc'),
+    path('jb/bills_pdf_export', views.bills_pdf_export, name='bills-pdf-export'),
     path('jb/accounting_summary', views.accounting_summary, name='accounting-summary'),
 
     # bookings export
     path('jb/bookings_export', views.bookings_export, name='bookings-export'),
+    path('jb/bookings_download', views.bookings_download, name='bookings-download'),
 
     # member balance export
     path('jb/memberbalance_export', views.memberbalance_export, name='memberbalance-export'),
@@ -27,5 +29,6 @@ urlpatterns = [
     path('jb/user_bill_pdf/<int:bill_id>', views.user_bill_pdf, name='user-bill-pdf'),
 
     # payments
-    path('jb/payments_upload', views_payment.payments_upload, name='payments-upload')
+    path('jb/payments_upload', views_payment.payments_upload, name='payments-upload'),
+    path('jb/payments_uploads', views_payment.payments_uploads, name='payments-uploads'),
 ]
@@ -1,21 +1,103 @@
 import re
+import threading
+import time
+import requests.exceptions
 from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 from datetime import date
 
+BEXIO_API_URL = "https://api.bexio.com"
+
+# juntagrico billing docnumber at the end of entry descriptions
+DOCNUMBER_REGEX = re.compile(r'(.+) jb:(\d+)$')
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the rate of requests.
+    Can be shared by several threads.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        """
+        :param rate: number of requests per second.
+        :param capacity: number of requests that may be sent in a burst (default: rate).
+        """
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        take a token, waiting until one is available.
+        """
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+def request_not_sent(error):
+    """
+    whether a connection error or timeout occurred before the request was sent,
+    i.e. connecting to the server failed.
+    """
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
 
 class BexioApiClient:
     """
     A client to interact with the Bexio API.
     """
 
-    def __init__(self, api_key):
+    # status codes of responses that are retried
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+
+    # methods that can be repeated without changing the result.
+    # bexio may have created an entry despite a server error,
+    # so other requests are only retried on 429 (too many requests)
+    # or if the connection failed before the request was sent.
+    IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+    NON_IDEMPOTENT_RETRY_STATUS = (429,)
+
+    def __init__(self, api_key, base_url=BEXIO_API_URL, rate=5, max_retries=5,
+                 backoff=1.0, pool_size=10, timeout=30, sleep=time.sleep):
         """
         Initializes the BexioApiClient with an API key.
 
         :param api_key: The API key to authenticate with Bexio.
+        :param base_url: URL of the Bexio API.
+        :param rate: Maximum number of requests per second.
+        :param max_retries: Number of retries of requests failing with 429 or 5xx (429 only for POST).
+        :param backoff: Delay in seconds before the first retry, doubled with every retry.
+        :param pool_size: Number of connections kept open, should match the number of threads.
         """
         self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.sleep = sleep
+        self.rate_limiter = RateLimiter(rate, sleep=sleep)
+
         self.session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
         self.session.headers.update({
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
@@ -25,28 +107,71 @@ class BexioApiClient:
         self.accounts_by_id = {}
         self.account_ids_by_number = {}
         self.currency_ids = {}
+        self.base_data_lock = threading.Lock()
+
+    def request(self, method, path, **kwargs):
+        """
+        Sends a request to the Bexio API, respecting the rate limit.
+        Requests failing with 429 (too many requests), a server error,
+        a connection error or a timeout are retried with exponential backoff,
+        using the delay given by the Retry-After header if present.
+        Requests that are not idempotent (POST) are only retried on 429
+        or if the connection failed before the request was sent.
+
+        :param method: HTTP method.
+        :param path: Path of the API endpoint, e.g. /3.0/currencies.
+        :return: The response.
+        """
+        url = self.base_url + path
+        idempotent = method in self.IDEMPOTENT_METHODS
+        retry_status = self.RETRY_STATUS if idempotent else self.NON_IDEMPOTENT_RETRY_STATUS
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt == self.max_retries or not (idempotent or request_not_sent(e)):
+                    raise
+                self.sleep(self.backoff * 2 ** attempt)
+                continue
+
+            if response.status_code not in retry_status or attempt == self.max_retries:
+                return response
+
+            self.sleep(self.retry_delay(response, attempt))
+
+    def retry_delay(self, response, attempt):
+        """
+        delay before retrying a request,
+        as requested by the server or by exponential backoff.
+        """
+        try:
+            return float(response.headers['Retry-After'])
+        except (KeyError, ValueError):
+            return self.backoff * 2 ** attempt
 
     def load_base_data(self):
         """
         Loads accounts from Bexio in a dictionary
         """
-        if len(self.accounts_by_id):
-            return
+        with self.base_data_lock:
+            if len(self.accounts_by_id):
+                return
 
-        # Fetch accounts from Bexio
-        response = self.session.get("https://api.bexio.com/2.0/accounts")
-        response.raise_for_status()
+            # Fetch accounts from Bexio
+            response = self.request("GET", "/2.0/accounts")
+            response.raise_for_status()
 
-        for account in response.json():
-            self.accounts_by_id[account['id']] = account['account_no']
-            self.account_ids_by_number[account['account_no']] = account['id']
+            for account in response.json():
+                self.accounts_by_id[account['id']] = account['account_no']
+                self.account_ids_by_number[account['account_no']] = account['id']
 
-        # fetch currency IDs
-        response = self.session.get("https://api.bexio.com/3.0/currencies")
-        response.raise_for_status()
+            # fetch currency IDs
+            response = self.request("GET", "/3.0/currencies")
+            response.raise_for_status()
 
-        for currency in response.json():
-            self.currency_ids[currency['name']] = currency['id']
+            for currency in response.json():
+                self.currency_ids[currency['name']] = currency['id']
 
     def booking_to_dict(self, booking):
         return {
@@ -81,95 +206,90 @@ class BexioApiClient:
         except KeyError:
             raise Exception(f"Unknown currency {currency_name}") from None
 
-    def get_existing_bookings(self, from_date, till_date):
+    def get_existing_bookings(self, from_date, till_date, page_size=2000):
         """
         Fetches existing bookings from Bexio within the specified date range.
-        Uses pagination to fetch all bookings if there are more than 2000 entries.
+        Uses pagination to fetch all bookings if there are more than page_size entries.
+        The manual entries endpoint of bexio can't filter by date, so the entries
+        are filtered while reading the pages, one page at a time.
 
         :param from_date: The start date for the bookings to fetch.
         :param till_date: The end date for the bookings to fetch.
-        :param account: acount for filtering, must appear on either side of booking.
-        :return: A list of existing bookings.
+        :param page_size: Number of entries fetched with one request.
+        :return: A generator of existing bookings.
         """
         self.load_base_data()
 
-        # Fetch all manual entries using pagination
-        limit = 2000
-        offset = 0
-        all_envelopes = []
+        for envelope in self.iter_manual_entries(page_size):
+            booking = self.envelope_to_booking(envelope)
+            if booking and from_date <= booking.date <= till_date:
+                yield booking
 
+    def iter_manual_entries(self, page_size):
+        """
+        Fetches all manual entries page by page.
+        """
+        offset = 0
         while True:
-            response = self.session.get(
-                "https://api.bexio.com/3.0/accounting/manual_entries",
-                params={"limit": limit, "offset": offset}
+            response = self.request(
+                "GET", "/3.0/accounting/manual_entries",
+                params={"limit": page_size, "offset": offset}
             )
             response.raise_for_status()
 
             envelopes = response.json()
-            all_envelopes.extend(envelopes)
+            yield from envelopes
 
             # If we received fewer entries than the limit, we've fetched all entries
-            if len(envelopes) < limit:
+            if len(envelopes) < page_size:
                 break
 
-            offset += limit
-
-        # prepare regex for docnumber matching
-        docnum_regex = re.compile(r'(.+) jb:(\d+)$')
+            offset += page_size
 
-        result = []
-        for envelope in all_envelopes:
-            entries = envelope.get('entries', [])
-
-            # only consider first entry in envelope
-            entry = entries[0]
-
-            # filter by date range
-            entry_date = date.fromisoformat(entry['date'])
-            if not (from_date <= entry_date <= till_date):
-                continue
-
-            # parse docnumber from entry description
-            m = docnum_regex.match(entry['description'])
-
-            # only consider entries where the description ends with jb:<docnumber>
-            if not m:
-                continue
-
-            text = m.group(1)
-            docnum = m.group(2)
-            debit_account = self.accounts_by_id.get(entry['debit_account_id'])
-            credit_account = self.accounts_by_id.get(entry['credit_account_id'])
-
-            booking = Booking(
-                entry_date,
-                docnum,
-                text,
-                debit_account,
-                credit_account,
-                entry['amount'],
-                entry.get('tax_amount', 0.0)
-            )
-            booking.id = envelope.get('id')
-            result.append(booking)
-
-        return result
+    def envelope_to_booking(self, envelope):
+        """
+        Converts a manual entry to a booking.
+        Returns None for entries not exported by juntagrico billing,
+        i.e. where the description doesn't end with jb:<docnumber>.
+        """
+        entries = envelope.get('entries', [])
+
+        # only consider first entry in envelope
+        entry = entries[0]
+
+        # parse docnumber from entry description
+        m = DOCNUMBER_REGEX.match(entry['description'])
+        if not m:
+            return None
+
+        booking = Booking(
+            date.fromisoformat(entry['date']),
+            m.group(2),
+            m.group(1),
+            self.accounts_by_id.get(entry['debit_account_id']),
+            self.accounts_by_id.get(entry['credit_account_id']),
+            entry['amount'],
+            entry.get('tax_amount', 0.0)
+        )
+        booking.id = envelope.get('id')
+        return booking
 
     def create_booking(self, booking):
         """
         Creates a new booking in Bexio.
 
         :param booking: The booking to create.
+        :return: The id of the created Bexio entry.
         """
         self.load_base_data()
 
         entry_data = self.booking_to_dict(booking)
 
-        response = self.session.post("https://api.bexio.com/3.0/accounting/manual_entries", json=entry_data)
+        response = self.request("POST", "/3.0/accounting/manual_entries", json=entry_data)
         if not response.ok:
             raise Exception(f"Failed to create booking: {response.json()}")
 
-        print(f"create_booking response: {response.json()}")
+        return response.json().get('id')
 
     def update_booking(self, existing_booking, new_booking):
         """
@@ -181,7 +301,7 @@ class BexioApiClient:
         self.load_base_data()
 
         entry_data = self.booking_to_dict(new_booking)
-        response = self.session.put(f"https://api.bexio.com/3.0/accounting/manual_entries/{existing_booking.id}", json=entry_data)
+        response = self.request("PUT", f"/3.0/accounting/manual_entries/{existing_booking.id}", json=entry_data)
         response.raise_for_status()
 
     def delete_booking(self, booking):
@@ -190,7 +310,7 @@ class BexioApiClient:
 
         :param booking: The booking to delete.
         """
-        response = self.session.delete(f"https://api.bexio.com/3.0/accounting/manual_entries/{booking.id}")
+        response = self.request("DELETE", f"/3.0/accounting/manual_entries/{booking.id}")
         response.raise_for_status()
 
 
@@ -1,38 +1,78 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 
 class BexioExporter:
     """
     A class to handle exporting bookings to Bexio (https://www.bexio.com).
     """
 
-    def __init__(self, api_client, from_date=None, till_date=None):
+    def __init__(self, api_client, from_date=None, till_date=None, ledger=None, workers=1,
+                 remove_duplicates=False):
         """
         Initializes the BexioExporter with an API client.
 
         :param api_client: An instance of the API client to interact with Bexio.
+        :param ledger: Optional local record of the exported bookings (see BexioLedger).
+        :param workers: Number of threads sending the changes to Bexio.
+        :param remove_duplicates: Delete Bexio entries duplicating the entry of an exported booking.
         """
         self.api_client = api_client
         self.from_date = from_date
         self.till_date = till_date
+        self.ledger = ledger
+        self.workers = workers
+        self.remove_duplicates = remove_duplicates
+        self.operations = []
 
-    def export_bookings(self, bookings):
+    def export_bookings(self, bookings, full_sync=False):
         """
         Exports the list of bookings to Bexio.
 
-        First, load all the manual entries from bexio into memory.
+        If there is a ledger, that has been reconciled with Bexio for the whole date range,
+        the bookings are compared with the ledger and only changed, new or removed
+        bookings are sent to Bexio.
+        Otherwise (or with full_sync), load all the manual entries from bexio into memory.
         Then, sync with the passed bookings and export or delete bexio entries as necessary.
+        The date range is recorded as reconciled in the ledger, if all operations succeeded.
 
         This allows for exporting the bookings repeatedly without duplicating entries.
 
         :param bookings: The list of bookings to be exported.
-        :return: Response from the Bexio API.
+        :param full_sync: Reconcile with all entries in Bexio, even if there is a ledger.
+        :return: Number of created, updated, deleted and failed bookings and a message.
         """
         try:
-            existing_bookings = self.api_client.get_existing_bookings(self.from_date, self.till_date)
+            if self.ledger is not None and not full_sync and self.ledger.covers(self.from_date, self.till_date):
+                bookings = list(bookings)
+                ledger_entries = self.ledger.entries(self.from_date, self.till_date)
+                # bookings moved into the date range were exported with another booking date
+                moved_entries = self.ledger.entries_by_docnumber(
+                    [booking.docnumber for booking in bookings if booking.docnumber not in ledger_entries])
+                result = self.sync_bookings_incremental(ledger_entries, bookings, moved_entries)
+                return (result, self.result_message())
+
+            # load all the entries first, so a failure leaves the ledger as it is
+            existing_bookings = list(self.api_client.get_existing_bookings(self.from_date, self.till_date))
+            if self.ledger is not None:
+                started = self.ledger.begin_sync()
 
-            return (self.sync_bookings(existing_bookings, bookings), "OK")
+            result = self.sync_bookings(existing_bookings, bookings)
+            if self.ledger is not None and not self.failed_operations():
+                self.ledger.end_sync(self.from_date, self.till_date, started)
+            return (result, self.result_message())
         except Exception as e:
             return ({}, str(e))
 
+    def result_message(self):
+        """
+        "OK" or the errors of the failed operations.
+        """
+        failed = self.failed_operations()
+        if not failed:
+            return "OK"
+        return "\n".join(f"{operation.docnumber}: {operation.error}" for operation in failed)
+
     def sync_bookings(self, existing_bookings, new_bookings):
         """
         Syncs existing bookings with new bookings.
@@ -41,14 +81,20 @@ class BexioExporter:
         :param new_bookings: The new bookings to be exported.
         :return: Response from the Bexio API after syncing.
         """
-        existing_by_docnumber = {booking.docnumber: booking for booking in existing_bookings}
+        operations = []
+        existing_by_docnumber = {}
+        duplicates = []
+        for booking in existing_bookings:
+            if booking.docnumber in existing_by_docnumber:
+                duplicates.append(existing_by_docnumber[booking.docnumber])
+            existing_by_docnumber[booking.docnumber] = booking
         new_by_docnumber = {booking.docnumber: booking for booking in new_bookings}
 
-        result = {
-            'created': 0,
-            'updated': 0,
-            'deleted': 0
-        }
+        for booking in duplicates:
+            # duplicates of removed bookings are deleted as well,
+            # other duplicates only if requested
+            if self.remove_duplicates or booking.docnumber not in new_by_docnumber:
+                operations.append(BookingOperation('deleted', None, booking))
 
         for booking in new_bookings:
             if booking.docnumber in existing_by_docnumber:
@@ -58,26 +104,133 @@ class BexioExporter:
                     # bexio only accepts bookings with different debit and credit accounts
                     # so we need to update or delete the existing booking accordingly
                     if booking.debit_account != booking.credit_account:
-                        self.api_client.update_booking(existing_booking, booking)
-                        result['updated'] += 1
+                        operations.append(BookingOperation('updated', booking, existing_booking))
                     else:
-                        self.api_client.delete_booking(existing_booking)
-                        result['deleted'] += 1
+                        operations.append(BookingOperation('deleted', None, existing_booking))
+                else:
+                    self.record_existing_booking(booking, existing_booking)
 
             else:
                 if booking.debit_account == booking.credit_account:
                     # bexio does not allow bookings with the same debit and credit account
                     continue
-                self.api_client.create_booking(booking)
-                result['created'] += 1
+                operations.append(BookingOperation('created', booking))
 
-        for booking in existing_bookings:
+        for booking in existing_by_docnumber.values():
             if booking.docnumber not in new_by_docnumber:
-                self.api_client.delete_booking(booking)
-                result['deleted'] += 1
+                operations.append(BookingOperation('deleted', None, booking))
+
+        return self.run_operations(operations)
+
+    def sync_bookings_incremental(self, ledger_entries, new_bookings, moved_entries=None):
+        """
+        Syncs the bookings recorded in the ledger with new bookings.
+        Only bookings that differ from the ledger are sent to Bexio.
+        Entries not matching a new booking are only deleted within the date range.
+
+        :param ledger_entries: dictionary of docnumber -> (bexio id, content hash)
+                               of the bookings exported within the date range.
+        :param new_bookings: The new bookings to be exported.
+        :param moved_entries: dictionary of docnumber -> (bexio id, content hash)
+                              of new bookings exported with a booking date outside the date range.
+        :return: Response from the Bexio API after syncing.
+        """
+        exported_entries = {**(moved_entries or {}), **ledger_entries}
+        operations = []
+        new_docnumbers = set()
+        for booking in new_bookings:
+            new_docnumbers.add(booking.docnumber)
+            if booking.docnumber in exported_entries:
+                bexio_id, content_hash = exported_entries[booking.docnumber]
+                if content_hash == self.booking_hash(booking):
+                    continue
+
+                existing_booking = ExportedBooking(booking.docnumber, bexio_id)
+                if booking.debit_account != booking.credit_account:
+                    operations.append(BookingOperation('updated', booking, existing_booking))
+                else:
+                    operations.append(BookingOperation('deleted', None, existing_booking))
+
+            else:
+                if booking.debit_account == booking.credit_account:
+                    # bexio does not allow bookings with the same debit and credit account
+                    continue
+                operations.append(BookingOperation('created', booking))
+
+        for docnumber, (bexio_id, _content_hash) in ledger_entries.items():
+            if docnumber not in new_docnumbers:
+                operations.append(BookingOperation('deleted', None, ExportedBooking(docnumber, bexio_id)))
+
+        return self.run_operations(operations)
+
+    def run_operations(self, operations):
+        """
+        Sends the operations to Bexio using a pool of worker threads.
+        A failing operation doesn't stop the others, the outcome of each operation
+        is kept in self.operations. The ledger is updated for successful operations.
+
+        :param operations: The list of BookingOperation to send.
+        :return: Number of created, updated, deleted and failed bookings.
+        """
+        result = {
+            'created': 0,
+            'updated': 0,
+            'deleted': 0,
+            'failed': 0
+        }
+        self.operations = operations
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {pool.submit(operation.execute, self.api_client): operation for operation in operations}
+            # the ledger is only accessed from this thread
+            for future in as_completed(futures):
+                operation = futures[future]
+                if future.exception() is not None:
+                    operation.error = str(future.exception())
+                    result['failed'] += 1
+                    continue
+
+                if operation.kind == 'created':
+                    self.record_booking(operation.booking, operation.bexio_id)
+                elif operation.kind == 'updated':
+                    self.record_existing_booking(operation.booking, operation.existing_booking)
+                elif self.ledger is not None:
+                    # only the entry of the deleted bexio entry, not the one of a remaining duplicate
+                    self.ledger.delete_entry(operation.docnumber, operation.existing_booking.id)
+                result[operation.kind] += 1
 
         return result
 
+    def failed_operations(self):
+        return [operation for operation in self.operations if operation.error is not None]
+
+    def record_booking(self, booking, bexio_id):
+        """
+        record an exported booking in the ledger.
+        """
+        if self.ledger is not None:
+            self.ledger.save_entry(booking, bexio_id, self.booking_hash(booking))
+
+    def record_existing_booking(self, booking, existing_booking):
+        """
+        record a booking in the ledger, that is already present in Bexio.
+        """
+        if self.ledger is not None:
+            self.record_booking(booking, existing_booking.id)
+
+    def booking_hash(self, booking):
+        """
+        Hash of the booking content considered by bookings_are_equal.
+        """
+        content = '|'.join(str(value) for value in (
+            booking.docnumber,
+            booking.date,
+            booking.text,
+            booking.debit_account,
+            booking.credit_account,
+            float(booking.price)))
+        return hashlib.sha256(content.encode('utf8')).hexdigest()
+
     def bookings_are_equal(self, booking1, booking2):
         """
         Compares two bookings to determine if they are equal.
@@ -93,3 +246,40 @@ class BexioExporter:
                 booking1.debit_account == booking2.debit_account and
                 booking1.credit_account == booking2.credit_account and
                 booking1.text == booking2.text)
+
+
+class ExportedBooking:
+    """
+    Reference to a booking exported to Bexio, as recorded in the ledger.
+    """
+    def __init__(self, docnumber, id):
+        self.docnumber = docnumber
+        self.id = id
+
+
+class BookingOperation:
+    """
+    Change of a single booking to be sent to Bexio.
+    kind is one of created, updated or deleted.
+    """
+    def __init__(self, kind, booking, existing_booking=None):
+        self.kind = kind
+        self.booking = booking
+        self.existing_booking = existing_booking
+        self.bexio_id = None
+        self.error = None
+
+    @property
+    def docnumber(self):
+        return (self.booking or self.existing_booking).docnumber
+
+    def execute(self, api_client):
+        if self.kind == 'created':
+            self.bexio_id = api_client.create_booking(self.booking)
+        elif self.kind == 'updated':
+            api_client.update_booking(self.existing_booking, self.booking)
+        else:
+            api_client.delete_booking(self.existing_booking)
+
+    def __repr__(self):
+        return 'BookingOperation %s %s' % (self.kind, self.docnumber)
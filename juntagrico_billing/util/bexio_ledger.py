@@ -0,0 +1,89 @@
+from datetime import date, timedelta
+
+from django.utils import timezone
+
+from juntagrico_billing.models.bexio import BexioLedgerEntry, BexioSyncedRange
+
+
+class BexioLedger:
+    """
+    Local record of the bookings exported to Bexio,
+    stored in the BexioLedgerEntry table.
+    """
+
+    def entries(self, from_date=None, till_date=None):
+        """
+        returns a dictionary of docnumber -> (bexio id, content hash)
+        of the bookings exported within the date range.
+        """
+        return self.as_dict(self.in_daterange(from_date, till_date))
+
+    def entries_by_docnumber(self, docnumbers):
+        """
+        returns a dictionary of docnumber -> (bexio id, content hash)
+        of the exported bookings with the docnumbers, whatever their booking date.
+        """
+        return self.as_dict(BexioLedgerEntry.objects.filter(docnumber__in=docnumbers))
+
+    def as_dict(self, entries):
+        return {
+            docnumber: (bexio_id, content_hash)
+            for docnumber, bexio_id, content_hash
+            in entries.values_list('docnumber', 'bexio_id', 'content_hash')
+        }
+
+    def save_entry(self, booking, bexio_id, content_hash):
+        BexioLedgerEntry.objects.update_or_create(
+            docnumber=booking.docnumber,
+            defaults={
+                'bexio_id': bexio_id,
+                'booking_date': booking.date,
+                'content_hash': content_hash,
+            })
+
+    def delete_entry(self, docnumber, bexio_id):
+        BexioLedgerEntry.objects.filter(docnumber=docnumber, bexio_id=bexio_id).delete()
+
+    def covers(self, from_date=None, till_date=None):
+        """
+        whether the date range is fully covered by date ranges
+        reconciled with all the entries in Bexio.
+        """
+        start = from_date or date.min
+        end = till_date or date.max
+        synced_ranges = sorted(
+            (synced_from or date.min, synced_till or date.max)
+            for synced_from, synced_till in BexioSyncedRange.objects.values_list('from_date', 'till_date'))
+        for synced_from, synced_till in synced_ranges:
+            if synced_from > start:
+                # gap before this range
+                return False
+            if synced_till >= end:
+                return True
+            if synced_till >= start:
+                start = synced_till + timedelta(days=1)
+        return False
+
+    def begin_sync(self):
+        """
+        start reconciling the ledger with all the entries in Bexio.
+        returns the start time to be passed to end_sync.
+        """
+        return timezone.now()
+
+    def end_sync(self, from_date, till_date, started):
+        """
+        complete a successful reconciliation of the date range.
+        all bookings found in Bexio have been recorded since started,
+        the remaining entries of the date range are not in Bexio anymore.
+        """
+        self.in_daterange(from_date, till_date).filter(exported__lt=started).delete()
+        BexioSyncedRange.objects.create(from_date=from_date, till_date=till_date)
+
+    def in_daterange(self, from_date, till_date):
+        entries = BexioLedgerEntry.objects.all()
+        if from_date:
+            entries = entries.filter(booking_date__gte=from_date)
+        if till_date:
+            entries = entries.filter(booking_date__lte=till_date)
+        return entries
@@ -0,0 +1,106 @@
+import threading
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models import F
+
+from juntagrico_billing.models.bill import Bill
+from juntagrico_billing.util.billing import update_bill_amounts, invalidate_memberbalances
+from juntagrico_billing.util.summaries import invalidate_summaries
+
+# bills changed within the deferred_bill_totals context of the current thread
+_deferred = threading.local()
+
+# fields of a bill maintained by update_bill_totals
+TOTAL_FIELDS = ('amount', 'amount_paid', 'amount_open', 'paid')
+
+
+class ChangedBills(object):
+    """
+    bills with changed items or payments, waiting for
+    the recomputation of their totals.
+    """
+
+    def __init__(self):
+        self.bill_ids = set()
+        self.paid_bill_ids = set()
+        self.fromdate = None
+
+    def add(self, bill_id, fromdate=None, payment=False):
+        self.bill_ids.add(bill_id)
+        if payment:
+            self.paid_bill_ids.add(bill_id)
+        if fromdate and (self.fromdate is None or fromdate < self.fromdate):
+            self.fromdate = fromdate
+
+
+def update_bill_totals(bill_ids, paid_bill_ids=(), fromdate=None):
+    """
+    recompute the amount, paid and open amount of bills
+    with one aggregate query for all of them.
+    bills with changed payments are marked as paid, if the full amount is reached.
+    returns the new totals per bill id.
+    """
+    with transaction.atomic():
+        # lock the bills, so that concurrent changes on
+        # the same bills are summed up one after the other
+        bills = Bill.objects.select_for_update().filter(id__in=bill_ids)
+        booking_dates = [booking_date for (booking_date,) in bills.values_list('booking_date')]
+        if not booking_dates:
+            return {}
+
+        update_bill_amounts(bills)
+        if paid_bill_ids:
+            bills.filter(id__in=paid_bill_ids, paid=False, amount_paid__gte=F('amount')).update(paid=True)
+
+    # update() sends no signals, invalidate the balance snapshots and summaries
+    if fromdate:
+        booking_dates.append(fromdate)
+    invalidate_memberbalances(min(booking_dates))
+    invalidate_summaries()
+
+    return {totals['id']: totals for totals in bills.values('id', *TOTAL_FIELDS)}
+
+
+def bill_changed(instance, fromdate=None, payment=False):
+    """
+    recompute the totals of the bill of a changed item or payment.
+    within deferred_bill_totals, the bill is recomputed only once at the end.
+    otherwise it is recomputed immediately and the totals are also set
+    on the bill object of the instance, if it is loaded.
+    """
+    bill_id = instance.bill_id
+    changed = getattr(_deferred, 'changed', None)
+    if changed is not None:
+        changed.add(bill_id, fromdate, payment)
+        return
+
+    totals = update_bill_totals([bill_id], [bill_id] if payment else (), fromdate)
+    if bill_id in totals and type(instance).bill.is_cached(instance):
+        for field in TOTAL_FIELDS:
+            setattr(instance.bill, field, totals[bill_id][field])
+
+
+@contextmanager
+def deferred_bill_totals():
+    """
+    defer the recomputation of bill totals for changes of items and payments
+    made within the context.
+    the totals of each changed bill are recomputed once, when the surrounding
+    transaction is committed (or at the end of the context, outside of a transaction).
+    bill objects held in memory are not updated.
+    """
+    if getattr(_deferred, 'changed', None) is not None:
+        # nested context, recomputed by the outermost context
+        yield
+        return
+
+    changed = _deferred.changed = ChangedBills()
+    try:
+        yield
+    finally:
+        _deferred.changed = None
+
+    if changed.bill_ids:
+        transaction.on_commit(lambda: update_bill_totals(
+            changed.bill_ids, changed.paid_bill_ids, changed.fromdate))
@@ -1,57 +1,35 @@
 from collections import defaultdict
-from datetime import date
-from decimal import Decimal
+from datetime import date, timedelta
 
 from django.utils.translation import gettext as _
 from juntagrico.entity.subs import SubscriptionPart
 from django.contrib.messages import error
-from django.db.models import Sum, Q
+from django.db import connection, transaction
+from django.db.models import Sum, Q, F, Exists, OuterRef, Subquery, FloatField, prefetch_related_objects
+from django.db.models.functions import Coalesce
 
-from juntagrico.util.xls import generate_excel
 from juntagrico.entity.member import Member
+from juntagrico_billing.models.balance import MemberBalance, YearClosing
 from juntagrico_billing.models.bill import Bill, BillItem
 from juntagrico_billing.models.payment import Payment
 from juntagrico_billing.models.settings import Settings
+from juntagrico_billing.util.export import export_response, negotiate_format
+from juntagrico_billing.util.pricing import get_price_table, invalidate_price_tables
+from juntagrico_billing.util.summaries import invalidate_summaries
 
 
 def scale_subscriptionpart_price(part, fromdate, tilldate):
     """
     scale subscription part price for a certain date interval.
+    uses the cached price table of the date interval.
     """
+    table = get_price_table(fromdate, tilldate)
+    if part.type_id not in table:
+        # type created after the table was built
+        invalidate_price_tables()
+        table = get_price_table(fromdate, tilldate)
 
-    if part.type.periods.count():
-        # calculate price based on billing periods.
-        # takes into account periods that overlap with the requested interval.
-        period_prices = []
-        for period in part.type.periods.all():
-            period_start = date(fromdate.year, period.start_month, period.start_day)
-            period_end = date(fromdate.year, period.end_month, period.end_day)
-            if period_start <= tilldate and period_end >= fromdate:
-                # calculate the resulting start and end of the period that overlaps
-                # with the activation date and our requested date interval
-                eff_start = max(fromdate, max(period_start, part.activation_date or date.min))
-                eff_end = min(tilldate, min(period_end, part.deactivation_date or date.max))
-
-                # scale the period price
-                full_days = (period_end - period_start).days + 1
-                eff_days = (eff_end - eff_start).days + 1
-
-                period_prices.append(period.price * Decimal(eff_days / full_days))
-
-        # round to .05
-        return round(Decimal(2.0) * sum(period_prices), 1) / Decimal('2.0')
-
-    # otherwise
-    # calculate price without billing periods.
-    # just scale the subscription type price proportionately
-    days_period = (tilldate - fromdate).days + 1
-    if part.activation_date and part.activation_date <= tilldate:
-        part_start = max(part.activation_date or date.min, fromdate)
-        part_end = min(part.deactivation_date or date.max, tilldate)
-        days_part = (part_end - part_start).days + 1
-        return round(part.type.price * Decimal(2.0 * days_part / days_period), 1) / Decimal('2.0')
-
-    return 0
+    return table.part_price(part)
 
 
 def get_billable_subscription_parts(business_year):
@@ -62,91 +40,86 @@ def get_billable_subscription_parts(business_year):
     from_date = business_year.start_date
     till_date = business_year.end_date
 
-    # prepare a dictionary with member, subscription_part tuples as keys
-    # based on the bills of this year
-    bill_items = BillItem.objects.filter(bill__business_year=business_year)
-    bill_parts = [itm.subscription_part for itm in bill_items if itm.subscription_part]
+    # bill items referencing a part on a bill of this year
+    billed_items = BillItem.objects.filter(
+        subscription_part=OuterRef('pk'),
+        bill__business_year=business_year)
 
-    # get all active subscription parts for billing period
-    active_parts = SubscriptionPart.objects.in_daterange(from_date, till_date)
-
-    # get parts that are not billed yet
-    billed_dict = dict([(part, None) for part in bill_parts])
-
-    not_billed = [part for part in active_parts if part not in billed_dict]
-
-    return not_billed
-
-
-def update_bill_parts(bill, subscription_parts):
-    """
-    update a bill with the given subscription parts.
-    all existing parts will be removed and replaced by the new ones.
-    """
-    # remove existing subscription part items
-    for itm in bill.items.all():
-        if itm.subscription_part:
-            itm.delete()
-
-    for part in subscription_parts:
-        price = scale_subscriptionpart_price(
-            part,
-            bill.business_year.start_date,
-            bill.business_year.end_date)
-        text = str(part.type)
-        bill_item = BillItem.objects.create(
-            bill=bill, subscription_part=part,
-            amount=float(price), description=text)
-        # vat amount is calculated on save
-        bill_item.save()
-
-    # set total amount on bill
-    bill.amount = sum([itm.amount for itm in bill.items.all()])
-    bill.save()
+    # get active subscription parts for billing period that are not billed yet
+    return SubscriptionPart.objects.in_daterange(from_date, till_date)\
+        .filter(~Exists(billed_items))\
+        .select_related('subscription__primary_member', 'type__size__product')
 
 
 def create_bill(billable_items, businessyear, bill_date, vat_rate=0.0):
-    booking_date = max(businessyear.start_date, bill_date)
-
     # make sure all billables belong to the same member
     billables_per_member = group_billables_by_member(billable_items)
     if len(billables_per_member) > 1:
         raise Exception('billable items belong to different members')
 
     # create bill for member
-    member = list(billables_per_member.keys())[0]
-    bill = Bill.objects.create(business_year=businessyear, amount=0.0, member=member,
-                               bill_date=bill_date, booking_date=booking_date,
-                               vat_rate=vat_rate)
-
-    update_bill_parts(bill, billable_items)
-    return bill
+    return bulk_create_bills(billables_per_member, businessyear, bill_date, vat_rate)[0]
 
 
-def recalc_bill(bill):
+def bulk_create_bills(parts_per_member, businessyear, bill_date, vat_rate=0.0):
     """
-    update an existing bill with all items that are not
-    on another bill in the same businessyear.
+    create a bill per member for a dictionary of members and their
+    subscription parts.
+    bills and items are calculated in memory (including amount and
+    vat amount) and written with bulk inserts inside one transaction.
+    as bulk inserts don't send signals, the lifecycle recalculation of
+    the bill amount per item is skipped.
     """
-    # get all subscription parts for member and businessyear
-    year = bill.business_year
-    member = bill.member
-    parts_in_year = SubscriptionPart.objects.by_primary_member(member).in_daterange(year.start_date, year.end_date)
-
-    # determine if part is on another bill in the same year
-    def is_on_other_bill(part):
-        items = part.bill_items.all()
-        for itm in items:
-            if itm.bill:
-                if itm.bill != bill:
-                    if itm.bill.business_year == year:
-                        return True
-        return False
+    booking_date = max(businessyear.start_date, bill_date)
 
-    parts = [part for part in parts_in_year
-             if not is_on_other_bill(part)]
+    # make sure item descriptions don't query per part
+    all_parts = [part for parts in parts_per_member.values() for part in parts]
+    prefetch_related_objects(all_parts, 'type__size__product')
+
+    bills_and_items = []
+    for member, parts in parts_per_member.items():
+        bill = Bill(business_year=businessyear, member=member,
+                    bill_date=bill_date, booking_date=booking_date,
+                    vat_rate=vat_rate)
+        items = []
+        for part in parts:
+            price = scale_subscriptionpart_price(
+                part,
+                businessyear.start_date,
+                businessyear.end_date)
+            item = BillItem(
+                bill=bill, subscription_part=part,
+                amount=float(price), description=str(part.type))
+            item.calc_vat_amount()
+            items.append(item)
+
+        bill.amount = sum([itm.amount for itm in items])
+        # bulk_create doesn't call save(), set open amount explicitly
+        bill.amount_open = bill.amount
+        bills_and_items.append((bill, items))
+
+    bills = [bill for bill, items in bills_and_items]
+    with transaction.atomic():
+        if connection.features.can_return_rows_from_bulk_insert:
+            Bill.objects.bulk_create(bills)
+        else:
+            # backend doesn't return primary keys on bulk inserts
+            for bill in bills:
+                bill.save()
+
+        all_items = []
+        for bill, items in bills_and_items:
+            for item in items:
+                # set the foreign key now that the bill has a primary key
+                item.bill = bill
+                all_items.append(item)
+        BillItem.objects.bulk_create(all_items)
+
+        # bulk_create sends no signals, invalidate the balance snapshots and summaries
+        invalidate_memberbalances(booking_date)
+        invalidate_summaries()
 
-    update_bill_parts(bill, parts)
+    return bills
 
 
 def group_billables_by_member(billable_items):
@@ -172,15 +145,14 @@ def create_bills_for_items(billable_items, businessyear, bill_date):
     # get current vat percentage from settings
     vat_rate = round(Settings.objects.first().vat_percent / 100, 4)
 
+    # avoid a query per part when grouping by member
+    prefetch_related_objects(billable_items, 'subscription__primary_member')
+
     # get dictionary of billables per member
     items_per_member = group_billables_by_member(billable_items)
 
     # create a bill per member
-    bills = []
-    for items in items_per_member.values():
-        bills.append(create_bill(items, businessyear, bill_date, vat_rate))
-
-    return bills
+    return bulk_create_bills(items_per_member, businessyear, bill_date, vat_rate)
 
 
 def get_open_bills(businessyear, expected_percentage_paid):
@@ -189,12 +161,47 @@ def get_open_bills(businessyear, expected_percentage_paid):
     bills are considered open, if the percentage of paid amount is less
     than the given expected percentage.
     """
-    # fetch unpaid bills, SQL filtered
-    unpaid_bills = businessyear.bills.filter(paid=False, published=True)
+    return businessyear.bills.filter(
+        paid=False, published=True, amount__gt=0,
+        amount_paid__lt=F('amount') * expected_percentage_paid / 100.0)
+
+
+def bill_total(queryset):
+    """
+    subquery expression summing up the amounts of queryset per bill.
+    """
+    totals = queryset.filter(bill=OuterRef('pk'))\
+        .order_by().values('bill')\
+        .annotate(total=Sum('amount')).values('total')
+    return Coalesce(Subquery(totals, output_field=FloatField()), 0.0)
+
+
+def update_paid_amounts(bills):
+    """
+    recalculate the paid and open amount of the given bills
+    from their payments.
+    returns the number of updated bills.
+    """
+    amount_paid = bill_total(Payment.objects.all())
 
-    return [
-        bill for bill in unpaid_bills
-        if (bill.amount > 0) and (bill.amount_paid / bill.amount * 100.0 < expected_percentage_paid)]
+    return bills.update(
+        amount_paid=amount_paid,
+        amount_open=F('amount') - amount_paid)
+
+
+def update_bill_amounts(bills):
+    """
+    recalculate the total amount of the given bills from their items
+    and the paid and open amount from their payments.
+    returns the number of updated bills.
+    """
+    amount = bill_total(BillItem.objects.all())
+    amount_paid = bill_total(Payment.objects.all())
+
+    return bills.update(
+        amount=amount,
+        amount_paid=amount_paid,
+        amount_open=amount - amount_paid)
 
 
 def get_unpublished_bills():
@@ -207,81 +214,205 @@ def get_unpublished_bills():
 def publish_bills(id_list):
     """
     Publishes a set of bills given by their ids.
+    returns the number of newly published bills.
     """
-    for bill_id in id_list:
-        bill = Bill.objects.get(pk=bill_id)
-        bill.published = True
-        bill.save()
+    return Bill.objects.filter(id__in=id_list, published=False).update(published=True)
 
 
-def update_vat(bill):
+def update_vat(bills):
     """
-    update the vat amount on a bill.
+    update the vat rate and the vat amount of all items
+    on a set of bills.
+    returns the number of updated bills.
     """
     # get the current vat rate from settings
-    bill.vat_rate = round(Settings.objects.first().vat_percent / 100, 4)
-    bill.save()
+    vat_rate = round(Settings.objects.first().vat_percent / 100, 4)
 
-    # update the vat amount on all items
-    for itm in bill.items.all():
-        itm.save()
+    with transaction.atomic():
+        count = bills.update(vat_rate=vat_rate)
 
+        # recalculate the vat amount on all items in memory
+        # and write back the changed ones
+        changed_items = []
+        for itm in BillItem.objects.filter(bill__in=bills).select_related('bill'):
+            vat_amount = itm.vat_amount
+            itm.calc_vat_amount()
+            if itm.vat_amount != vat_amount:
+                changed_items.append(itm)
+        BillItem.objects.bulk_update(changed_items, ['vat_amount'], batch_size=1000)
 
-def add_balancing_payment(request, bill):
+    return count
+
+
+def add_balancing_payments(request, bills):
     """
-    balance bill by adding a compensation payment (usually solidarity fund contribution)
+    balance bills by adding a compensation payment (usually solidarity fund contribution)
+    to each bill with an open amount.
+    returns the number of balanced bills.
     """
     # get the payment type from settings
     balancing_paymenttype = Settings.objects.first().balancing_paymenttype
     if not balancing_paymenttype:
         error(request, _("No balancing payment type configured."))
-        return
+        return 0
+
+    paid_date = date.today()
+    with transaction.atomic():
+        # lock the bills, so that concurrent payments
+        # don't change the open amounts meanwhile
+        open_bills = bills.select_for_update().exclude(amount_open=0)
+        payments = [
+            Payment(bill_id=bill_id, amount=amount_open,
+                    paid_date=paid_date, type=balancing_paymenttype)
+            for bill_id, amount_open in open_bills.values_list('id', 'amount_open')]
+        if not payments:
+            return 0
+
+        # add the payments to balance the bills
+        Payment.objects.bulk_create(payments)
+
+        # bulk_create sends no signals, update the paid amounts
+        balanced_bills = Bill.objects.filter(id__in=[payment.bill_id for payment in payments])
+        update_paid_amounts(balanced_bills)
+        balanced_bills.update(paid=True)
+        invalidate_memberbalances(paid_date)
+        invalidate_summaries()
 
-    # add a payment to balance the bill
-    if bill.amount_open:
-        payment = Payment.objects.create(bill=bill, amount=bill.amount_open,
-                                         paid_date=date.today(),
-                                         type=balancing_paymenttype)
-        payment.save()
-        bill.paid = True
-        bill.save()
+    return len(payments)
 
 
-def get_memberbalances(keydate):
+# fields of the member balance rows
+MEMBERBALANCE_FIELDS = (
+    'id', 'first_name', 'last_name',
+    'billed_amount', 'billed_items_amount', 'paid_amount', 'balance'
+)
+
+
+def member_total(queryset, member_field):
+    """
+    subquery expression summing up the amounts of queryset per member.
+    """
+    totals = queryset.filter(**{member_field: OuterRef('pk')})\
+        .order_by().values(member_field)\
+        .annotate(total=Sum('amount')).values('total')
+    return Coalesce(Subquery(totals, output_field=FloatField()), 0.0)
+
+
+def closing_total(closing, field):
+    """
+    subquery expression reading a member total from the balances
+    of a business year closing.
+    """
+    balances = MemberBalance.objects.filter(closing=closing, member=OuterRef('pk')).values(field)
+    return Coalesce(Subquery(balances, output_field=FloatField()), 0.0)
+
+
+def compute_memberbalances(keydate):
+    """
+    compute member balances for a given date.
+    bills, bill items and payments are summed up in independent subqueries,
+    so the totals are not multiplied by joins.
+    if a business year ending before the key date is closed, only the bookings
+    after it are summed up and added to the balances of its closing.
+    """
+    bills = Bill.objects.filter(booking_date__lte=keydate)
+    items = BillItem.objects.filter(bill__booking_date__lte=keydate)
+    payments = Payment.objects.filter(paid_date__lte=keydate)
+
+    closing = YearClosing.objects.latest_until(keydate)
+    if closing:
+        since = closing.business_year.end_date
+        bills = bills.filter(booking_date__gt=since)
+        items = items.filter(bill__booking_date__gt=since)
+        payments = payments.filter(paid_date__gt=since)
+
+    totals = {
+        'billed_amount': member_total(bills, 'member'),
+        'billed_items_amount': member_total(items, 'bill__member'),
+        'paid_amount': member_total(payments, 'bill__member'),
+    }
+    if closing:
+        totals = {field: total + closing_total(closing, field) for field, total in totals.items()}
+
+    return Member.objects.annotate(**totals).filter(billed_amount__gt=0)\
+        .annotate(balance=F('billed_items_amount') - F('paid_amount'))\
+        .order_by('last_name', 'first_name', 'id')\
+        .values(*MEMBERBALANCE_FIELDS)
+
+
+def get_memberbalances(keydate, snapshot=False):
     """
     get member balances for a given date.
+    with snapshot, the balances are stored for the key date
+    and read from the stored snapshot on subsequent calls.
+    """
+    if not snapshot:
+        return list(compute_memberbalances(keydate))
+
+    snapshots = MemberBalance.objects.filter(keydate=keydate)
+    balances = list(snapshots.order_by('member__last_name', 'member__first_name', 'member_id').values(
+        'member_id', 'billed_amount', 'billed_items_amount', 'paid_amount', 'balance',
+        first_name=F('member__first_name'), last_name=F('member__last_name')))
+    if balances:
+        for balance in balances:
+            balance['id'] = balance.pop('member_id')
+        return balances
+
+    balances = list(compute_memberbalances(keydate))
+    store_memberbalances(keydate, balances)
+
+    return balances
+
+
+def store_memberbalances(keydate, balances, closing=None):
+    """
+    store member balances as snapshot of the key date.
     """
-    members_billed_amount = Member.objects.annotate(
-        billed_amount=Sum('bills__amount', filter=Q(bills__booking_date__lte=keydate)),
-        ).filter(billed_amount__gt=0).values('id', 'first_name', 'last_name', 'billed_amount')
-    member_billed_items_amount = Member.objects.annotate(
-        billed_items_amount=Sum('bills__items__amount', filter=Q(bills__booking_date__lte=keydate)),
-        ).filter(billed_items_amount__gt=0).values('id', 'billed_items_amount')
-    members_paid_amount = Member.objects.annotate(
-        paid_amount=Sum('bills__payments__amount', filter=Q(bills__payments__paid_date__lte=keydate)),
-        ).filter(paid_amount__gt=0).values('id', 'first_name', 'last_name', 'paid_amount')
+    MemberBalance.objects.bulk_create([
+        MemberBalance(
+            keydate=keydate, member_id=balance['id'], closing=closing,
+            billed_amount=balance['billed_amount'],
+            billed_items_amount=balance['billed_items_amount'],
+            paid_amount=balance['paid_amount'],
+            balance=balance['balance'])
+        for balance in balances], ignore_conflicts=True)
 
-    member_dict = {}
-    for member in members_billed_amount:
-        member_dict[member['id']] = member
 
-    for member in members_paid_amount:
-        if member['id'] in member_dict:
-            member_dict[member['id']].update(member)
+def invalidate_memberbalances(fromdate):
+    """
+    delete the member balance snapshots affected
+    by a change of bookings on or after fromdate.
+    the closings of business years ending on or after fromdate
+    are deleted with their balances, i.e. these years are reopened.
+    """
+    YearClosing.objects.filter(business_year__end_date__gte=fromdate).delete()
+    MemberBalance.objects.filter(keydate__gte=fromdate).delete()
 
-    for member in member_billed_items_amount:
-        if member['id'] in member_dict:
-            member_dict[member['id']].update(member)
 
-    for member in member_dict.values():
-        member['balance'] = member.get('billed_items_amount', 0) - member.get('paid_amount', 0)
+def booking_changed(instance, fieldnames, **kwargs):
+    """
+    whether saving or deleting an instance changes the billed or paid amounts,
+    i.e. the instance is new, deleted, or one of the fields differs from the state it was loaded with.
+    kwargs are the arguments of the post_save or post_delete signal.
+    """
+    if kwargs.get('created', True) or instance._old is None:
+        return True
+    return any(getattr(instance, fieldname) != instance._old.get(fieldname) for fieldname in fieldnames)
 
-    return sorted(member_dict.values(), key=lambda x: x['last_name'])
+
+def earliest_date(instance, fieldname):
+    """
+    the earlier of the current date of an instance and the date it was loaded with,
+    so that moving a date later also invalidates the snapshots in between.
+    """
+    dates = [getattr(instance, fieldname), (instance._old or {}).get(fieldname)]
+    return min(value for value in dates if value is not None)
 
 
 def export_memberbalance_sheet(request, keydate):
     """
     Export a member balance sheet for a given date.
+    the format (excel or csv) is negotiated with the request.
     """
     fields = {
         'last_name': 'Nachname',
@@ -292,38 +423,58 @@ def export_memberbalance_sheet(request, keydate):
         'balance': 'Saldo'
     }
 
-    filename = 'memberbalances_{}.xlsx'.format(keydate)
-    lines = get_memberbalances(keydate)
+    filename = 'memberbalances_{}'.format(keydate)
+    # balances of past dates are kept as a snapshot for repeated exports
+    lines = get_memberbalances(keydate, snapshot=keydate < date.today())
 
-    return generate_excel(fields.items(), lines, filename)
+    return export_response(negotiate_format(request), fields.items(), lines, filename)
 
 def get_billing_summary(fromdate, tilldate):
     """
     get a summary of billing for a date range.
     returns a dictionary with total billed amount, total paid amount and
     total open amount.
+    bill items and payments are summed up with one query each,
+    using conditional aggregation for the range, start and end totals.
+    if a business year ending before the range is closed, only the bookings
+    after it are summed up and added to the totals of its closing.
     """
-    bills = Bill.objects.in_daterange(fromdate, tilldate)
-
-    range_billed = bills.aggregate(Sum('items__amount'))['items__amount__sum'] or Decimal('0.0')
-    
-    range_payments_query = Payment.objects.in_daterange(fromdate, tilldate)
-    range_payments = range_payments_query.aggregate(Sum('amount'))['amount__sum'] or Decimal('0.0')
-    
-    start_billed = Bill.objects.filter(booking_date__lt=fromdate).aggregate(Sum('items__amount'))['items__amount__sum'] or Decimal('0.0')
-    end_billed = Bill.objects.filter(booking_date__lte=tilldate).aggregate(Sum('items__amount'))['items__amount__sum'] or Decimal('0.0')
-
-    start_payments = Payment.objects.filter(paid_date__lt=fromdate).aggregate(Sum('amount'))['amount__sum'] or Decimal('0.0')
-    end_payments = Payment.objects.filter(paid_date__lte=tilldate).aggregate(Sum('amount'))['amount__sum'] or Decimal('0.0')
+    items = BillItem.objects.filter(bill__booking_date__lte=tilldate)
+    payments = Payment.objects.filter(paid_date__lte=tilldate)
+    closed_billed = closed_paid = 0.0
+
+    closing = YearClosing.objects.latest_until(fromdate - timedelta(days=1))
+    if closing:
+        since = closing.business_year.end_date
+        items = items.filter(bill__booking_date__gt=since)
+        payments = payments.filter(paid_date__gt=since)
+        closed_billed = closing.closing_billed
+        closed_paid = closing.closing_paid
+
+    billed = items.aggregate(
+        range_billed=Sum('amount', filter=Q(bill__booking_date__gte=fromdate)),
+        start_billed=Sum('amount', filter=Q(bill__booking_date__lt=fromdate)),
+        end_billed=Sum('amount'))
+    paid = payments.aggregate(
+        range_payments=Sum('amount', filter=Q(paid_date__gte=fromdate)),
+        start_payments=Sum('amount', filter=Q(paid_date__lt=fromdate)),
+        end_payments=Sum('amount'))
+
+    # sums over no rows are None
+    totals = {key: value or 0.0 for key, value in (billed | paid).items()}
+    for key in ('start_billed', 'end_billed'):
+        totals[key] += closed_billed
+    for key in ('start_payments', 'end_payments'):
+        totals[key] += closed_paid
 
     return {
-        'range_billed': range_billed,
-        'range_payments': range_payments,
-        'range_balance': range_billed - range_payments,
-        'start_billed': start_billed,
-        'end_billed': end_billed,
-        'start_balance': start_billed - start_payments,
-        'end_balance': end_billed - end_payments,
-        'start_payments': start_payments,
-        'end_payments': end_payments,
+        'range_billed': totals['range_billed'],
+        'range_payments': totals['range_payments'],
+        'range_balance': totals['range_billed'] - totals['range_payments'],
+        'start_billed': totals['start_billed'],
+        'end_billed': totals['end_billed'],
+        'start_balance': totals['start_billed'] - totals['start_payments'],
+        'end_balance': totals['end_billed'] - totals['end_payments'],
+        'start_payments': totals['start_payments'],
+        'end_payments': totals['end_payments'],
     }
@@ -1,13 +1,18 @@
+from collections import defaultdict
+
 from django.utils.translation import gettext as _
 
 from juntagrico_billing.models import Payment
-from juntagrico_billing.models.bill import Bill
+from juntagrico_billing.models.bill import BillItem
 from juntagrico_billing.models.settings import Settings
 
 # Offset for generating Document numbers for bookings
 DOCNUMBER_OFFSET_BILL = 500000
 DOCNUMBER_OFFSET_PAYMENT = 600000
 
+# number of rows fetched at once when iterating over bookings
+ITERATOR_CHUNK_SIZE = 2000
+
 
 class Booking(object):
     def __init__(self, date=None, docnumber=None, text=None, debit_account=None,
@@ -33,99 +38,160 @@ class Booking(object):
         }
 
 
-def get_bill_bookings(fromdate, tilldate):
-    # get all bills by business-year start, end
+# fields of the flat rows that bill bookings are built from
+ITEM_BOOKING_FIELDS = (
+    'bill_id', 'bill__booking_date', 'amount', 'vat_amount',
+    'bill__member__first_name', 'bill__member__last_name',
+    'bill__member__member_account__account',
+    'subscription_part_id', 'subscription_part__type__size__product__is_extra',
+    'subscription_part__type__subscriptiontype_account__account',
+    'custom_item_type__name', 'custom_item_type__booking_account',
+)
+
+# fields of the flat rows that payment bookings are built from
+PAYMENT_BOOKING_FIELDS = (
+    'id', 'paid_date', 'amount', 'type__booking_account', 'bill_id',
+    'bill__member__first_name', 'bill__member__last_name',
+    'bill__member__member_account__account',
+)
 
-    bills = Bill.objects.in_daterange(fromdate, tilldate)
+
+def get_bill_bookings(fromdate, tilldate):
+    """
+    bookings of the bill items of bills within the date range.
+    """
+    return list(iter_bill_bookings(fromdate, tilldate))
+
+
+def iter_bill_bookings(fromdate, tilldate):
+    """
+    generate the bookings of the bill items of bills within the date range,
+    ordered by date and document number.
+    the items are read with a single joined query and
+    bookings are created while iterating over it.
+    """
+    items = BillItem.objects.filter(
+        bill__booking_date__gte=fromdate, bill__booking_date__lte=tilldate)\
+        .order_by('bill__booking_date', 'bill_id', 'id').values(*ITEM_BOOKING_FIELDS)
 
     # global debtor account on settings object
     debtor_account = Settings.objects.first().debtor_account
 
-    bookings = []
+    idx = 0
+    bill_id = None
+    for row in items.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
+        # sequence number of the item on the bill
+        idx = idx + 1 if row['bill_id'] == bill_id else 0
+        bill_id = row['bill_id']
+        yield create_item_booking(idx, row, debtor_account)
+
+
+def item_kind(row):
+    """
+    the type of a bill item (see BillItem.item_kind) from a flat row.
+    """
+    if row['subscription_part_id']:
+        if row['subscription_part__type__size__product__is_extra']:
+            return _('Extrasubscription')
+        else:
+            return _('Subscription')
+    elif row['custom_item_type__name'] is not None:
+        return row['custom_item_type__name']
+    else:
+        return ''
 
-    for bill in bills:
-        for idx, item in enumerate(bill.items.all()):
-            bookings.append(create_item_booking(idx, item, debtor_account))
 
-    return bookings
+def member_name(row):
+    return '%s %s' % (row['bill__member__first_name'], row['bill__member__last_name'])
 
 
-def create_item_booking(idx, item, debtor_account):
+def create_item_booking(idx, row, debtor_account):
     booking = Booking()
-    bill = item.bill
+    bill_id = row['bill_id']
 
-    booking.date = bill.booking_date
+    booking.date = row['bill__booking_date']
     booking.credit_account = ""
-    if item.subscription_part:
-        stype = item.subscription_part.type
-        if hasattr(stype, "subscriptiontype_account"):
-            booking.credit_account = stype.subscriptiontype_account.account
-        else:
-            booking.credit_account = ""
+    if row['subscription_part_id']:
+        booking.credit_account = row['subscription_part__type__subscriptiontype_account__account'] or ""
 
-    elif item.custom_item_type:
-        booking.credit_account = item.custom_item_type.booking_account
+    elif row['custom_item_type__booking_account'] is not None:
+        booking.credit_account = row['custom_item_type__booking_account']
 
     # docnumber is DOCNUMBER_OFFSET_BILL + id of bill*10 + sequencenumber of bill item
-    booking.docnumber = str(DOCNUMBER_OFFSET_BILL + bill.id * 10 + idx + 1)
+    booking.docnumber = str(DOCNUMBER_OFFSET_BILL + bill_id * 10 + idx + 1)
 
     # "Bl" is short form for "Bill"
-    booking.text = "%s %d: %s %s" % (_('Bl'), bill.id, item.item_kind, bill.member)
+    booking.text = "%s %d: %s %s" % (_('Bl'), bill_id, item_kind(row), member_name(row))
     booking.debit_account = debtor_account
-    if item.amount >= 0:
-        booking.price = item.amount
-        booking.vat_amount = item.vat_amount
+    if row['amount'] >= 0:
+        booking.price = row['amount']
+        booking.vat_amount = row['vat_amount']
     else:
         # negative amount: exchange accounts and set positive amount
-        booking.price = -item.amount
-        booking.vat_amount = -item.vat_amount
+        booking.price = -row['amount']
+        booking.vat_amount = -row['vat_amount']
         booking.debit_account = booking.credit_account
         booking.credit_account = debtor_account
 
-    if hasattr(bill.member, "member_account"):
-        booking.member_account = bill.member.member_account.account
-    else:
-        booking.member_account = ""
+    booking.member_account = row['bill__member__member_account__account'] or ""
 
     return booking
 
 
 def get_payment_bookings(fromdate, tilldate):
+    """
+    bookings of the payments within the date range.
+    """
+    return list(iter_payment_bookings(fromdate, tilldate))
+
+
+def iter_payment_bookings(fromdate, tilldate):
+    """
+    generate the bookings of the payments within the date range,
+    ordered by date and document number.
+    the payments and the item kinds of their bills are read
+    with one joined query each.
+    """
     payments = Payment.objects.in_daterange(fromdate, tilldate)
+    rows = payments.order_by('paid_date', 'id').values(*PAYMENT_BOOKING_FIELDS)
+
+    # item kinds of the paid bills (see Bill.item_kinds)
+    kinds_by_bill = defaultdict(list)
+    items = BillItem.objects.filter(bill__in=payments.values('bill_id'))\
+        .order_by('bill_id', 'id').values(
+            'bill_id', 'subscription_part_id',
+            'subscription_part__type__size__product__is_extra', 'custom_item_type__name')
+    for item in items:
+        kinds_by_bill[item['bill_id']].append(item_kind(item))
 
     # global debtor account on settings object
     debtor_account = Settings.objects.first().debtor_account
 
-    bookings = []
-
-    for payment in payments:
+    for row in rows.iterator(chunk_size=ITERATOR_CHUNK_SIZE):
         booking = Booking()
-        bookings.append(booking)
 
-        booking.date = payment.paid_date
+        booking.date = row['paid_date']
 
         # docnumber is DOCNUMBER_OFFSET_PAYMENT + of bill*10 + sequence number of bill item
-        booking.docnumber = str(DOCNUMBER_OFFSET_PAYMENT + payment.id)
+        booking.docnumber = str(DOCNUMBER_OFFSET_PAYMENT + row['id'])
 
-        bill = payment.bill
+        bill_id = row['bill_id']
         # 'Pmt' and 'Bl' are short forms for payment and bill
-        booking.text = "%s %s %d: %s %s" % (_('Pmt'), _('Bl'), bill.id, bill.item_kinds, bill.member)
+        booking.text = "%s %s %d: %s %s" % (
+            _('Pmt'), _('Bl'), bill_id, ', '.join(kinds_by_bill[bill_id]), member_name(row))
 
-        if payment.amount >= 0:
-            booking.price = payment.amount
-            booking.debit_account = payment.type.booking_account
+        if row['amount'] >= 0:
+            booking.price = row['amount']
+            booking.debit_account = row['type__booking_account']
             booking.credit_account = debtor_account
         else:
             # negative amount: exchange accounts and set positive amount
-            booking.price = -payment.amount
+            booking.price = -row['amount']
             booking.debit_account = debtor_account
-            booking.credit_account = payment.type.booking_account
+            booking.credit_account = row['type__booking_account']
 
-        if hasattr(payment.bill.member, "member_account"):
-            booking.member_account = payment.bill.member.member_account.account
-        else:
-            booking.member_account = ""
+        booking.member_account = row['bill__member__member_account__account'] or ""
 
         booking.vat_amount = 0.0
 
-    return bookings
+        yield booking
@@ -0,0 +1,25 @@
+import uuid
+
+from django.core.cache import cache
+
+
+def get_cache_version(version_key):
+    """
+    get the version of a group of cached values.
+    if the version key is not set (or was evicted), a new version is started,
+    so values cached under an earlier version are never served again.
+    """
+    version = cache.get(version_key)
+    if version is None:
+        version = new_cache_version(version_key)
+    return version
+
+
+def new_cache_version(version_key):
+    """
+    start a new version of a group of cached values,
+    invalidating all values cached before.
+    """
+    version = uuid.uuid4().hex
+    cache.set(version_key, version, None)
+    return version
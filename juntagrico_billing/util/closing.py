@@ -0,0 +1,47 @@
+from django.db import transaction
+
+from juntagrico_billing.models.balance import MemberBalance, YearClosing
+from juntagrico_billing.util.billing import compute_memberbalances, get_billing_summary, \
+    store_memberbalances
+from juntagrico_billing.util.summaries import invalidate_summaries
+
+
+def close_business_year(business_year):
+    """
+    close a business year.
+    persists the opening and closing totals of the year
+    and the balances of all members at the end of the year.
+    a closed year can be closed again to update its snapshots.
+    """
+    start_date = business_year.start_date
+    end_date = business_year.end_date
+
+    with transaction.atomic():
+        # totals are computed from the closings of earlier years
+        YearClosing.objects.filter(business_year=business_year).delete()
+
+        summary = get_billing_summary(start_date, end_date)
+        balances = list(compute_memberbalances(end_date))
+
+        closing = YearClosing.objects.create(
+            business_year=business_year,
+            opening_billed=summary['start_billed'],
+            opening_paid=summary['start_payments'],
+            closing_billed=summary['end_billed'],
+            closing_paid=summary['end_payments'])
+
+        # closing balances replace the snapshot of the end date
+        MemberBalance.objects.filter(keydate=end_date).delete()
+        store_memberbalances(end_date, balances, closing)
+
+    # summaries of later years start from the new closing
+    invalidate_summaries()
+    return closing
+
+
+def reopen_business_year(business_year):
+    """
+    reopen a closed business year, deleting its closing snapshots.
+    """
+    YearClosing.objects.filter(business_year=business_year).delete()
+    invalidate_summaries()
@@ -0,0 +1,104 @@
+import csv
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+from juntagrico.util.xls import ExcelWriter
+from xlsxwriter import Workbook
+
+EXCEL_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CSV_CONTENT_TYPE = 'text/csv'
+
+# export formats by name and by media type
+EXPORT_FORMATS = ('xlsx', 'csv')
+EXPORT_MEDIA_TYPES = {
+    EXCEL_CONTENT_TYPE: 'xlsx',
+    CSV_CONTENT_TYPE: 'csv',
+}
+
+
+class Echo(object):
+    """
+    pseudo buffer for the csv writer,
+    handing each written line back instead of storing it.
+    """
+
+    def write(self, value):
+        return value
+
+
+def get_value(item, fieldname):
+    if isinstance(item, dict):
+        return item.get(fieldname, "")
+    return getattr(item, fieldname)
+
+
+def iter_csv(fields, data):
+    """
+    write data as CSV, yielding one line after the other.
+    fields is a list of tuples containing field-name and field-label,
+    data may be any iterable of objects or dictionaries.
+    """
+    writer = csv.writer(Echo())
+    yield writer.writerow([label for _fieldname, label in fields])
+    for item in data:
+        yield writer.writerow([get_value(item, fieldname) for fieldname, _label in fields])
+
+
+def stream_csv(fields, data, download_name):
+    """
+    stream data as CSV file, rows are written as they are produced.
+    """
+    return StreamingHttpResponse(
+        iter_csv(fields, data), content_type=CSV_CONTENT_TYPE,
+        headers={'Content-Disposition': 'attachment; filename="%s.csv"' % download_name})
+
+
+def write_excel(fields, data, outfile):
+    """
+    write data to an excel workbook in constant memory mode.
+    rows are flushed to disk as they are written, so
+    the memory used does not grow with the number of rows.
+    """
+    workbook = Workbook(outfile, {'constant_memory': True})
+    ExcelWriter(fields, workbook).write_data(data)
+    workbook.close()
+
+
+def stream_excel(fields, data, download_name):
+    """
+    write data to a temporary excel file and stream it to the client.
+    """
+    outfile = tempfile.TemporaryFile()
+    write_excel(fields, data, outfile)
+    outfile.seek(0)
+    return FileResponse(
+        outfile, as_attachment=True, filename='%s.xlsx' % download_name,
+        content_type=EXCEL_CONTENT_TYPE)
+
+
+def negotiate_format(request):
+    """
+    determine the export format of a request.
+    an explicit format parameter takes precedence over the accept header,
+    excel is the default.
+    """
+    requested = request.GET.get('format')
+    if requested in EXPORT_FORMATS:
+        return requested
+
+    # first media type of the accept header that we can export to
+    for media_type in request.accepted_types:
+        export_format = EXPORT_MEDIA_TYPES.get('%s/%s' % (media_type.main_type, media_type.sub_type))
+        if export_format:
+            return export_format
+
+    return 'xlsx'
+
+
+def export_response(export_format, fields, data, download_name):
+    """
+    streaming response exporting data in the given format.
+    """
+    if export_format == 'csv':
+        return stream_csv(fields, data, download_name)
+    return stream_excel(fields, data, download_name)
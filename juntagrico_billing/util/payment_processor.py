@@ -1,9 +1,13 @@
 from django.db import IntegrityError, transaction
+from django.db.models import F
+from stdnum.exceptions import ValidationError
 from django.utils.translation import gettext
 from juntagrico.entity.member import Member
 from juntagrico_billing.models.bill import Bill
 from juntagrico_billing.models.payment import Payment, PaymentType
+from juntagrico_billing.util.billing import update_paid_amounts, invalidate_memberbalances
 from juntagrico_billing.util.qrbill import bill_id_from_refnumber
+from juntagrico_billing.util.summaries import invalidate_summaries
 from juntagrico_billing.util.qrbill import member_id_from_refnumber
 from stdnum import iban
 
@@ -40,6 +44,12 @@ class PaymentProcessor(object):
             except Exception:
                 pass
 
+        # in-memory indexes of members and bills,
+        # filled by prefetch while processing payments
+        self.members = None
+        self.bills = None
+        self.open_bills = None
+
     def _(self, text):
         """
         internal translation method.
@@ -79,13 +89,13 @@ class PaymentProcessor(object):
                 self._(msg) % member_id_from_refnumber(paymentinfo.reference))
 
         bill = self.find_bill(paymentinfo)
-        if bill and (bill.member == member):
+        if bill and (bill.member_id == member.id):
             return ('OK', bill)
 
         # consider the most recent open bill of the same member
-        bills = member.bills.filter(paid=False).order_by('-bill_date')
-        if len(bills):
-            return ('OTHER_BILL', bills[0])
+        open_bill = self.find_open_bill(member)
+        if open_bill:
+            return ('OTHER_BILL', open_bill)
 
         msg = 'Payment from member %d can not be imported, because there is no open bill for the member.'
         raise PaymentProcessorError(
@@ -96,6 +106,8 @@ class PaymentProcessor(object):
         find bill by id from reference number
         """
         bill_id = bill_id_from_refnumber(paymentinfo.reference)
+        if self.bills is not None:
+            return self.bills.get(bill_id)
 
         try:
             return Bill.objects.get(id=bill_id)
@@ -107,47 +119,146 @@ class PaymentProcessor(object):
         find member by id from reference number
         """
         member_id = member_id_from_refnumber(paymentinfo.reference)
+        if self.members is not None:
+            return self.members.get(member_id)
 
         try:
             return Member.objects.get(id=member_id)
         except Member.DoesNotExist:
             return None
 
+    def find_open_bill(self, member):
+        """
+        find the most recent open bill of a member
+        """
+        if self.open_bills is not None:
+            return self.open_bills.get(member.id)
+
+        return member.bills.filter(paid=False).order_by('-bill_date').first()
+
     def find_paymenttype(self, paymentinfo):
         return self.payment_types.get(iban.compact(paymentinfo.credit_iban), None)
 
-    def process_payments(self, payments):
+    def prefetch(self, payments):
+        """
+        load the members and bills referenced by the payments
+        and the open bills of these members into in-memory indexes,
+        so checking the payments needs no further queries.
+        """
+        bill_ids = set()
+        member_ids = set()
+        for paymentinfo in payments:
+            try:
+                bill_ids.add(bill_id_from_refnumber(paymentinfo.reference))
+                member_ids.add(member_id_from_refnumber(paymentinfo.reference))
+            except ValidationError:
+                # invalid reference numbers are reported by check_payment
+                pass
+
+        self.members = Member.objects.in_bulk(member_ids)
+        self.bills = Bill.objects.in_bulk(bill_ids)
+
+        # most recent open bill per member
+        self.open_bills = {}
+        open_bills = Bill.objects.filter(member_id__in=member_ids, paid=False)\
+            .order_by('member_id', '-bill_date')
+        for bill in open_bills:
+            self.open_bills.setdefault(bill.member_id, bill)
+
+    def process_payments(self, payments, skip_duplicates=False):
         """
-        process a list of payments.
+        process a list or an iterable of payments.
 
         first check all payments if they are importable.
         the payments are only imported if there are not fatal errors.
+
+        payments that have already been imported are reported all at once,
+        or skipped with skip_duplicates.
+        returns the list of skipped payments.
         """
-        check_results = [self.check_payment(p) for p in payments]
-        self.import_payments([
-            (bill, payments[idx])
-            for idx, (code, bill) in enumerate(check_results)])
+        payments = list(payments)
+
+        duplicates = self.find_duplicates(payments)
+        if duplicates and not skip_duplicates:
+            raise self.duplicates_error(duplicates)
+        skipped = set(map(id, duplicates))
+        payments = [p for p in payments if id(p) not in skipped]
+
+        self.prefetch(payments)
+        try:
+            bills_and_payments = []
+            for payment in payments:
+                code, bill = self.check_payment(payment)
+                bills_and_payments.append((bill, payment))
+        finally:
+            self.members = self.bills = self.open_bills = None
+
+        self.import_payments(bills_and_payments)
+        return duplicates
 
     def import_payments(self, bills_and_payments):
         """
         when import_payments is called, all the payments
         should be importable and associateable to the given bill.
-        we are checking the uniqueness of the imported payments via
-        db constraint.
-        therefore the importing needs to be inside
-        a transaction.
+        the uniqueness of the imported payments is
+        guaranteed by a db constraint.
         we import either all payments or none.
         """
-        with transaction.atomic():
-            for bill, pinfo in bills_and_payments:
-                try:
-                    payment = Payment.objects.create(
+        if not bills_and_payments:
+            return
+
+        try:
+            with transaction.atomic():
+                bill_ids = {bill.id for bill, pinfo in bills_and_payments}
+                # lock the bills, so that concurrent payments on
+                # the same bills are summed up one after the other
+                bills = Bill.objects.select_for_update().filter(id__in=bill_ids)
+                list(bills.values_list('id'))
+
+                Payment.objects.bulk_create([
+                    Payment(
                         bill=bill,
                         type=self.find_paymenttype(pinfo),
                         paid_date=pinfo.date,
                         amount=pinfo.amount,
                         unique_id=pinfo.unique_id)
-                    payment.save()
-                except IntegrityError as err:
-                    msg = 'Payment with unique id %s has already been imported.'
-                    raise PaymentProcessorError(self._(msg) % pinfo.unique_id) from err
+                    for bill, pinfo in bills_and_payments])
+
+                # bulk_create sends no signals, update the paid amounts
+                # and mark fully paid bills as paid
+                update_paid_amounts(bills)
+                bills.filter(paid=False, amount_paid__gte=F('amount')).update(paid=True)
+                invalidate_memberbalances(min(pinfo.date for bill, pinfo in bills_and_payments))
+                invalidate_summaries()
+        except IntegrityError as err:
+            # report the payments that have already been imported
+            duplicates = self.find_duplicates([pinfo for bill, pinfo in bills_and_payments])
+            if duplicates:
+                raise self.duplicates_error(duplicates) from err
+            raise
+
+    def find_duplicates(self, payments):
+        """
+        find the payments that have already been imported
+        or occur more than once, using a single query.
+        """
+        unique_ids = [pinfo.unique_id for pinfo in payments if pinfo.unique_id is not None]
+        existing = set(Payment.objects.filter(unique_id__in=unique_ids)
+                       .values_list('unique_id', flat=True))
+
+        duplicates = []
+        for pinfo in payments:
+            if pinfo.unique_id in existing:
+                duplicates.append(pinfo)
+            elif pinfo.unique_id is not None:
+                existing.add(pinfo.unique_id)
+
+        return duplicates
+
+    def duplicates_error(self, duplicates):
+        if len(duplicates) == 1:
+            msg = 'Payment with unique id %s has already been imported.'
+        else:
+            msg = 'Payments with unique ids %s have already been imported.'
+        return PaymentProcessorError(
+            self._(msg) % ', '.join(pinfo.unique_id for pinfo in duplicates))
@@ -2,6 +2,9 @@ import datetime
 from xml.etree import ElementTree as et
 from juntagrico_billing.util.payment_processor import PaymentInfo
 
+# size of the chunks read from payment files
+CHUNK_SIZE = 64 * 1024
+
 
 class Camt045Reader(object):
     ns = 'urn:iso:std:iso:20022:tech:xsd:camt.054.001.04'
@@ -36,53 +39,108 @@ class Camt045Reader(object):
         return result
 
     def parse_payments(self, xml):
-        results = []
+        """
+        parse all payments of a camt.054 document
+        given as string or bytes.
+        """
+        return list(self.iter_payments(xml))
+
+    def iter_payments(self, source, chunk_size=CHUNK_SIZE):
+        """
+        parse the payments of a camt.054 document incrementally.
+        source is the document as string or bytes, or a file-like object.
+        yields the payments while parsing, processed entries
+        are removed from the tree, so memory usage doesn't depend
+        on the number of entries.
+        """
+        notification_tag = '{%s}Ntfctn' % self.ns
+        entry_tag = '{%s}Ntry' % self.ns
+        container_tag = '{%s}BkToCstmrDbtCdtNtfctn' % self.ns
+
+        # currently open elements, from the root element down
+        stack = []
+        notification_found = False
+        entry_count = 0
+
+        for event, elem in self.iter_events(source, chunk_size):
+            if event == 'start':
+                stack.append(elem)
+                continue
+
+            stack.pop()
+            if elem.tag == notification_tag and len(stack) == 2 and stack[1].tag == container_tag:
+                notification_found = True
+            elif elem.tag == entry_tag and len(stack) == 3 and stack[2].tag == notification_tag:
+                entry_count += 1
+                yield from self.parse_entry(elem)
+                stack[-1].remove(elem)
+
+        if not notification_found:
+            raise PaymentReaderError("element BkToCstmrDbtCdtNtfctn/Ntfctn not found")
+        if not entry_count:
+            raise PaymentReaderError("elements Ntry not found")
+
+    def iter_events(self, source, chunk_size):
+        """
+        feed the source chunkwise to a pull parser
+        and yield the start and end events of the elements.
+        """
+        if isinstance(source, (str, bytes)):
+            chunks = [source]
+        else:
+            chunks = iter(lambda: source.read(chunk_size), source.read(0))
+
+        parser = et.XMLPullParser(events=('start', 'end'))
+        try:
+            for chunk in chunks:
+                parser.feed(chunk)
+                yield from parser.read_events()
+            parser.close()
+            yield from parser.read_events()
+        except et.ParseError as e:
+            raise PaymentReaderError("invalid xml document: %s" % e) from e
+
+    def parse_entry(self, entry):
+        """
+        parse the payments of an entry (Ntry element).
+        """
+        # get valuta date
+        vdate_elem = self.find(entry, "ns:ValDt/ns:Dt")
+        valuta_date = datetime.date.fromisoformat(vdate_elem.text)
+
+        entry_ref = self.find_optional(entry, "ns:NtryRef")
+        if entry_ref is not None:
+            entry_iban = entry_ref.text[:21]
+        else:
+            entry_iban = None
+
+        details = self.findall(entry, 'ns:NtryDtls/ns:TxDtls')
+        for detail in details:
+            amt = self.find(detail, 'ns:Amt')
+            amount = float(amt.text)
+
+            # if there is no global creditor iban, try to find it in the detail
+            if entry_iban:
+                credit_iban = entry_iban
+            else:
+                credit_iban = self.find(
+                    detail, 'ns:RltdPties/ns:CdtrAcct/ns:Id/ns:IBAN').text
 
-        doc = et.fromstring(xml)
-        root = self.find(doc, "./ns:BkToCstmrDbtCdtNtfctn/ns:Ntfctn")
+            refinf = self.find(detail, 'ns:RmtInf/ns:Strd/ns:CdtrRefInf')
+            reftype = self.find(refinf, 'ns:Tp/ns:CdOrPrtry/ns:Prtry')
 
-        entries = self.findall(root, "ns:Ntry")
-        for entry in entries:
-            # get valuta date
-            vdate_elem = self.find(entry, "ns:ValDt/ns:Dt")
-            valuta_date = datetime.date.fromisoformat(vdate_elem.text)
+            ref = self.find(refinf, 'ns:Ref')
 
-            entry_ref = self.find_optional(entry, "ns:NtryRef")
-            if entry_ref is not None:
-                entry_iban = entry_ref.text[:21]
-            else:
-                entry_iban = None
-
-            details = self.findall(entry, 'ns:NtryDtls/ns:TxDtls')
-            for detail in details:
-                amt = self.find(detail, 'ns:Amt')
-                amount = float(amt.text)
-
-                # if there is no global creditor iban, try to find it in the detail
-                if entry_iban:
-                    credit_iban = entry_iban
-                else:
-                    credit_iban = self.find(
-                        detail, 'ns:RltdPties/ns:CdtrAcct/ns:Id/ns:IBAN').text
-
-                refinf = self.find(detail, 'ns:RmtInf/ns:Strd/ns:CdtrRefInf')
-                reftype = self.find(refinf, 'ns:Tp/ns:CdOrPrtry/ns:Prtry')
-
-                ref = self.find(refinf, 'ns:Ref')
-
-                # we use Refs/TxId as unique id
-                id = self.find_optional(detail, 'ns:Refs/ns:InstrId')
-                if id is None:
-                    id = self.find_optional(detail, 'ns:Refs/ns:TxId')
-                if id is None:
-                    raise PaymentReaderError("couldn't find a unique id for payment. No TxId nor InstrId was found.")
-
-                results.append(
-                    PaymentInfo(
-                        valuta_date, credit_iban,
-                        amount, reftype.text, ref.text, id.text))
-
-        return results
+            # we use Refs/TxId as unique id
+            id = self.find_optional(detail, 'ns:Refs/ns:InstrId')
+            if id is None:
+                id = self.find_optional(detail, 'ns:Refs/ns:TxId')
+            if id is None:
+                raise PaymentReaderError("couldn't find a unique id for payment. No TxId nor InstrId was found.")
+
+            yield PaymentInfo(
+                valuta_date, credit_iban,
+                amount, reftype.text, ref.text, id.text)
 
 
 class PaymentReaderError(Exception):
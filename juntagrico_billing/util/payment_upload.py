@@ -0,0 +1,119 @@
+import multiprocessing
+from datetime import timedelta
+from io import BytesIO
+
+from django import db
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from juntagrico_billing.models.payment import PaymentUpload
+from juntagrico_billing.util.payment_processor import PaymentProcessor
+from juntagrico_billing.util.payment_reader import Camt045Reader
+from juntagrico_billing.util.pool import init_worker
+
+# uploads claimed by a run that was interrupted
+# are processed again after this time
+CLAIM_TIMEOUT = timedelta(hours=1)
+
+
+def stage_payment_uploads(files, skip_duplicates=False):
+    """
+    stage uploaded payment files for importing
+    by the process_payment_uploads management command.
+    """
+    return PaymentUpload.objects.bulk_create([
+        PaymentUpload(name=f.name, content=f.read(), skip_duplicates=skip_duplicates)
+        for f in files])
+
+
+def parse_upload(upload_id):
+    """
+    parse the payments of a staged payment file.
+    returns the list of payments and an error message
+    if the file could not be read.
+    used as worker function of the process pool,
+    so the file is only loaded by the process parsing it.
+    """
+    try:
+        content = PaymentUpload.objects.values_list('content', flat=True).get(id=upload_id)
+        return list(Camt045Reader().iter_payments(BytesIO(content))), None
+    except Exception as e:
+        # any error only fails this file
+        return None, str(e)
+
+
+def iter_parsed_uploads(upload_ids, processes=1):
+    """
+    parse staged payment files, yielding (payments, error) in the order of upload_ids.
+    with more than one process, the files are parsed in parallel by a process pool.
+    """
+    if processes <= 1:
+        for upload_id in upload_ids:
+            yield parse_upload(upload_id)
+        return
+
+    # don't share the database connection with the worker processes
+    db.connections.close_all()
+    with multiprocessing.Pool(processes, initializer=init_worker) as pool:
+        yield from pool.imap(parse_upload, upload_ids)
+
+
+def claim_pending_uploads():
+    """
+    mark the pending uploads as processing and return them, without their content.
+    uploads claimed by a concurrent run are left out,
+    uploads of a run that was interrupted are claimed again after CLAIM_TIMEOUT.
+    """
+    now = timezone.now()
+    PaymentUpload.objects.claimable(now - CLAIM_TIMEOUT).update(status='processing', claimed=now)
+    # the claim time identifies the uploads claimed by this run
+    return list(PaymentUpload.objects.filter(status='processing', claimed=now)
+                .defer('content').order_by('uploaded', 'id'))
+
+
+def process_payment_uploads(processes=1):
+    """
+    import the staged payment files.
+    the files are parsed in parallel, the payments are imported
+    one file after the other, so the paid amounts of bills
+    are updated in order.
+    returns the number of imported and failed files.
+    """
+    uploads = claim_pending_uploads()
+    if not uploads:
+        return 0, 0
+
+    processor = PaymentProcessor()
+    parsed = iter_parsed_uploads([upload.id for upload in uploads], processes)
+
+    done = failed = 0
+    for upload, (payments, error) in zip(uploads, parsed):
+        if error is None:
+            try:
+                skipped = processor.process_payments(payments, upload.skip_duplicates)
+                upload.status = 'done'
+                upload.imported_count = len(payments) - len(skipped)
+                upload.skipped_count = len(skipped)
+                upload.message = _("Payments file %s successfully imported.") % upload.name
+                if skipped:
+                    upload.message += '\n' + _(
+                        "%d payments were skipped, because they have already been imported.") % len(skipped)
+            except Exception as e:
+                # any error only fails this file, the other files are still imported
+                error = _("Failed to process payments in file %s:\n%s") % (upload.name, e)
+        else:
+            error = _("Failed to read payments file %s:\n%s") % (upload.name, error)
+
+        if error is None:
+            done += 1
+        else:
+            upload.status = 'failed'
+            upload.message = error
+            failed += 1
+
+        # the bank data is not kept after processing
+        upload.content = None
+        upload.processed = timezone.now()
+        upload.save()
+
+    return done, failed
@@ -1,4 +1,5 @@
 import datetime
+from django.core.cache import cache
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import cm
@@ -8,7 +9,7 @@ from django.utils.translation import gettext as _
 from juntagrico.config import Config
 from juntagrico_billing.config import Config as BillingConfig
 from juntagrico_billing.models.settings import Settings
-from juntagrico_billing.util.qrbill import get_qrbill_svg
+from juntagrico_billing.util.qrbill import get_cached_qrbill_svg, qrbill_cache_key, QRBILL_CACHE_TIMEOUT
 from svglib.svglib import SvgRenderer
 from lxml import etree
 
@@ -232,16 +233,27 @@ class PdfBillRenderer(object):
         settings = Settings.objects.first()
 
         payment_type = settings.default_paymenttype
-        qr_svg = get_qrbill_svg(bill, payment_type)
-        svg_element = etree.fromstring(qr_svg)
-
-        renderer = SvgRenderer("")
 
         # save payslip drawing and
         # offset bottom margin
-        self.qrpayslip_drawing = renderer.render(svg_element)
+        self.qrpayslip_drawing = self.get_payslip_drawing(bill, payment_type)
         self.bottom_margin = self.qrpayslip_drawing.height
 
+    def get_payslip_drawing(self, bill, payment_type):
+        """
+        get the reportlab drawing of the payslip from the cache.
+        on a cache miss the QR-Bill svg is converted to a drawing.
+        """
+        key = qrbill_cache_key(bill, payment_type, 'drawing')
+        drawing = cache.get(key)
+        if drawing is None:
+            qr_svg = get_cached_qrbill_svg(bill, payment_type)
+            svg_element = etree.fromstring(qr_svg)
+            drawing = SvgRenderer("").render(svg_element)
+            cache.set(key, drawing, QRBILL_CACHE_TIMEOUT)
+
+        return drawing
+
     def draw_payslip(self, canvas, document):
         """
         page draw function for drawing the payslip
@@ -0,0 +1,107 @@
+import multiprocessing
+import zipfile
+from io import BytesIO
+
+from django import db
+from pypdf import PdfReader, PdfWriter
+
+from juntagrico_billing.models.bill import Bill
+from juntagrico_billing.util.pdfbill import PdfBillRenderer
+from juntagrico_billing.util.pool import init_worker
+
+
+def bill_pdf_filename(bill_id):
+    return "Rechnung %d.pdf" % bill_id
+
+
+def render_bill_pdf(bill_id):
+    """
+    render a single bill as PDF.
+    returns the bill id and the PDF document as bytes.
+    used as worker function of the process pool.
+    """
+    bill = Bill.objects.with_display_data().get(pk=bill_id)
+    outfile = BytesIO()
+    PdfBillRenderer().render(bill, outfile)
+    return bill_id, outfile.getvalue()
+
+
+def iter_bill_pdfs(bill_ids, processes=1):
+    """
+    render bills as PDFs, yielding (bill_id, pdf bytes) in the order of bill_ids.
+    with more than one process, bills are rendered in parallel by a process pool.
+    """
+    if processes <= 1:
+        for bill_id in bill_ids:
+            yield render_bill_pdf(bill_id)
+        return
+
+    # don't share the database connection with the worker processes
+    db.connections.close_all()
+    with multiprocessing.Pool(processes, initializer=init_worker) as pool:
+        yield from pool.imap(render_bill_pdf, bill_ids, chunksize=4)
+
+
+class StreamBuffer(object):
+    """
+    unseekable file-like object collecting written data,
+    until it is taken out with pop().
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_bills_zip(bill_ids, processes=1):
+    """
+    render bills as PDFs into a ZIP archive.
+    yields the archive in chunks, one chunk per bill,
+    so only the current document is held in memory.
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for bill_id, pdf in iter_bill_pdfs(bill_ids, processes):
+            archive.writestr(bill_pdf_filename(bill_id), pdf)
+            yield buffer.pop()
+
+    # central directory of the archive
+    yield buffer.pop()
+
+
+def iter_bills_merged(bill_ids, batch_size=None, processes=1):
+    """
+    render bills into PDF documents for printing,
+    with up to batch_size bills each (all bills in one document by default).
+    yields the documents as bytes, one after the other,
+    so only the pages of the current document are held in memory.
+    """
+    writer = PdfWriter()
+    count = 0
+    for _bill_id, pdf in iter_bill_pdfs(bill_ids, processes):
+        writer.append(PdfReader(BytesIO(pdf)))
+        count += 1
+        if count == batch_size:
+            yield pdf_bytes(writer)
+            writer = PdfWriter()
+            count = 0
+
+    if count or not bill_ids:
+        yield pdf_bytes(writer)
+
+
+def pdf_bytes(writer):
+    outfile = BytesIO()
+    writer.write(outfile)
+    return outfile.getvalue()
@@ -0,0 +1,10 @@
+import django
+
+
+def init_worker():
+    """
+    initialize a worker process of a process pool.
+    with the spawn start method, django needs to be set up
+    in the new process.
+    """
+    django.setup()
@@ -0,0 +1,106 @@
+from datetime import date
+from decimal import Decimal
+
+from django.core.cache import cache
+from juntagrico.entity.subtypes import SubscriptionType
+
+from juntagrico_billing.util.cache import get_cache_version, new_cache_version
+
+# cache key of the version used for invalidating all price tables
+PRICE_TABLE_VERSION_KEY = 'juntagrico_billing_price_table_version'
+
+# price tables expire after 5 minutes. the invalidation on price changes
+# only reaches other processes, if they share the cache (e.g. memcached or redis),
+# otherwise they pick up the new prices when their tables expire.
+PRICE_TABLE_CACHE_TIMEOUT = 60 * 5
+
+
+class PriceTable(object):
+    """
+    Prices of all subscription types for a date interval
+    (usually a business year).
+    The billing periods of the types are resolved to concrete dates
+    and day counts once, so scaling the price of a subscription part
+    needs no database queries.
+    """
+
+    def __init__(self, fromdate, tilldate):
+        self.fromdate = fromdate
+        self.tilldate = tilldate
+        self.days = (tilldate - fromdate).days + 1
+
+        # dictionary of type id -> (type price, has periods, list of resolved periods)
+        self.types = {}
+        for stype in SubscriptionType.objects.prefetch_related('periods'):
+            all_periods = stype.periods.all()
+            periods = []
+            for period in all_periods:
+                period_start = date(fromdate.year, period.start_month, period.start_day)
+                period_end = date(fromdate.year, period.end_month, period.end_day)
+                # only keep periods that overlap with our date interval
+                if period_start <= tilldate and period_end >= fromdate:
+                    full_days = (period_end - period_start).days + 1
+                    periods.append((period_start, period_end, full_days, period.price))
+            self.types[stype.id] = (Decimal(stype.price), len(all_periods) > 0, periods)
+
+    def __contains__(self, type_id):
+        return type_id in self.types
+
+    def part_price(self, part):
+        """
+        scale the price of a subscription part to the date interval.
+        """
+        type_price, has_periods, periods = self.types[part.type_id]
+        activation_date = part.activation_date
+        deactivation_date = part.deactivation_date
+
+        if has_periods:
+            # calculate price based on billing periods.
+            # takes into account periods that overlap with the requested interval.
+            total = Decimal(0)
+            for period_start, period_end, full_days, price in periods:
+                # calculate the resulting start and end of the period that overlaps
+                # with the activation date and our requested date interval
+                eff_start = max(self.fromdate, period_start, activation_date or date.min)
+                eff_end = min(self.tilldate, period_end, deactivation_date or date.max)
+
+                # scale the period price
+                eff_days = (eff_end - eff_start).days + 1
+                total += price * eff_days / full_days
+
+            # round to .05
+            return round(2 * total, 1) / Decimal('2.0')
+
+        # otherwise
+        # calculate price without billing periods.
+        # just scale the subscription type price proportionately
+        if activation_date and activation_date <= self.tilldate:
+            part_start = max(activation_date, self.fromdate)
+            part_end = min(deactivation_date or date.max, self.tilldate)
+            days_part = (part_end - part_start).days + 1
+            return round(2 * type_price * days_part / self.days, 1) / Decimal('2.0')
+
+        return 0
+
+
+def get_price_table(fromdate, tilldate):
+    """
+    get the price table for a date interval from the cache.
+    the table is built on a cache miss.
+    """
+    version = get_cache_version(PRICE_TABLE_VERSION_KEY)
+    key = 'juntagrico_billing_price_table_%s_%s' % (fromdate.isoformat(), tilldate.isoformat())
+
+    table = cache.get(key, version=version)
+    if table is None:
+        table = PriceTable(fromdate, tilldate)
+        cache.set(key, table, PRICE_TABLE_CACHE_TIMEOUT, version=version)
+
+    return table
+
+
+def invalidate_price_tables():
+    """
+    invalidate all cached price tables.
+    """
+    new_cache_version(PRICE_TABLE_VERSION_KEY)
@@ -1,4 +1,6 @@
+import hashlib
 from decimal import Decimal, ROUND_HALF_UP
+from django.core.cache import cache
 from qrbill.bill import QRBill
 from stdnum.ch.esr import calc_check_digit, validate, compact
 import stdnum.iban
@@ -6,6 +8,10 @@ from lxml import etree
 from io import StringIO
 from juntagrico.config import Config
 
+# rendered qr bills are cached under a key derived from their content,
+# so they never need to be invalidated and are just evicted by the cache backend.
+QRBILL_CACHE_TIMEOUT = 60 * 60 * 24 * 30
+
 
 def is_qr_iban(iban):
     """
@@ -109,3 +115,38 @@ def get_qrbill_svg(bill, paymenttype):
     svg_bytes = modify_svg_fill(svg_bytes, 'none')
 
     return svg_bytes.decode('utf8')
+
+
+def qrbill_cache_key(bill, paymenttype, kind):
+    """
+    cache key of a rendered qr bill.
+    derived from everything that is printed on the payment part:
+    bill id and member id (making up the reference number), open amount,
+    IBAN, creditor and debtor address.
+    """
+    addr = Config.organisation_address()
+    member = bill.member
+    content = '|'.join(str(value) for value in (
+        bill.id, bill.member_id,
+        Decimal(bill.amount_open).quantize(Decimal('.01'), ROUND_HALF_UP),
+        stdnum.iban.compact(paymenttype.iban),
+        addr['name'], addr['street'], addr['number'], addr['zip'], addr['city'],
+        member.first_name, member.last_name,
+        member.addr_street, member.addr_zipcode, member.addr_location,
+    ))
+    address_hash = hashlib.sha256(content.encode('utf8')).hexdigest()
+    return 'juntagrico_billing_qrbill_%s_%s' % (kind, address_hash)
+
+
+def get_cached_qrbill_svg(bill, paymenttype):
+    """
+    Get the QR-Bill payment part as SVG from the cache,
+    generating it on a cache miss.
+    """
+    key = qrbill_cache_key(bill, paymenttype, 'svg')
+    qr_svg = cache.get(key)
+    if qr_svg is None:
+        qr_svg = get_qrbill_svg(bill, paymenttype)
+        cache.set(key, qr_svg, QRBILL_CACHE_TIMEOUT)
+
+    return qr_svg
@@ -0,0 +1,180 @@
+from collections import defaultdict
+
+from django.db import transaction
+from juntagrico.entity.subs import SubscriptionPart
+
+from juntagrico_billing.models.bill import BillItem
+from juntagrico_billing.util.bill_totals import bill_changed, deferred_bill_totals
+from juntagrico_billing.util.billing import scale_subscriptionpart_price
+
+
+class BillChanges(object):
+    """
+    changes of the subscription part items of a bill,
+    computed by the recalculation of its business year.
+    """
+
+    def __init__(self, bill):
+        self.bill = bill
+        self.old_amount = bill.amount
+        self.amount = 0.0
+        self.inserted = []
+        self.updated = []
+        self.deleted = []
+
+    @property
+    def items_changed(self):
+        return bool(self.inserted or self.updated or self.deleted)
+
+    @property
+    def amount_changed(self):
+        return round(self.amount, 2) != round(self.old_amount, 2)
+
+
+def recalc_business_year(business_year, bills=None, dry_run=False):
+    """
+    recalculate bills of a business year in one pass (all bills of the year by default).
+    each bill gets the subscription parts of its member that are not on
+    another bill of the year. the parts, the billed parts of the year and
+    the current items are loaded once, so the number of queries doesn't
+    depend on the number of bills.
+    only the differing items are inserted, updated or deleted.
+    with dry_run, the changes are computed but not written.
+    returns the changes of all recalculated bills.
+    """
+    if bills is None:
+        bills = business_year.bills.select_related('member')
+    # parts not billed yet go to the first bill of a member with several bills
+    bills = sorted(bills, key=lambda bill: bill.id)
+    if not bills:
+        return []
+
+    start_date = business_year.start_date
+    end_date = business_year.end_date
+
+    # active subscription parts of the members
+    parts_per_member = defaultdict(list)
+    parts = SubscriptionPart.objects.in_daterange(start_date, end_date)\
+        .filter(subscription__primary_member__in={bill.member_id for bill in bills})\
+        .select_related('subscription', 'type__size__product')
+    for part in parts:
+        parts_per_member[part.subscription.primary_member_id].append(part)
+
+    # index of the bills of the year per subscription part,
+    # kept up to date while the bills are recalculated
+    part_bills = defaultdict(set)
+    billed_parts = BillItem.objects.filter(bill__business_year=business_year, subscription_part__isnull=False)
+    for part_id, bill_id in billed_parts.values_list('subscription_part_id', 'bill_id'):
+        part_bills[part_id].add(bill_id)
+
+    # current items of the bills
+    items_per_bill = defaultdict(list)
+    for item in BillItem.objects.filter(bill__in=[bill.id for bill in bills]).order_by('id'):
+        items_per_bill[item.bill_id].append(item)
+
+    changes = []
+    for bill in bills:
+        bill_changes = BillChanges(bill)
+
+        # existing subscription part items, other items are kept as they are
+        part_items = {}
+        for item in items_per_bill[bill.id]:
+            item.bill = bill
+            if item.subscription_part_id is None:
+                bill_changes.amount += item.amount
+            elif item.subscription_part_id in part_items:
+                # part billed twice on the same bill
+                bill_changes.deleted.append(item)
+            else:
+                part_items[item.subscription_part_id] = item
+
+        for part in parts_per_member[bill.member_id]:
+            if part_bills[part.id] - {bill.id}:
+                # part is on another bill of the year
+                continue
+
+            price = float(scale_subscriptionpart_price(part, start_date, end_date))
+            description = str(part.type)
+            item = part_items.pop(part.id, None)
+            if item is None:
+                item = BillItem(bill=bill, subscription_part=part, amount=price, description=description)
+                item.calc_vat_amount()
+                bill_changes.inserted.append(item)
+                part_bills[part.id].add(bill.id)
+            else:
+                current = (item.amount, item.description, item.vat_amount)
+                item.subscription_part = part
+                item.amount = price
+                item.description = description
+                item.calc_vat_amount()
+                if (item.amount, item.description, item.vat_amount) != current:
+                    bill_changes.updated.append(item)
+            bill_changes.amount += price
+
+        # parts no longer on this bill
+        for part_id, item in part_items.items():
+            bill_changes.deleted.append(item)
+            part_bills[part_id].discard(bill.id)
+
+        changes.append(bill_changes)
+
+    if not dry_run:
+        apply_bill_changes(changes)
+
+    return changes
+
+
+def apply_bill_changes(changes):
+    """
+    write the item changes of recalculated bills with bulk operations.
+    the totals of the changed bills are recomputed once per bill,
+    when the transaction is committed.
+    """
+    inserted = [item for bill_changes in changes for item in bill_changes.inserted]
+    updated = [item for bill_changes in changes for item in bill_changes.updated]
+    deleted = [item.id for bill_changes in changes for item in bill_changes.deleted]
+    changed_amounts = {bill_changes.bill.id for bill_changes in changes if bill_changes.amount_changed}
+
+    with transaction.atomic(), deferred_bill_totals():
+        if deleted:
+            BillItem.objects.filter(id__in=deleted).delete()
+        BillItem.objects.bulk_create(inserted)
+        BillItem.objects.bulk_update(updated, ['amount', 'description', 'vat_amount'], batch_size=1000)
+
+        # bulk operations send no signals, register the bills
+        # with changed amounts for the recomputation of their totals
+        for item in inserted + updated:
+            if item.bill_id in changed_amounts:
+                bill_changed(item)
+
+    # totals of the bill objects in memory
+    for bill_changes in changes:
+        if bill_changes.items_changed:
+            bill = bill_changes.bill
+            bill.amount = bill_changes.amount
+            bill.amount_open = bill.amount - bill.amount_paid
+
+
+def recalc_bills(bills, dry_run=False):
+    """
+    recalculate a set of bills, with one pass per business year.
+    returns the changes of all recalculated bills.
+    """
+    bills_per_year = defaultdict(list)
+    for bill in bills:
+        bills_per_year[bill.business_year].append(bill)
+
+    changes = []
+    with transaction.atomic():
+        for business_year, year_bills in bills_per_year.items():
+            changes += recalc_business_year(business_year, year_bills, dry_run)
+
+    return changes
+
+
+def recalc_bill(bill):
+    """
+    update an existing bill with all items that are not
+    on another bill in the same businessyear.
+    """
+    recalc_business_year(bill.business_year, [bill])
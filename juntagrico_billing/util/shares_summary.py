@@ -1,24 +1,27 @@
 from juntagrico.entity.share import Share
-from django.db.models import Sum
+from django.db.models import Q, Sum
 from decimal import Decimal
 
 def get_shares_summary(start_date, end_date):
     """
     Get a summary of share paid and paid back between start_date and end_date,
     with balances at start_date and end_date.
+    all totals are summed up in a single query using conditional aggregation.
     """
-    shares = Share.objects.all()
+    shares = Share.objects.filter(Q(paid_date__lte=end_date) | Q(payback_date__lte=end_date))
 
-    start_paid = shares.filter(paid_date__lt=start_date).aggregate(total=Sum('value'))['total'] or Decimal('0.0')
-    start_paid_back = shares.filter(payback_date__lt=start_date).aggregate(total=Sum('value'))['total'] or Decimal('0.0')
-    start_balance = start_paid - start_paid_back
+    totals = shares.aggregate(
+        start_paid=Sum('value', filter=Q(paid_date__lt=start_date)),
+        start_paid_back=Sum('value', filter=Q(payback_date__lt=start_date)),
+        end_paid=Sum('value', filter=Q(paid_date__lte=end_date)),
+        end_paid_back=Sum('value', filter=Q(payback_date__lte=end_date)))
+    totals = {key: value or Decimal('0.0') for key, value in totals.items()}
 
-    end_paid = shares.filter(paid_date__lte=end_date).aggregate(total=Sum('value'))['total'] or Decimal('0.0')
-    end_paid_back = shares.filter(payback_date__lte=end_date).aggregate(total=Sum('value'))['total'] or Decimal('0.0')
-    end_balance = end_paid - end_paid_back
+    start_balance = totals['start_paid'] - totals['start_paid_back']
+    end_balance = totals['end_paid'] - totals['end_paid_back']
 
     return {
         'range_balance': end_balance - start_balance,
         'start_balance': start_balance,
         'end_balance': end_balance,
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,34 @@
+from django.core.cache import cache
+
+from juntagrico_billing.util.cache import get_cache_version, new_cache_version
+
+# cache key of the version used for invalidating all cached summaries
+SUMMARY_VERSION_KEY = 'juntagrico_billing_summary_version'
+
+# summaries expire after 5 minutes. the invalidation on bookings
+# only reaches other processes, if they share the cache (e.g. memcached or redis),
+# otherwise they pick up the changes when their summaries expire.
+SUMMARY_CACHE_TIMEOUT = 60 * 5
+
+
+def get_cached_summary(name, fromdate, tilldate, summarize):
+    """
+    get a summary for a date range from the cache.
+    the summary is computed with summarize(fromdate, tilldate) on a cache miss.
+    """
+    version = get_cache_version(SUMMARY_VERSION_KEY)
+    key = 'juntagrico_billing_summary_%s_%s_%s' % (name, fromdate.isoformat(), tilldate.isoformat())
+
+    summary = cache.get(key, version=version)
+    if summary is None:
+        summary = summarize(fromdate, tilldate)
+        cache.set(key, summary, SUMMARY_CACHE_TIMEOUT, version=version)
+
+    return summary
+
+
+def invalidate_summaries():
+    """
+    invalidate all cached summaries.
+    """
+    new_cache_version(SUMMARY_VERSION_KEY)
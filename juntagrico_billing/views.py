@@ -1,35 +1,58 @@
 from datetime import date, timedelta
+from itertools import chain
 
 from django import forms
 from django.contrib.auth.decorators import permission_required, login_required
 from django.contrib.messages import success, error
 from django.core.exceptions import PermissionDenied
+from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
 from django.template.loader import get_template
 from django.urls import reverse
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from juntagrico.util import return_to_previous_location
 from juntagrico.util.temporal import start_of_business_year, \
     start_of_next_business_year
-from juntagrico.util.xls import generate_excel
 from juntagrico_billing.models.bill import BusinessYear, Bill
 from juntagrico_billing.models.settings import Settings
-from juntagrico_billing.mailer import send_bill_notification
+from juntagrico_billing.mailer import queue_bill_notifications, MAX_ATTEMPTS
+from juntagrico_billing.models.notification import BillNotification
 from juntagrico_billing.util.billing import get_billable_subscription_parts, \
     group_billables_by_member, create_bills_for_items, get_open_bills, \
-    scale_subscriptionpart_price, recalc_bill, get_unpublished_bills, \
+    scale_subscriptionpart_price, get_unpublished_bills, \
     publish_bills, export_memberbalance_sheet, get_billing_summary
-from juntagrico_billing.util.qrbill import get_qrbill_svg
+from juntagrico_billing.util.qrbill import get_cached_qrbill_svg
+from juntagrico_billing.util.recalc import recalc_bill
 from juntagrico_billing.util.pdfbill import PdfBillRenderer
+from juntagrico_billing.util.pdfbulk import iter_bills_zip
 from juntagrico_billing.util.bookings import get_bill_bookings, \
-    get_payment_bookings
+    get_payment_bookings, iter_bill_bookings, iter_payment_bookings
+from juntagrico_billing.util.export import export_response, negotiate_format
 from juntagrico_billing.util.shares_summary import get_shares_summary
+from juntagrico_billing.util.summaries import get_cached_summary
 from juntagrico_billing.util.bexio_exporter import BexioExporter
 from juntagrico_billing.util.bexio_api import BexioApiClient
+from juntagrico_billing.util.bexio_ledger import BexioLedger
 from django.utils.translation import gettext as _
 
 
+# number of bills per page on the open bills list
+OPEN_BILLS_PAGE_SIZE = 100
+
+# sort orders on the open bills list
+OPEN_BILLS_ORDERING = {
+    'id': ('id',),
+    'member': ('member__last_name', 'member__first_name', 'id'),
+    'date': ('bill_date', 'id'),
+    'amount': ('amount', 'id'),
+    'amount_open': ('amount_open', 'id'),
+}
+
+# number of threads sending bookings to bexio
+BEXIO_EXPORT_WORKERS = 4
+
+
 @permission_required('juntagrico.is_book_keeper')
 def open_bills(request):
     """
@@ -37,7 +60,7 @@ def open_bills(request):
     """
     business_years, selected_year = get_years_and_selected(request)
 
-    bills_list = []
+    bills_page = None
     percent_paid = 100
 
     # determine view state (all, open, open75, open50, open25)
@@ -47,21 +70,34 @@ def open_bills(request):
     # array to set active tab state in template
     state_active = [(state == st and 'active') or '' for st in states]
 
+    # determine sort order, default is open amount descending
+    order = request.GET.get('order', '-amount_open')
+    if order.lstrip('-') not in OPEN_BILLS_ORDERING:
+        order = '-amount_open'
+    order_fields = OPEN_BILLS_ORDERING[order.lstrip('-')]
+    if order.startswith('-'):
+        order_fields = ['-' + field for field in order_fields]
+
     if selected_year:
         percent_str = state[4:]
         if percent_str:
             percent_paid = int(percent_str)
-        bills_list = get_open_bills(selected_year, percent_paid)
+        bills = get_open_bills(selected_year, percent_paid)\
+            .with_display_data().order_by(*order_fields)
+        paginator = Paginator(bills, OPEN_BILLS_PAGE_SIZE)
+        bills_page = paginator.get_page(request.GET.get('page'))
 
     renderdict = {
         'business_years': business_years,
         'selected_year': selected_year,
-        'bills_list': bills_list,
+        'bills_list': bills_page or [],
+        'bills_page': bills_page,
         'percent_paid': percent_paid,
         'email_form_disabled': True,
         'change_date_disabled': True,
         'state': state,
-        'state_active': state_active
+        'state_active': state_active,
+        'order': order,
     }
 
     return render(request, "jb/open_bills.html", renderdict)
@@ -162,7 +198,7 @@ def unpublished_bills(request):
     Show bills that are not published (not yet
     visible to members)
     """
-    bills_list = get_unpublished_bills()
+    bills_list = get_unpublished_bills().with_display_data()
 
     renderdict = {
         'bills_list': bills_list,
@@ -233,20 +269,27 @@ def bookings_export(request):
         bill_bookings = []
         payment_bookings = []
 
-    # export button pressed and date fields OK -> do excel export
+    # export button pressed and date fields OK -> do excel or csv export
     if ('export' in request.POST) and daterange_form.is_valid():
         return export_bookings(
             bill_bookings + payment_bookings, "bookings")
 
+    if ('export_csv' in request.POST) and daterange_form.is_valid():
+        return export_bookings(
+            bill_bookings + payment_bookings, "bookings", 'csv')
+
     # export to bexio
     if ('export_bexio' in request.POST) and daterange_form.is_valid():
         token = request.POST['bexio_token']
         if token:
             api_client = BexioApiClient(token)
-            exporter = BexioExporter(api_client, fromdate, tilldate)
-            result, message = exporter.export_bookings(bill_bookings + payment_bookings)
-            if result:
+            exporter = BexioExporter(api_client, fromdate, tilldate, BexioLedger(), BEXIO_EXPORT_WORKERS)
+            result, message = exporter.export_bookings(
+                bill_bookings + payment_bookings, 'bexio_full_sync' in request.POST)
+            if result and not result['failed']:
                 success(request, f"{_('Export to Bexio successful')}.\n{result['created']} created\n{result['updated']} updated\n{result['deleted']} deleted")
+            elif result:
+                error(request, f"{_('Export to Bexio failed')}.\n{result['created']} created\n{result['updated']} updated\n{result['deleted']} deleted\n{result['failed']} failed\n{message}")
             else:
                 error(request, f"{_('Export to Bexio failed')}.\n {message}")
         else:
@@ -263,7 +306,27 @@ def bookings_export(request):
     return render(request, 'jb/bookings_export.html', renderdict)
 
 
-def export_bookings(bookings, filename):
+@permission_required('juntagrico.is_book_keeper')
+def bookings_download(request):
+    """
+    Download the bookings of a date range as excel or csv file.
+    the format is taken from the format parameter or the accept header,
+    bookings are written to the response while they are read from the database.
+    """
+    daterange_form = DateRangeForm(request.GET)
+    if not daterange_form.is_valid():
+        return HttpResponseBadRequest(daterange_form.errors.as_text())
+
+    fromdate = daterange_form.cleaned_data['fromdate']
+    tilldate = daterange_form.cleaned_data['tilldate']
+    bookings = chain(iter_bill_bookings(fromdate, tilldate),
+                     iter_payment_bookings(fromdate, tilldate))
+    filename = 'bookings_{}_{}'.format(fromdate, tilldate)
+
+    return export_bookings(bookings, filename, negotiate_format(request))
+
+
+def export_bookings(bookings, filename, export_format='xlsx'):
     fields = {
         'date': 'Datum',
         'docnumber': 'Belegnummer',
@@ -275,7 +338,7 @@ def export_bookings(bookings, filename):
         'vat_amount': "MWST"
     }
 
-    return generate_excel(fields.items(), bookings, filename)
+    return export_response(export_format, fields.items(), bookings, filename)
 
 
 class KeyDateForm(forms.Form):
@@ -288,7 +351,7 @@ class KeyDateForm(forms.Form):
 @permission_required('juntagrico.is_book_keeper')
 def memberbalance_export(request):
     """
-    Export member balances as excel file, specifying the key date
+    Export member balances as excel or csv file, specifying the key date
     """
     # determine end of last year as default key date
     last_year = date.today() - timedelta(days=365)
@@ -303,8 +366,8 @@ def memberbalance_export(request):
     else:
         keydate_form = KeyDateForm(default_date)
 
-    # export button pressed and date fields OK -> do excel export
-    if ('export' in request.GET) and keydate_form.is_valid():
+    # export button pressed or format requested and date fields OK -> do export
+    if ('export' in request.GET or 'format' in request.GET) and keydate_form.is_valid():
         keydate = keydate_form.cleaned_data['keydate']
         return export_memberbalance_sheet(request, keydate)
 
@@ -338,8 +401,8 @@ def accounting_summary(request):
     if daterange_form.is_valid():
         fromdate = daterange_form.cleaned_data['fromdate']
         tilldate = daterange_form.cleaned_data['tilldate']
-        billing = get_billing_summary(fromdate, tilldate)
-        shares = get_shares_summary(fromdate, tilldate)
+        billing = get_cached_summary('billing', fromdate, tilldate, get_billing_summary)
+        shares = get_cached_summary('shares', fromdate, tilldate, get_shares_summary)
     else:
         fromdate = None
         tilldate = None
@@ -361,7 +424,7 @@ def user_bills(request):
     member = request.user.member
     settings = Settings.objects.first()
     renderdict = {
-        'bills': Bill.objects.of_member(member).published().order_by("-bill_date"),
+        'bills': Bill.objects.of_member(member).published().with_display_data().order_by("-bill_date"),
         'paymenttype': settings.default_paymenttype,
         'menu': {'bills': 'active'},
     }
@@ -371,7 +434,7 @@ def user_bills(request):
 @login_required
 def user_bill(request, bill_id):
     member = request.user.member
-    bill = get_object_or_404(Bill, id=bill_id)
+    bill = get_object_or_404(Bill.objects.with_display_data(), id=bill_id)
 
     # only allow for bookkepper or the bills member
     if not (request.user.has_perms(('juntagrico.is_book_keeper',)) or bill.member == member):
@@ -381,7 +444,7 @@ def user_bill(request, bill_id):
 
     # add QR-Bill part
     if bill.amount_open > 0:
-        qr_svg = get_qrbill_svg(bill, settings.default_paymenttype)
+        qr_svg = get_cached_qrbill_svg(bill, settings.default_paymenttype)
     else:
         qr_svg = None
 
@@ -402,7 +465,7 @@ def user_bill(request, bill_id):
 @login_required
 def user_bill_pdf(request, bill_id):
     member = request.user.member
-    bill = get_object_or_404(Bill, id=bill_id)
+    bill = get_object_or_404(Bill.objects.with_display_data(), id=bill_id)
 
     # only allow for bookkeeper or the bills member
     if not (request.user.has_perms(('juntagrico.is_book_keeper',)) or bill.member == member):
@@ -417,24 +480,50 @@ def user_bill_pdf(request, bill_id):
     return response
 
 
+@permission_required('juntagrico.is_book_keeper')
+def bills_pdf_export(request):
+    """
+    Download all published bills of the selected year
+    as PDFs in a ZIP archive.
+    The archive is streamed while the bills are rendered.
+    """
+    business_years, selected_year = get_years_and_selected(request)
+    if selected_year is None:
+        return redirect(reverse('jb:open-bills-list'))
+
+    bill_ids = list(
+        selected_year.bills.published()
+        .order_by('member__last_name', 'member__first_name', 'id')
+        .values_list('id', flat=True))
+
+    filename = "Rechnungen %s.zip" % selected_year.name
+    response = StreamingHttpResponse(iter_bills_zip(bill_ids), content_type='application/zip')
+    response['Content-Disposition'] = \
+        "attachment; filename=\"" + filename + "\""
+    return response
+
+
 @permission_required('juntagrico.is_book_keeper')
 def bills_notify(request):
     """
-    List of bills to send notification e-mails
+    List of bills to send notification e-mails.
+    The e-mails are only queued here, they are sent
+    by the send_bill_notifications management command.
     """
-    bills_list = list(Bill.objects.filter(notification_sent=False))
+    bills = Bill.objects.filter(notification_sent=False)
 
     if request.method == 'POST':
-        for bill in bills_list:
-            send_bill_notification(bill)
-            bill.notification_sent = True
-            bill.save()
-
+        count = queue_bill_notifications(bills)
+        success(request, _('%d billing notifications queued for sending.') % count)
         return return_to_previous_location(request)
 
+    bills_list = list(bills.with_display_data())
+
     renderdict = {
         'bills_list': bills_list,
         'bills_count': len(bills_list),
+        'queued_count': BillNotification.objects.pending(MAX_ATTEMPTS).count(),
+        'failed_count': BillNotification.objects.failed(MAX_ATTEMPTS).filter(bill__notification_sent=False).count(),
         'email_form_disabled': True,
         'change_date_disabled': True,
     }
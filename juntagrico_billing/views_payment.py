@@ -1,10 +1,13 @@
 from django import forms
-from django.utils.translation import gettext as _
+from django.utils.translation import gettext as _, gettext_lazy
 from django.contrib.auth.decorators import permission_required
-from django.contrib.messages import success, error
+from django.contrib.messages import success
 from django.shortcuts import render, redirect
-from juntagrico_billing.util.payment_processor import PaymentProcessor, PaymentProcessorError
-from juntagrico_billing.util.payment_reader import Camt045Reader, PaymentReaderError
+from juntagrico_billing.models.payment import PaymentUpload
+from juntagrico_billing.util.payment_upload import stage_payment_uploads
+
+# number of uploads shown on the status page
+PAYMENT_UPLOADS_SHOWN = 50
 
 
 class UploadFileForm(forms.Form):
@@ -13,44 +16,39 @@ class UploadFileForm(forms.Form):
         'class': 'form-control-file',
         'multiple': True
     })
+    skip_duplicates = forms.BooleanField(
+        label=gettext_lazy('Skip payments that have already been imported'),
+        required=False)
 
 
 @permission_required('juntagrico.is_book_keeper')
 def payments_upload(request):
     """
     show upload form for importing payment-files.
+    the files are staged and imported in the background.
     """
     if request.method == 'POST':
         form = UploadFileForm(request.POST, request.FILES)
         if form.is_valid():
-            for f in request.FILES.getlist('file'):
-                ok, message = handle_payments_upload(f)
-                if ok:
-                    success(request, message)
-                else:
-                    error(request, message)
-            return redirect('jb:payments-upload')
+            uploads = stage_payment_uploads(
+                request.FILES.getlist('file'),
+                form.cleaned_data['skip_duplicates'])
+            success(request, _("%d payment files queued for importing.") % len(uploads))
+            return redirect('jb:payments-uploads')
     else:
         form = UploadFileForm()
 
     return render(request, 'jb/payments_upload.html', {'form': form})
 
 
-def handle_payments_upload(f):
-    reader = Camt045Reader()
-    processor = PaymentProcessor()
-
-    try:
-        payments = reader.parse_payments(f.read())
-        processor.process_payments(payments)
-    except PaymentReaderError as e:
-        message = _("Failed to read payments file %s:\n%s") % (f.name, e)
-        return (False, message)
-    except PaymentProcessorError as e:
-        message = _("Failed to process payments in file %s:\n%s") % (f.name, e)
-        return (False, message)
-
-    return (
-        True,
-        _("Payments file %s successfully imported.") % f.name
-    )
+@permission_required('juntagrico.is_book_keeper')
+def payments_uploads(request):
+    """
+    show the import status of the recently uploaded payment-files.
+    """
+    uploads = PaymentUpload.objects.defer('content').order_by('-uploaded', '-id')[:PAYMENT_UPLOADS_SHOWN]
+
+    return render(request, 'jb/payments_uploads.html', {
+        'uploads': uploads,
+        'in_progress': any(upload.status in ('pending', 'processing') for upload in uploads),
+    })